@@ -0,0 +1,181 @@
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from database.config import Config
+from metrics import Counter, Gauge
+
+"""
+Ограничение числа одновременных запросов по классам маршрутов.
+
+У каждого класса (write- записи в MongoDB, read- чтение из MongoDB,
+cpu- только валидация) свой лимит одновременных запросов и своя очередь
+ожидания ограниченной длины. Запрос, которому не хватило места в очереди
+или который не дождался своей очереди за отведенное время, сразу получает
+503 с Retry-After (views.handle_exceptions), а не ждет бесконечно, занимая
+поток и замедляя остальные маршруты.
+"""
+
+ROUTE_CLASSES = ("write", "read", "cpu")
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight", "Requests being processed", ("route_class",))
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth", "Requests waiting for a slot", ("route_class",))
+ADMISSION_SHED = Counter(
+    "admission_shed_total", "Requests rejected by admission control",
+    ("route_class", "reason"))
+
+
+class Overloaded(Exception):
+    """
+    Запрос отклонен: очередь класса заполнена или время ожидания истекло.
+    """
+
+    def __init__(self, route_class, reason, retry_after):
+        super().__init__(f"Too many '{route_class}' requests ({reason})")
+        self.retry_after = retry_after
+
+
+class Limiter:
+    """
+    Счетчики и параметры одного класса маршрутов, общие для
+    потокового и асинхронного вариантов.
+
+    :args:
+        name (str): Класс маршрутов
+        limit (int): Запросов одновременно
+        queue_size (int): Запросов в ожидании
+        timeout_ms (int): Сколько запрос ждет своей очереди
+    """
+
+    def __init__(self, name, limit, queue_size, timeout_ms):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout_ms / 1000
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "timeout": 0}
+
+    def reject(self, reason):
+        self.shed[reason] += 1
+        ADMISSION_SHED.inc(1, self.name, reason)
+        return Overloaded(self.name, reason, Config.ADMISSION_RETRY_AFTER)
+
+    def entered(self):
+        self.in_flight += 1
+        self.admitted += 1
+        ADMISSION_IN_FLIGHT.inc(1, self.name)
+
+    def left(self):
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.dec(1, self.name)
+
+    def queued(self, amount):
+        self.waiting += amount
+        ADMISSION_QUEUE_DEPTH.inc(amount, self.name)
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "timeout_ms": int(self.timeout * 1000),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+        }
+
+
+class AdmissionLimiter(Limiter):
+    """
+    Ограничитель для потоков (views.py).
+
+    Очередь- FIFO: освободившееся место передается первому ожидающему,
+    новый запрос не может занять его раньше тех, кто уже ждет.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    @contextmanager
+    def slot(self):
+        """
+        :exception:
+            Overloaded, если место не освободилось
+        """
+        ticket = None
+        with self._lock:
+            if self.in_flight < self.limit and not self._waiters:
+                self.entered()
+            elif self.waiting >= self.queue_size:
+                raise self.reject("queue_full")
+            else:
+                ticket = threading.Event()
+                self._waiters.append(ticket)
+                self.queued(1)
+
+        if ticket is not None and not ticket.wait(self.timeout):
+            with self._lock:
+                # Место могли передать уже после истечения времени
+                if not ticket.is_set():
+                    self._waiters.remove(ticket)
+                    self.queued(-1)
+                    raise self.reject("timeout")
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.left()
+                if self._waiters and self.in_flight < self.limit:
+                    # Место переходит первому в очереди уже занятым
+                    self.queued(-1)
+                    self.entered()
+                    self._waiters.popleft().set()
+
+
+class AsyncAdmissionLimiter(Limiter):
+    """
+    Ограничитель для одного event loop (async_views.py).
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._semaphore = asyncio.Semaphore(self.limit)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.queue_size:
+                raise self.reject("queue_full")
+            self.queued(1)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                raise self.reject("timeout") from None
+            finally:
+                self.queued(-1)
+        else:
+            await self._semaphore.acquire()
+        self.entered()
+        try:
+            yield
+        finally:
+            self.left()
+            self._semaphore.release()
+
+
+def create_limiters(limiter_class):
+    """
+    Ограничители для всех классов маршрутов из Config.ADMISSION_*
+
+    :returns:
+        dict: { "<класс>": limiter_class }, пустой, если ограничение выключено
+    """
+    if not Config.ADMISSION_ENABLED:
+        return {}
+    return {name: limiter_class(name, *Config.ADMISSION_LIMITS[name]) for name in ROUTE_CLASSES}
@@ -0,0 +1,17 @@
+from quart import Quart
+from async_views import async_views_blueprint
+
+"""
+Асинхронный вариант приложения (Quart + AsyncMongoClient).
+Запуск: hypercorn async_app:app --bind 0.0.0.0:5000
+"""
+
+app = Quart(__name__)
+
+
+# Импортируем и регистрируем Blueprint -> async_views.py
+app.register_blueprint(async_views_blueprint, url_prefix='/')
+
+
+if __name__ == '__main__':
+    app.run(debug=True, host="0.0.0.0")
@@ -0,0 +1,637 @@
+import asyncio
+import os
+import tempfile
+import time
+from quart import Blueprint, Response, request, jsonify, make_response
+from validators import validate_email, validate_phone, validate_date, validator_cache_stats, validate_batch, validate_ndjson, parse_template, parse_templates, classify_form
+from database import async_operations as db
+from database.config import Config
+from database.queries import TEMPLATE_FIELDS, INDEX_FIELDS
+from snapshot import SnapshotWriter
+from matching import index_entries, batch_results, forms_keys, match_forms_buckets
+from caching import MISSING
+from coherence import ADDED, RESET
+from profiling import PROFILE_HEADER, start_profile
+from admission import AsyncAdmissionLimiter
+from logging_form import logger
+from metrics import current_route, stage, render as render_metrics, start_snapshot_writer, worker_id, WORKER_HEADER
+from view_support import (ViewState, error_response, request_route, log_failed_request, record_request,
+                          value_result, batch_error, parse_ndjson, created_result, bulk_result, form_result,
+                          json_line, json_body, output_format, listing_args, not_modified, tagged,
+                          listing_key, listing_body, page_result)
+from functools import wraps
+
+"""
+Асинхронный вариант views.py для async_app. Кэши, разбор параметров
+и тела ответов общие с синхронным приложением (view_support), здесь
+только обработчики запросов и обращения к MongoDB через async_operations.
+"""
+
+async_views_blueprint = Blueprint('async_views', __name__)
+
+# Индекс шаблонов, кэши и ограничители процесса
+state = ViewState(AsyncAdmissionLimiter)
+
+
+async def reload_caches(generation):
+    """
+    Перезагружает все кэши процесса из базы данных, см. views.reload_caches.
+    Индекс строится в отдельном потоке, цикл событий продолжает обслуживать запросы.
+    """
+    templates = await db.find_templates_after().to_list()
+    await asyncio.to_thread(state.load_templates, templates, generation)
+
+
+async def warm_caches():
+    """
+    Первая загрузка кэшей после подключения, см. views.warm_caches
+    """
+    generation = await db.get_generation_state()
+    if not state.load_snapshot(generation):
+        await reload_caches(generation)
+
+
+async def reload_in_background(generation):
+    """
+    Полная перезагрузка индекса фоновой задачей, см. views.reload_in_background
+    """
+    try:
+        await reload_caches(generation)
+    except Exception as e:
+        logger.warning(f" Не удалось перезагрузить кэши: {e} ")
+    finally:
+        state.end_reload()
+
+
+# Фоновые задачи подключения к базе данных и перезагрузки кэшей
+connect_task = None
+reload_task = None
+
+
+@async_views_blueprint.before_app_serving
+async def connect_database():
+    """
+    Запускает подключение к MongoDB фоновой задачей, приложение
+    начинает принимать запросы сразу, см. views.connect_database
+    """
+    global connect_task
+    connect_task = asyncio.create_task(db.connect(on_ready=[warm_caches]))
+    start_snapshot_writer()
+
+
+@async_views_blueprint.before_request
+async def check_generation():
+    """
+    Сверка поколения данных до обработки запроса, см. views.check_generation
+    """
+    global reload_task
+    if not state.check_due():
+        return
+    try:
+        generation = await db.get_generation_state()
+        changes = state.changes(generation)
+        if changes == ADDED:
+            templates = await db.find_templates_after(state.templates_since()).to_list()
+            state.load_added(templates, generation)
+        elif changes == RESET and state.begin_reload():
+            reload_task = asyncio.create_task(reload_in_background(generation))
+    except Exception as e:
+        logger.warning(f" Не удалось проверить поколение данных: {e} ")
+
+
+@async_views_blueprint.after_request
+async def tag_worker(response):
+    """
+    Номер воркера в заголовке X-Worker, см. views.tag_worker
+    """
+    response.headers[WORKER_HEADER] = worker_id()
+    return response
+
+
+@async_views_blueprint.after_app_serving
+async def close_database():
+    for task in (connect_task, reload_task):
+        if task is not None:
+            task.cancel()
+    await db.close()
+
+
+def log_requests_and_responses(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        route = request_route(request)
+        token = current_route.set(route)
+        profile = start_profile(route, request.headers)
+        started = time.perf_counter()
+        try:
+            if profile is None:
+                response = await func(*args, **kwargs)
+            else:
+                response = await profile.run_async(func, *args, **kwargs)
+        except Exception as e:
+            log_failed_request(request, e)
+            raise
+        finally:
+            current_route.reset(token)
+        if profile is not None:
+            response = await make_response(response)
+            response.headers[PROFILE_HEADER] = profile.report(request.method, response.status_code)
+        record_request(request, route, response, started)
+        return response
+    return wrapper
+
+
+def handle_exceptions(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            body, status, headers = error_response(e)
+            return jsonify(body), status, headers
+    return wrapper
+
+
+def admit(route_class):
+    """
+    Декоратор ограничения одновременных запросов, см. views.admit
+    """
+    def decorator(func):
+        limiter = state.limiters.get(route_class)
+        if limiter is None:
+            return func
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with limiter.slot():
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def match_form(result_form):
+    """
+    Поиск подходящего шаблона через match_cache, см. views.match_form
+    """
+    lookup = state.lookup([result_form])
+    if lookup.missed:
+        lookup.fill([await find_template(result_form)])
+    return lookup.names[0]
+
+
+async def match_forms(result_forms):
+    """
+    Поиск шаблонов для списка форм через match_cache, см. views.match_forms
+    """
+    lookup = state.lookup(result_forms)
+    if lookup.missed:
+        lookup.fill(await find_templates(lookup.missed_forms))
+    return lookup.names
+
+
+async def find_template(result_form):
+    """
+    Поиск подходящего шаблона, см. views.find_template.
+    """
+    if Config.MATCH_ENGINE == "aggregate":
+        return await db.match_template(result_form)
+    if Config.MATCH_ENGINE != "index":
+        return state.memory_index().match(result_form)
+    return await db.match_index(result_form)
+
+
+async def find_templates(result_forms):
+    """
+    Поиск шаблонов для списка форм, см. views.find_templates
+    """
+    if Config.MATCH_ENGINE == "aggregate":
+        return list(await asyncio.gather(*(db.match_template(result_form) for result_form in result_forms)))
+    if Config.MATCH_ENGINE != "index":
+        template_index = state.memory_index()
+        return [template_index.match(result_form) for result_form in result_forms]
+    return match_forms_buckets(result_forms, await db.find_templates_by_keys(forms_keys(result_forms)))
+
+
+async def validate_value(name, message, validator):
+    body, status = value_result(await request.get_json(), name, message, validator)
+    return jsonify(body), status
+
+
+@async_views_blueprint.route('/validate/email', methods=['POST'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("cpu")
+async def validate_email_route():
+    """
+    Эндпоинт для проверки валидности email-адреса, см. views.validate_email_route
+    """
+    return await validate_value("email", "Email is required", validate_email)
+
+
+@async_views_blueprint.route('/validate/phone', methods=['POST'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("cpu")
+async def validate_phone_route():
+    """
+    Эндпоинт для проверки валидности номера телефона, см. views.validate_phone_route
+    """
+    return await validate_value("phone", "Phone number is required", validate_phone)
+
+
+@async_views_blueprint.route('/validate/date', methods=['POST'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("cpu")
+async def validate_date_route():
+    """
+    Эндпоинт для проверки валидности даты, см. views.validate_date_route
+    """
+    return await validate_value("date", "Date is required", validate_date)
+
+
+async def body_lines(body):
+    """
+    Строки тела запроса (request.body) по мере получения.
+    """
+    pending = b""
+    async for chunk in body:
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            yield line
+    yield pending
+
+
+async def stream_validation(kind, lines):
+    """
+    Отдает результаты пакета NDJSON частями, см. views.stream_validation
+    """
+    seen = {}
+    chunk = []
+    async for line in lines:
+        if line.strip():
+            chunk.append(line)
+        if len(chunk) >= Config.STREAM_BATCH_SIZE:
+            yield validate_ndjson(kind, chunk, seen)
+            chunk = []
+    if chunk:
+        yield validate_ndjson(kind, chunk, seen)
+
+
+@async_views_blueprint.route('/validate/<any(email, phone, date):kind>/batch', methods=['POST'])
+@async_views_blueprint.route('/validate/classify', methods=['POST'], defaults={"kind": "classify"})
+@log_requests_and_responses
+@handle_exceptions
+@admit("cpu")
+async def validate_batch_route(kind):
+    """
+    Эндпоинт для проверки сразу многих значений, см. views.validate_batch_route
+    """
+    if request.mimetype == "application/x-ndjson":
+        return Response(stream_validation(kind, body_lines(request.body)), mimetype="application/x-ndjson")
+
+    values = await request.get_json()
+    error = batch_error(values)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    with stage("validation"):
+        results = validate_batch(kind, values)
+    with stage("serialization"):
+        return jsonify(results)
+
+
+@async_views_blueprint.route('/validate/cache', methods=['GET'])
+@log_requests_and_responses
+@handle_exceptions
+async def validate_cache_route():
+    """
+    Эндпоинт со счетчиками кэша валидаторов.
+    """
+    return jsonify(validator_cache_stats())
+
+
+@async_views_blueprint.route('/match/cache', methods=['GET'])
+@log_requests_and_responses
+@handle_exceptions
+async def match_cache_route():
+    """
+    Эндпоинт со счетчиками кэша результатов подбора шаблона, см. views.match_cache_route
+    """
+    return jsonify(state.match_cache_stats())
+
+
+@async_views_blueprint.route('/admission', methods=['GET'])
+@log_requests_and_responses
+@handle_exceptions
+async def admission_route():
+    """
+    Эндпоинт с состоянием ограничителей одновременных запросов, см. views.admission_route
+    """
+    return jsonify(state.admission_stats())
+
+
+@async_views_blueprint.route('/clear_db', methods=['POST'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("write")
+async def clear_db():
+    """
+    Эндпоинт для очистки базы данных.
+    """
+    state.cleared(await db.clear_database())
+    return jsonify({"message": "Database cleared successfully"}), 200
+
+
+async def stream_documents(cursor):
+    """
+    Отдает документы курсора по одному в строке (NDJSON).
+    """
+    async for document in cursor:
+        yield json_line(document)
+
+
+async def stream_raw_documents(cursor):
+    """
+    Отдает байты BSON документов курсора подряд, см. views.stream_raw_documents
+    """
+    async for document in cursor:
+        yield document.raw
+
+
+def json_response(value):
+    return Response(json_body(value), mimetype="application/json")
+
+
+async def all_documents(get_all, find_page, projection):
+    if projection is None:
+        return await get_all()
+    return await find_page(None, None, projection).to_list()
+
+
+async def cached_listing(get_all, find_page, projection):
+    """
+    Весь список JSON, тело готовится один раз на поколение, см. views.cached_listing
+    """
+    listing_cache = state.listing_cache
+    key, compress = listing_key(request)
+    version = listing_cache.version
+    body = listing_cache.get(key)
+    if body is MISSING:
+        body = listing_body(await all_documents(get_all, find_page, projection), compress)
+        listing_cache.put_if_current(key, body, version)
+
+    response = Response(body, mimetype="application/json")
+    if compress:
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+async def list_documents(get_all, find_page, allowed_fields):
+    """
+    Общая выдача для /templates и /indexes, см. views.list_documents
+    """
+    try:
+        after, limit, projection = listing_args(request, allowed_fields)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    output = output_format(request)
+
+    generation = state.listing_generation()
+    if not_modified(request, generation):
+        return tagged(Response("", status=304), generation)
+
+    if output == "bson":
+        cursor = find_page(after, limit, projection, raw=True)
+        return tagged(Response(stream_raw_documents(cursor), mimetype="application/bson"), generation)
+
+    if output == "ndjson":
+        return tagged(Response(stream_documents(find_page(after, limit, projection)),
+                               mimetype="application/x-ndjson"), generation)
+
+    if after is None and limit is None:
+        if generation is not None:
+            return tagged(await cached_listing(get_all, find_page, projection), generation)
+        documents = await all_documents(get_all, find_page, projection)
+        with stage("serialization"):
+            return json_response(documents)
+
+    limit = limit or Config.PAGE_SIZE
+    documents = await find_page(after, limit, projection).to_list()
+    with stage("serialization"):
+        return tagged(json_response(page_result(documents, limit)), generation)
+
+
+@async_views_blueprint.route('/templates', methods=['GET'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("read")
+async def get_templates():
+    """
+    Эндпоинт для получения всех шаблонов.
+    """
+    return await list_documents(db.get_all_form_templates, db.find_form_templates, TEMPLATE_FIELDS)
+
+
+@async_views_blueprint.route('/indexes', methods=['GET'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("read")
+async def get_indexes():
+    """
+    Эндпоинт для получения всех индексов.
+    """
+    return await list_documents(db.get_all_form_indexes, db.find_form_indexes, INDEX_FIELDS)
+
+
+@async_views_blueprint.route('/create_template', methods=['POST'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("write")
+async def create_template():
+    """
+    Эндпоинт для создания нового шаблона, см. views.create_template
+    """
+    data = await request.get_json()
+    with stage("validation"):
+        template, warnings, error = parse_template(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    template_id = await db.create_form_template(dict(template))
+    generation = await db.build_indexes(index_entries(template, template_id))
+    state.templates_added([template], [template_id], generation)
+
+    return jsonify(created_result(template, template_id, warnings)), 201
+
+
+@async_views_blueprint.route('/create_templates/bulk', methods=['POST'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("write")
+async def create_templates_bulk():
+    """
+    Эндпоинт для создания сразу нескольких шаблонов, см. views.create_templates_bulk
+    """
+    if request.mimetype == "application/x-ndjson":
+        try:
+            items = parse_ndjson(await request.get_data(as_text=True))
+        except ValueError as e:
+            return jsonify({"error": "Invalid NDJSON", "message": str(e)}), 400
+    else:
+        items = await request.get_json()
+
+    if not items or not isinstance(items, list):
+        return jsonify({"error": "Template list is required"}), 400
+
+    with stage("validation"):
+        templates, results = parse_templates(items)
+    if not templates:
+        return jsonify({"error": "No valid templates", "templates": results}), 400
+
+    template_ids = await db.create_form_templates([dict(template) for template in templates])
+    generation = await db.build_indexes([entry for template, template_id in zip(templates, template_ids)
+                                         for entry in index_entries(template, template_id)])
+
+    state.templates_added(templates, template_ids, generation)
+
+    return jsonify(bulk_result(templates, template_ids, results)), 201
+
+
+@async_views_blueprint.route('/get_form', methods=['POST'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("read")
+async def get_form():
+    """
+    Эндпоинт для поиска подходящего шаблона по полям формы, см. views.get_form
+    """
+    form_fields = await request.get_json()
+    if not form_fields:
+        return jsonify({"error": "Form fields are required"}), 400
+
+    with stage("validation"):
+        result_form = classify_form(form_fields)
+
+    with stage("matching"):
+        potential_template_name = await match_form(result_form)
+
+    with stage("serialization"):
+        body, status = form_result(result_form, potential_template_name)
+        return jsonify(body), status
+
+
+@async_views_blueprint.route('/get_form/batch', methods=['POST'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("read")
+async def get_form_batch():
+    """
+    Эндпоинт для поиска шаблонов сразу для списка форм, см. views.get_form_batch
+    """
+    forms = await request.get_json()
+    if not forms or not isinstance(forms, list):
+        return jsonify({"error": "Form list is required"}), 400
+
+    with stage("validation"):
+        result_forms = [classify_form(form) for form in forms
+                        if form and isinstance(form, dict)]
+    with stage("matching"):
+        template_names = await match_forms(result_forms)
+    with stage("serialization"):
+        return jsonify(batch_results(forms, result_forms, template_names))
+
+
+@async_views_blueprint.route('/metrics', methods=['GET'])
+@handle_exceptions
+async def metrics_route():
+    """
+    Эндпоинт с метриками, см. views.metrics_route
+    """
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+async def read_chunks(file, size=1 << 20):
+    """
+    Читает файл частями в потоке, не блокируя event loop.
+    """
+    try:
+        while chunk := await asyncio.to_thread(file.read, size):
+            yield chunk
+    finally:
+        file.close()
+
+
+async def document_batches(cursor):
+    """
+    Документы курсора пачками по Config.SNAPSHOT_BATCH_SIZE.
+    """
+    while batch := await cursor.to_list(Config.SNAPSHOT_BATCH_SIZE):
+        yield batch
+
+
+async def export_snapshot(path, generation):
+    """
+    Пишет снимок, читая коллекции пачками: запись файла идет в потоке,
+    в памяти не больше одной пачки документов, см. snapshot.SnapshotWriter
+
+    :returns:
+        str: Id снимка
+    """
+    writer = await asyncio.to_thread(SnapshotWriter, path)
+    try:
+        async for batch in document_batches(db.find_documents(Config.MONGO_COLLECTION_NAME)):
+            await asyncio.to_thread(writer.add_templates, batch)
+        async for batch in document_batches(db.find_documents(Config.INDEX_COLLECTION_NAME, raw=True)):
+            await asyncio.to_thread(writer.add_indexes, batch)
+        return await asyncio.to_thread(writer.close, generation)
+    except BaseException:
+        await asyncio.to_thread(writer.abort)
+        raise
+
+
+@async_views_blueprint.route('/snapshot', methods=['GET'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("read")
+async def snapshot_route():
+    """
+    Эндпоинт для выгрузки снимка шаблонов и индексов, см. views.snapshot_route
+    """
+    generation = await db.get_generation()
+    descriptor, path = tempfile.mkstemp(suffix=".snapshot")
+    os.close(descriptor)
+    try:
+        snapshot_id = await export_snapshot(path, generation)
+        # Файл удаляется сразу, ответ читает его через открытый дескриптор
+        file = open(path, "rb")
+    finally:
+        os.remove(path)
+    await db.mark_snapshot(generation, snapshot_id)
+    return Response(read_chunks(file), mimetype="application/octet-stream",
+                    headers={"Content-Disposition": "attachment; filename=templates.snapshot"})
+
+
+@async_views_blueprint.route('/healthz', methods=['GET'])
+async def healthz():
+    """
+    Проверка живости процесса, см. views.healthz
+    """
+    if db.STATUS == "failed":
+        return jsonify({"status": "failed"}), 503
+    return jsonify({"status": "ok"})
+
+
+@async_views_blueprint.route('/readyz', methods=['GET'])
+async def readyz():
+    """
+    Проверка готовности принимать запросы, см. views.readyz
+    """
+    loaded = state.template_index.loaded
+    if db.STATUS != "ready" or not loaded:
+        return jsonify({"status": db.STATUS, "caches": loaded}), 503
+    try:
+        await db.get_database().command("ping")
+    except Exception as e:
+        return jsonify({"status": "unavailable", "message": str(e)}), 503
+    return jsonify({"status": "ready"})
@@ -0,0 +1,263 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from validators import validate_field
+from database.queries import group_bucket_entries
+from matching import TemplateIndex, match_buckets, form_buckets, index_entries
+
+"""
+Микробенчмарки валидаторов и подбора шаблона, без сервера и MongoDB.
+
+Запуск:
+    python benchmark.py --update-baseline    # записать результат как эталон
+    python benchmark.py                      # все случаи, сравнение с benchmark_baseline.json
+    python benchmark.py --quick              # без самых больших размеров
+
+Результат пишется в JSON (--output). Если случай стал медленнее эталона
+больше чем на --tolerance, бенчмарк завершается с кодом 1. Эталон зависит
+от машины и в репозитории не хранится, в CI он снимается с предыдущего коммита.
+"""
+
+SEED = 2024
+
+TEMPLATE_COUNTS = (10, 1_000, 100_000)
+FORM_SIZES = (5, 50, 500)
+VALUES_COUNT = 10_000
+
+# Словарь полей, из которого собираются шаблоны и формы
+FIELD_NAMES_COUNT = 2_000
+FIELD_TYPES = ("email", "phone", "date", "text")
+SAMPLE_VALUES = {
+    "email": "user@example.com",
+    "phone": "+7 999 123 45 67",
+    "date": "01.01.2000",
+    "text": "some text",
+}
+MAX_TEMPLATE_FIELDS = 8
+
+
+# --- Данные ---
+
+def realistic_values(rnd, count):
+    """
+    Значения полей, как в обычных формах: в основном текст,
+    часть email/телефонов/дат, значения повторяются.
+    """
+    pool = ([f"user{i}@example.com" for i in range(50)]
+            + [f"+7 9{i:02d} 123 45 67" for i in range(50)]
+            + [f"{day:02d}.{month:02d}.20{year:02d}" for day, month, year in zip(range(1, 29), range(1, 13), range(50))]
+            + [f"{year}-0{month}-1{day}" for year, month, day in zip(range(1990, 2020), range(1, 10), range(10))]
+            + ["John Doe", "Moscow", "Hello, world", "order #1234", "", "yes", "no", "description of the event"])
+    return [rnd.choice(pool) for _ in range(count)]
+
+
+def adversarial_values(rnd, count):
+    """
+    Неудобные для валидатора значения: уникальные, длинные строки с '@',
+    почти-даты и почти-телефоны, цифры других алфавитов.
+    """
+    generators = [
+        lambda: "a" * rnd.randint(100, 2000) + "@" + "b" * rnd.randint(10, 200),
+        lambda: "x.".join(str(rnd.random()) for _ in range(5)) + "@host",
+        lambda: f"{rnd.randint(0, 99):02d}.{rnd.randint(0, 99):02d}.{rnd.randint(0, 9999):04d}",
+        lambda: f"{rnd.randint(0, 9999):04d}-{rnd.randint(0, 99):02d}-{rnd.randint(0, 99):02d}",
+        lambda: f"+7 {rnd.randint(0, 999):03d} {rnd.randint(0, 999):03d} {rnd.randint(0, 99):02d} {rnd.randint(0, 999)}",
+        lambda: "٠١.٠٢.٢٠٢٤"[:rnd.randint(8, 10)] + str(rnd.randint(0, 9)),
+        lambda: "".join(rnd.choice("0123456789 .-+@") for _ in range(rnd.randint(9, 17))),
+    ]
+    return [rnd.choice(generators)() for _ in range(count)]
+
+
+def field_key(number, field_type):
+    return f"field{number}", field_type
+
+
+def make_templates(rnd, count):
+    templates = []
+    for number in range(count):
+        fields = []
+        names = set()
+        for _ in range(rnd.randint(1, MAX_TEMPLATE_FIELDS)):
+            name, field_type = field_key(rnd.randrange(FIELD_NAMES_COUNT), rnd.choice(FIELD_TYPES))
+            if name not in names:
+                names.add(name)
+                fields.append({"name": name, "type": field_type})
+        templates.append({"name": f"Template {number}", "fields": fields})
+    return templates
+
+
+def make_form(rnd, templates, size):
+    """
+    Форма из полей случайного шаблона, дополненная случайными полями.
+    """
+    form = {field["name"]: field["type"] for field in rnd.choice(templates)["fields"]}
+    while len(form) < size:
+        name, field_type = field_key(rnd.randrange(FIELD_NAMES_COUNT), rnd.choice(FIELD_TYPES))
+        form.setdefault(name, field_type)
+    return dict(list(form.items())[:size])
+
+
+def make_index(templates):
+    """
+    Замена коллекции индексов: ключ "имя+тип" -> корзины в порядке field_count,
+    как их записывает build_indexes. Вместо _id- номер шаблона.
+    """
+    entries = [entry for template_id, template in enumerate(templates)
+               for entry in index_entries(template, template_id)]
+    index = {}
+    for key, field_count, bucket in group_bucket_entries(entries):
+        index.setdefault(key, []).append({"field_count": field_count, "entries": bucket})
+    for buckets in index.values():
+        buckets.sort(key=lambda bucket: bucket["field_count"])
+    return index
+
+
+# --- Замер ---
+
+def measure(func, min_time):
+    """
+    Время одного вызова func в микросекундах: лучшая из 5 серий,
+    каждая серия длится не меньше min_time секунд.
+    """
+    calls = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(calls):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+        calls *= 2 if elapsed < min_time / 10 else max(2, int(min_time / elapsed) + 1)
+
+    best = elapsed
+    for _ in range(4):
+        started = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, time.perf_counter() - started)
+    return {"us_per_op": round(best / calls * 1e6, 3), "calls": calls}
+
+
+def validator_cases(rnd):
+    uncached = getattr(validate_field, "__wrapped__", validate_field)
+    for mix, values in (("realistic", realistic_values(rnd, VALUES_COUNT)),
+                        ("adversarial", adversarial_values(rnd, VALUES_COUNT))):
+        def run(values=values):
+            for value in values:
+                uncached(value)
+
+        def run_cached(values=values):
+            for value in values:
+                validate_field(value)
+
+        # Время на одно значение
+        yield f"validate_field/{mix}", run, len(values)
+        yield f"validate_field/{mix}/cached", run_cached, len(values)
+
+
+def matching_cases(rnd, template_counts, form_sizes):
+    for template_count in template_counts:
+        templates = make_templates(rnd, template_count)
+        index = make_index(templates)
+        memory_index = TemplateIndex()
+        memory_index.load(templates)
+
+        for form_size in form_sizes:
+            forms = [make_form(rnd, templates, form_size) for _ in range(20)]
+
+            def run_index(forms=forms, index=index):
+                for form in forms:
+                    match_buckets(form_buckets(form, index))
+
+            def run_memory(forms=forms, memory_index=memory_index):
+                for form in forms:
+                    memory_index.match(form)
+
+            # Время на одну форму
+            yield f"match/index/{template_count}t/{form_size}f", run_index, len(forms)
+            yield f"match/memory/{template_count}t/{form_size}f", run_memory, len(forms)
+
+
+def run_suite(quick=False, min_time=0.2, only=None):
+    """
+    :returns:
+        dict: { "<случай>": {"us_per_op", "calls"} }
+    """
+    rnd = random.Random(SEED)
+    template_counts = TEMPLATE_COUNTS[:-1] if quick else TEMPLATE_COUNTS
+    form_sizes = FORM_SIZES[:-1] if quick else FORM_SIZES
+
+    results = {}
+    cases = [*validator_cases(rnd), *matching_cases(rnd, template_counts, form_sizes)]
+    for name, func, items in cases:
+        if only and only not in name:
+            continue
+        result = measure(func, min_time)
+        result["us_per_op"] = round(result["us_per_op"] / items, 3)
+        results[name] = result
+        print(f"{name:<40} {result['us_per_op']:>12.3f} us", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Сравнивает результаты с эталоном.
+
+    :returns:
+        list: Случаи, ставшие медленнее эталона больше чем на tolerance:
+              (случай, эталон, сейчас, отношение)
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        ratio = result["us_per_op"] / reference["us_per_op"]
+        if ratio > 1 + tolerance:
+            regressions.append((name, reference["us_per_op"], result["us_per_op"], round(ratio, 2)))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Микробенчмарки валидаторов и подбора шаблона")
+    parser.add_argument("--quick", action="store_true", help="без самых больших размеров")
+    parser.add_argument("--only", help="только случаи, содержащие эту строку")
+    parser.add_argument("--min-time", type=float, default=0.2, help="длительность серии, с")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое замедление, доля")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.quick, args.min_time, args.only)
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+        return 0
+
+    try:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+    except FileNotFoundError:
+        print(f"Эталон {args.baseline} не найден, сравнение пропущено", file=sys.stderr)
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, reference, current, ratio in regressions:
+        print(f"REGRESSION {name}: {reference} -> {current} us (x{ratio})", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import threading
+from collections import OrderedDict
+
+"""
+Кэши в памяти процесса.
+"""
+
+# Значение-маркер промаха, т.к. None тоже может лежать в кэше
+MISSING = object()
+
+
+class LRUCache:
+    """
+    Ограниченный по числу записей кэш с вытеснением давно не используемых.
+    Считает попадания, промахи и вытеснения. Потокобезопасен.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """
+        :returns:
+            Значение из кэша, либо MISSING.
+        """
+        with self._lock:
+            value = self._data.get(key, MISSING)
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._put(key, value)
+
+    def _put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        :returns:
+            dict: Размер кэша и счетчики.
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+
+class VersionedLRUCache(LRUCache):
+    """
+    LRUCache, который сбрасывается целиком при изменении исходных данных.
+
+    Значение, вычисленное до сброса, не должно попасть в кэш после него,
+    поэтому перед вычислением запоминается version, а put_if_current
+    записывает значение, только если сброса за это время не было.
+    """
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.version = 0
+
+    def put_if_current(self, key, value, version):
+        with self._lock:
+            if version == self.version:
+                self._put(key, value)
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._data.clear()
+
+
+class ResponseCache(VersionedLRUCache):
+    """
+    Готовые тела ответов для одного поколения данных (coherence.py).
+
+    Ограничен суммарным размером тел в байтах (capacity), а не числом
+    записей: полный список шаблонов может занимать мегабайты. Тело больше
+    capacity не кэшируется.
+
+    generation- поколение, которому соответствуют данные в базе по
+    последней проверке воркера. После записи в этом воркере оно неизвестно
+    (None), пока GenerationWatcher не прочитает новое значение.
+    """
+
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self.generation = None
+        self.bytes = 0
+
+    def _put(self, key, value):
+        if len(value) > self.capacity:
+            return
+        previous = self._data.pop(key, None)
+        if previous is not None:
+            self.bytes -= len(previous)
+        self._data[key] = value
+        self.bytes += len(value)
+        while self.bytes > self.capacity:
+            _, evicted = self._data.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    def _clear(self):
+        self.version += 1
+        self._data.clear()
+        self.bytes = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def set_generation(self, generation):
+        with self._lock:
+            if generation != self.generation:
+                self._clear()
+                self.generation = generation
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            self.generation = None
+
+    def stats(self):
+        stats = super().stats()
+        stats["bytes"] = self.bytes
+        return stats
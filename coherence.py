@@ -0,0 +1,158 @@
+import threading
+import time
+from datetime import timedelta
+from bson import ObjectId
+
+"""
+Согласование кэшей между воркерами.
+
+Каждая запись в шаблоны или индексы увеличивает счетчик поколений в MongoDB
+(db_operations.bump_generation). Воркер не чаще раза в интервал читает
+счетчик до обработки запроса и, если он изменился, догружает в свой индекс
+шаблоны, созданные после последнего известного ему (RecentTemplates).
+Целиком индекс перестраивается, только если шаблоны удалялись или
+заменялись: очистка базы и восстановление из снимка увеличивают еще и
+счетчик resets. Тогда кэши сбрасываются сразу, а индекс строится в фоне.
+
+Собственные записи воркер добавляет в индекс сразу и запоминает поколение,
+которое вернул bump_generation, поэтому перечитывать их не нужно.
+"""
+
+# Что изменилось с последнего известного поколения, см. GenerationWatcher.compare
+ADDED = "added"
+RESET = "reset"
+
+
+class GenerationWatcher:
+    """
+    Последнее известное воркеру поколение данных и ограничение частоты проверок.
+    """
+
+    def __init__(self, interval_ms):
+        self.interval = interval_ms / 1000
+        self.generation = None
+        self.resets = 0
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def due(self):
+        """
+        Пора ли проверить поколение. Из одновременных вызовов True
+        получает только один, остальные ждут следующего интервала.
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        with self._lock:
+            if now < self._next_check:
+                return False
+            self._next_check = now + self.interval
+            return True
+
+    def compare(self, generation, resets=0):
+        """
+        Сравнивает прочитанное поколение с известным.
+
+        :returns:
+            str: None, если поколение не изменилось или еще не было известно;
+                RESET, если шаблоны с тех пор удалялись или заменялись;
+                иначе ADDED- шаблоны только добавлялись
+        """
+        with self._lock:
+            if self.generation is None or generation == self.generation:
+                return None
+            return RESET if resets != self.resets else ADDED
+
+    def update(self, generation, resets=0):
+        """
+        Запоминает поколение, на котором построены кэши.
+        """
+        with self._lock:
+            self.generation, self.resets = generation, resets
+
+    def advance(self, generation, writes, resets=0):
+        """
+        Запоминает поколение после собственных записей воркера.
+
+        :args:
+            generation (int): Поколение после последней записи
+            writes (int): Сколько раз записи увеличили счетчик
+            resets (int): Из них удалений или замен шаблонов
+
+        :returns:
+            bool: False, если между записями были чужие- тогда поколение
+                не меняется, и их загрузит следующая проверка
+        """
+        with self._lock:
+            if generation is None or self.generation is None or generation != self.generation + writes:
+                return False
+            self.generation = generation
+            self.resets += resets
+            return True
+
+
+def overlap_start(template_id, overlap_s):
+    """
+    :args:
+        template_id (ObjectId): Последний известный шаблон, None- ни одного
+        overlap_s (int): Config.TEMPLATE_ID_OVERLAP_S
+
+    :returns:
+        ObjectId: Шаблоны с большим _id нужно перечитать, см. RecentTemplates;
+            None- все шаблоны
+    """
+    if template_id is None:
+        return None
+    return ObjectId.from_datetime(template_id.generation_time - timedelta(seconds=overlap_s))
+
+
+class RecentTemplates:
+    """
+    Id шаблонов, которые уже есть в индексе воркера, за последние
+    overlap секунд по времени создания в ObjectId.
+
+    ObjectId создает клиент, поэтому шаблоны разных воркеров попадают в базу
+    не строго в порядке _id: шаблон с меньшим _id может быть записан позже
+    уже прочитанного. Поэтому новые шаблоны догружаются начиная с since(),
+    на overlap секунд раньше последнего известного, а уже добавленные
+    пропускаются.
+
+    :args:
+        overlap_s (int): Config.TEMPLATE_ID_OVERLAP_S
+        known (bool): Известно ли, какие шаблоны уже в индексе. Индекс из
+            снимка (snapshot.py) id шаблонов не хранит, и после него при
+            первом изменении индекс перестраивается целиком.
+    """
+
+    def __init__(self, overlap_s, known=True):
+        self.overlap_s = overlap_s
+        self.known = known
+        self._ids = set()
+        self._latest = None
+        self._prune_at = 1000
+
+    def add(self, template_id):
+        """
+        :returns:
+            bool: False, если шаблон уже добавлен
+        """
+        if template_id in self._ids:
+            return False
+        self._ids.add(template_id)
+        if self._latest is None or template_id > self._latest:
+            self._latest = template_id
+        if len(self._ids) > self._prune_at:
+            self._prune()
+        return True
+
+    def since(self):
+        """
+        :returns:
+            ObjectId: Шаблоны с большим _id нужно перечитать, None- все шаблоны
+        """
+        return overlap_start(self._latest, self.overlap_s)
+
+    def _prune(self):
+        since = self.since()
+        self._ids = {template_id for template_id in self._ids if template_id > since}
+        self._prune_at = 2 * len(self._ids) + 1000
@@ -0,0 +1,312 @@
+import asyncio
+from pymongo import AsyncMongoClient, UpdateOne, ReturnDocument, ASCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from database.config import Config
+from database.connection import DatabaseNotReady, retry_delays, client_options, UNIQUE_INDEXES_FAILED, LEGACY_INDEX_FORMAT
+from database.queries import GENERATION_ID, BUCKET_PROJECTION, BUCKET_PUSH_ATTEMPTS, index_key, bucket_push, bucket_entry, bucket_indexes, obsolete_bucket_indexes, template_keys_backfill, BUCKET_LOOKUP_INDEX, LEGACY_BUCKET_FILTER, TEMPLATE_KEYS_INDEX, TEMPLATES_WITHOUT_KEYS, TEMPLATE_KEYS_SOURCE, group_bucket_entries, rejected_buckets, page_query, generation_bump, snapshot_mark, template_keys, match_pipeline, TEMPLATE_PROJECTION, RAW_CODEC_OPTIONS
+from logging_form import logger
+from matching import BucketMatch
+from metrics import timed, templates_scanned
+
+"""
+Асинхронные версии операций из db_operations для async_app.
+Клиент создается в цикле событий приложения, см. connect.
+"""
+
+ASYNC_MONGO_CLIENT = None
+ASYNC_MONGO_DB = None
+# Клиент для чтения, см. database.connection.get_read_database
+ASYNC_READ_CLIENT = None
+ASYNC_READ_DB = None
+# starting -> ready, либо failed, см. database.connection
+STATUS = "starting"
+
+
+async def connect(on_ready=()):
+    """
+    Подключение к MongoDB с повторными попытками и создание индексов
+    коллекции индексов, затем вызов on_ready (прогрев кэшей).
+    Запускается фоновой задачей, см. async_views.connect_database.
+
+    :args:
+        on_ready (iterable): async функции без аргументов
+    """
+    global ASYNC_MONGO_CLIENT, ASYNC_MONGO_DB, ASYNC_READ_CLIENT, ASYNC_READ_DB, STATUS
+
+    ASYNC_MONGO_CLIENT = AsyncMongoClient(Config.MONGO_URI, **client_options(
+        "main", Config.MONGO_MAX_POOL_SIZE, Config.MONGO_READ_PREFERENCE))
+    db = ASYNC_MONGO_CLIENT[Config.MONGO_DB_NAME]
+    if Config.MONGO_READ_CLIENT_ENABLED:
+        ASYNC_READ_CLIENT = AsyncMongoClient(Config.MONGO_URI, **client_options(
+            "read", Config.MONGO_READ_MAX_POOL_SIZE, Config.MONGO_READ_READ_PREFERENCE))
+        ASYNC_READ_DB = ASYNC_READ_CLIENT[Config.MONGO_DB_NAME]
+    delays = retry_delays()
+    while True:
+        try:
+            await db.command("ping")
+            await initialize_indexes(db)
+            ASYNC_MONGO_DB = db
+            logger.info(" Подключение к MongoDB (async) успешно! ")
+            for callback in on_ready:
+                await callback()
+            STATUS = "ready"
+            return
+        except Exception as e:
+            attempt, delay = next(delays, (None, None))
+            if attempt is None:
+                STATUS = "failed"
+                logger.critical(f" Не удалось подключиться к MongoDB: {e} ")
+                return
+            logger.info(f" Ошибка подключения к MongoDB (попытка {attempt}), повтор через {delay:.1f} с: {e} ")
+            await asyncio.sleep(delay)
+
+
+async def initialize_indexes(db):
+    """
+    Индексы коллекций и ключи подбора старым шаблонам, см.
+    database.connection.create_index_indexes и initialize_collection
+    """
+    index = db[Config.INDEX_COLLECTION_NAME]
+    for name in obsolete_bucket_indexes(await index.index_information()):
+        await index.drop_index(name)
+    await index.create_index(BUCKET_LOOKUP_INDEX)
+    try:
+        for keys, options in bucket_indexes():
+            await index.create_index(keys, **options)
+    except OperationFailure as e:
+        logger.warning(UNIQUE_INDEXES_FAILED.format(e))
+    if await index.find_one(LEGACY_BUCKET_FILTER, {"_id": 1}):
+        logger.warning(LEGACY_INDEX_FORMAT)
+
+    templates = db[Config.MONGO_COLLECTION_NAME]
+    backfill = [template_keys_backfill(template)
+                async for template in templates.find(TEMPLATES_WITHOUT_KEYS, TEMPLATE_KEYS_SOURCE)]
+    if backfill:
+        await templates.bulk_write(backfill, ordered=False)
+        logger.info(f" Добавлены ключи подбора шаблонам: {len(backfill)} ")
+    await templates.create_index(TEMPLATE_KEYS_INDEX)
+
+
+def get_database():
+    """
+    См. database.connection.get_database
+    """
+    if ASYNC_MONGO_DB is None:
+        raise DatabaseNotReady("Database is not ready")
+    return ASYNC_MONGO_DB
+
+
+def get_read_database():
+    """
+    См. database.connection.get_read_database
+    """
+    database = get_database()
+    return ASYNC_READ_DB if ASYNC_READ_DB is not None else database
+
+
+async def close():
+    for client in (ASYNC_MONGO_CLIENT, ASYNC_READ_CLIENT):
+        if client is not None:
+            await client.close()
+
+
+async def bump_generation(reset=False):
+    """
+    Увеличивает счетчик поколений данных, см. db_operations.bump_generation
+    """
+    meta = get_database()[Config.META_COLLECTION_NAME]
+    result = await meta.find_one_and_update(*generation_bump(reset=reset), upsert=True,
+                                            return_document=ReturnDocument.AFTER)
+    return result["value"]
+
+
+@timed("mongo")
+async def get_generation():
+    """
+    Текущее поколение данных, 0 если записей еще не было
+    """
+    return (await get_generation_state())["value"]
+
+
+async def get_generation_state():
+    """
+    Поколение и id снимка, см. db_operations.get_generation_state
+    """
+    meta = get_database()[Config.META_COLLECTION_NAME]
+    result = await meta.find_one({"_id": GENERATION_ID}) or {}
+    return {"value": result.get("value", 0), "resets": result.get("resets", 0),
+            "snapshots": result.get("snapshots", [])}
+
+
+@timed("mongo")
+async def mark_snapshot(generation, snapshot_id):
+    """
+    См. db_operations.mark_snapshot
+    """
+    meta = get_database()[Config.META_COLLECTION_NAME]
+    return (await meta.update_one(*snapshot_mark(generation, snapshot_id))).modified_count == 1
+
+
+async def push_entry(index, key, field_count, entry):
+    """
+    Добавляет в корзину одну ссылку на шаблон, см. db_operations.push_entry
+    """
+    for attempt in range(BUCKET_PUSH_ATTEMPTS):
+        try:
+            await index.update_one(*bucket_push(key, field_count, [entry]), upsert=True)
+            return
+        except DuplicateKeyError:
+            if await index.find_one(bucket_entry(key, field_count, entry["id"]), {"_id": 1}):
+                return
+            if attempt == BUCKET_PUSH_ATTEMPTS - 1:
+                raise
+
+
+@timed("mongo")
+async def build_indexes(entries):
+    """
+    Добавляет ссылки на шаблоны в коллекцию индексов, см. db_operations.build_indexes
+    """
+    index = get_database()[Config.INDEX_COLLECTION_NAME]
+
+    buckets = group_bucket_entries(entries)
+    if not buckets:
+        return None
+
+    try:
+        try:
+            await index.bulk_write([UpdateOne(*bucket_push(*bucket), upsert=True) for bucket in buckets],
+                                   ordered=False)
+        except BulkWriteError as e:
+            for key, field_count, bucket_entries in rejected_buckets(buckets, e):
+                for entry in bucket_entries:
+                    await push_entry(index, key, field_count, entry)
+    finally:
+        generation = await bump_generation()
+    return generation
+
+
+@timed("mongo")
+async def match_index(result_form):
+    """
+    Подбор шаблона по корзинам коллекции индексов, см. db_operations.match_index
+    """
+    index = get_read_database()[Config.INDEX_COLLECTION_NAME]
+    keys = [index_key(field_name, field_type) for field_name, field_type in result_form.items()]
+    match = BucketMatch()
+    cursor = index.find({"key": {"$in": keys}}, BUCKET_PROJECTION).sort("field_count", ASCENDING)
+    try:
+        async for bucket in cursor:
+            if not match.add(bucket):
+                break
+    finally:
+        await cursor.close()
+    templates_scanned(match.scanned)
+    return match.name
+
+
+@timed("mongo")
+async def find_templates_by_keys(keys):
+    """
+    Поиск корзин сразу по нескольким ключам "имя+тип" одним запросом,
+    см. db_operations.find_templates_by_keys
+    """
+    index = get_read_database()[Config.INDEX_COLLECTION_NAME]
+    buckets = {}
+    async for bucket in index.find({"key": {"$in": list(keys)}}, BUCKET_PROJECTION).sort("field_count", ASCENDING):
+        buckets.setdefault(bucket["key"], []).append(bucket)
+    return buckets
+
+
+@timed("mongo")
+async def match_template(result_form):
+    """
+    Подбор шаблона одной агрегацией, см. db_operations.match_template
+    """
+    collection = get_read_database()[Config.MONGO_COLLECTION_NAME]
+    async for template in await collection.aggregate(match_pipeline(result_form)):
+        return template["name"]
+    return ""
+
+
+@timed("mongo")
+async def create_form_template(template_data):
+    """
+    Создает новый шаблон
+    """
+    collection = get_database()[Config.MONGO_COLLECTION_NAME]
+    result = await collection.insert_one({**template_data, **template_keys(template_data)})
+    await bump_generation()
+    return result.inserted_id
+
+
+@timed("mongo")
+async def create_form_templates(templates_data):
+    """
+    Создает несколько шаблонов одним запросом
+    """
+    collection = get_database()[Config.MONGO_COLLECTION_NAME]
+    result = await collection.insert_many([{**template, **template_keys(template)} for template in templates_data])
+    await bump_generation()
+    return result.inserted_ids
+
+
+@timed("mongo")
+async def get_all_form_templates():
+    """
+    Возвращает все текущие шаблоны, см. db_operations.get_all_form_templates
+    """
+    collection = get_read_database()[Config.MONGO_COLLECTION_NAME]
+    return await collection.find({}, TEMPLATE_PROJECTION).to_list()
+
+
+@timed("mongo")
+async def get_all_form_indexes():
+    """
+    Возвращает все текущие индексы
+    """
+    collection = get_read_database()[Config.INDEX_COLLECTION_NAME]
+    return await collection.find({}).to_list()
+
+
+def find_documents(collection_name, after=None, limit=None, projection=None, raw=False):
+    """
+    Асинхронный курсор по документам коллекции в порядке _id,
+    см. db_operations.find_documents
+    """
+    collection = get_read_database()[collection_name]
+    if raw:
+        collection = collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+    query, sort = page_query(after)
+    cursor = collection.find(query, projection).sort(sort).batch_size(Config.STREAM_BATCH_SIZE)
+    if limit:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+def find_form_templates(after=None, limit=None, projection=None, raw=False):
+    return find_documents(Config.MONGO_COLLECTION_NAME, after, limit, projection or TEMPLATE_PROJECTION, raw)
+
+
+def find_form_indexes(after=None, limit=None, projection=None, raw=False):
+    return find_documents(Config.INDEX_COLLECTION_NAME, after, limit, projection, raw)
+
+
+def find_templates_after(template_id=None):
+    """
+    Шаблоны после template_id в порядке _id с основного клиента,
+    см. db_operations.find_templates_after
+    """
+    collection = get_database()[Config.MONGO_COLLECTION_NAME]
+    query, sort = page_query(template_id)
+    return collection.find(query, TEMPLATE_PROJECTION).sort(sort)
+
+
+@timed("mongo")
+async def clear_database():
+    """
+    Удаляет все данные из коллекций, связанных с шаблонами и индексами.
+    """
+    await get_database()[Config.MONGO_COLLECTION_NAME].delete_many({})
+    await get_database()[Config.INDEX_COLLECTION_NAME].delete_many({})
+    return await bump_generation(reset=True)
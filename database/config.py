@@ -1,4 +1,35 @@
 import os
+from dotenv import load_dotenv
+
+# Загрузка переменных из .env до чтения конфигурации
+load_dotenv()
+
+
+def optional_int(name):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def thread_share(threads, divisor, minimum=0):
+    return max(threads // divisor, minimum)
+
+
+def connection_share(threads, divisor, pool_size):
+    """
+    Доля потоков, но не больше половины пула MongoClient: запросы write
+    и read, допущенные одновременно, не ждут соединения из пула.
+    """
+    return max(min(threads // divisor, pool_size // 2), 1)
+
+
+def admission_limits(route_class, limit, queue_size, timeout_ms):
+    """
+    (limit, queue_size, timeout_ms) класса маршрутов из ADMISSION_<КЛАСС>_*, см. admission.py
+    """
+    prefix = f"ADMISSION_{route_class.upper()}"
+    return (int(os.getenv(f"{prefix}_LIMIT", limit)),
+            int(os.getenv(f"{prefix}_QUEUE_SIZE", queue_size)),
+            int(os.getenv(f"{prefix}_TIMEOUT_MS", timeout_ms)))
 
 
 class Config:
@@ -8,5 +39,142 @@ class Config:
     MONGO_URI = f'mongodb://{os.getenv("MONGO_DB_URL_CONNECT")}'
     MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'form_templates_db')
     INDEX_COLLECTION_NAME = os.getenv('INDEX_DB_NAME', 'indexes')
+    # Коллекция, в которой rebuild.py строит индексы перед заменой
+    INDEX_REBUILD_COLLECTION_NAME = os.getenv('INDEX_REBUILD_COLLECTION_NAME', 'indexes_rebuild')
+    # Ссылок на шаблоны в одном документе коллекции индексов (queries.bucket_push)
+    INDEX_BUCKET_SIZE = int(os.getenv('INDEX_BUCKET_SIZE', 500))
     MONGO_COLLECTION_NAME = os.getenv('MONGO_COLLECTION_NAME',
                                       'form_templates')
+
+    # Способ поиска шаблона в /get_form:
+    #  memory- индекс шаблонов в памяти процесса (matching.TemplateIndex)
+    #  index- один запрос $in по корзинам ключей формы в коллекции индексов, в порядке
+    #         field_count и с остановкой, когда результат уже не изменится (db_operations.match_index)
+    #  aggregate- одна агрегация по коллекции шаблонов (db_operations.match_template)
+    MATCH_ENGINE = os.getenv('MATCH_ENGINE', 'memory')
+
+    # Кэш результатов подбора шаблона по виду формы (matching.form_signature)
+    MATCH_CACHE_ENABLED = os.getenv('MATCH_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    MATCH_CACHE_SIZE = int(os.getenv('MATCH_CACHE_SIZE', 10000))
+
+    # ETag и готовые тела ответов /templates и /indexes по поколению данных
+    # (views.list_documents). Размер кэша- суммарный размер тел в байтах,
+    # тело больше него не кэшируется
+    LISTING_CACHE_ENABLED = os.getenv('LISTING_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    LISTING_CACHE_MAX_BYTES = int(os.getenv('LISTING_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    # Сжатие тела один раз на поколение, если клиент принимает gzip
+    LISTING_GZIP_ENABLED = os.getenv('LISTING_GZIP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+    # Кэш результатов валидаторов (validators.memoized)
+    VALIDATOR_CACHE_ENABLED = os.getenv('VALIDATOR_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    VALIDATOR_CACHE_SIZE = int(os.getenv('VALIDATOR_CACHE_SIZE', 10000))
+    # Более длинные значения проверяются без кэша
+    VALIDATOR_CACHE_MAX_VALUE_LENGTH = int(os.getenv('VALIDATOR_CACHE_MAX_VALUE_LENGTH', 256))
+    # Значений в одном JSON запросе /validate/<вид>/batch, в NDJSON- без ограничения
+    VALIDATE_BATCH_MAX_SIZE = int(os.getenv('VALIDATE_BATCH_MAX_SIZE', 10000))
+
+    # Постраничная и потоковая выдача /templates и /indexes
+    PAGE_SIZE = int(os.getenv('PAGE_SIZE', 100))
+    MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
+    STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 500))
+
+    # Счетчик поколений данных для сброса кэшей воркеров (coherence.py)
+    META_COLLECTION_NAME = os.getenv('META_COLLECTION_NAME', 'meta')
+    GENERATION_CHECK_INTERVAL_MS = int(os.getenv('GENERATION_CHECK_INTERVAL_MS', 1000))
+    # Догрузка новых шаблонов перечитывает шаблоны, созданные за столько секунд
+    # до последнего известного: ObjectId создают клиенты, и шаблон с меньшим _id
+    # может попасть в базу позже (coherence.RecentTemplates)
+    TEMPLATE_ID_OVERLAP_S = int(os.getenv('TEMPLATE_ID_OVERLAP_S', 10))
+
+    # Логирование (logging_form.py): доля успешных запросов, попадающих
+    # в журнал запросов (0..1), и размер очереди записей
+    LOG_ACCESS_SAMPLE_RATE = float(os.getenv('LOG_ACCESS_SAMPLE_RATE', 1.0))
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    # Файл журнала в папке log, под gunicorn у каждого воркера свой (gunicorn.conf.py)
+    LOG_FILE_NAME = os.getenv('LOG_FILE_NAME', 'service.log')
+
+    # Метрики /metrics (metrics.py)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    # Папка, через которую /metrics собирает метрики всех воркеров, и как часто
+    # воркер сохраняет в нее свои. Пусто- только метрики процесса, под gunicorn
+    # по умолчанию log/metrics (gunicorn.conf.py)
+    METRICS_MULTIPROCESS_DIR = os.getenv('METRICS_MULTIPROCESS_DIR', '')
+    METRICS_FLUSH_INTERVAL_MS = int(os.getenv('METRICS_FLUSH_INTERVAL_MS', 1000))
+
+    # Профилирование запросов (profiling.py): по заголовку "X-Profile: 1",
+    # если PROFILE_ENABLED, и доля профилируемых запросов (0..1)
+    PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join('log', 'profile'))
+    PROFILE_TOP_FUNCTIONS = int(os.getenv('PROFILE_TOP_FUNCTIONS', 30))
+    # Сколько последних отчетов хранится в PROFILE_DIR, более старые удаляются
+    PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))
+
+    # Подключение в фоне (connection.start_database_connection): количество
+    # попыток (0- без ограничения) и пауза между ними, растущая от начальной
+    # до TIME_SLEEP_RETRY секунд
+    MAX_RETRY_CONNECT_DB = int(os.getenv('MAX_RETRY_CONNECT_DB', 0))
+    DB_RETRY_INITIAL_DELAY = float(os.getenv('DB_RETRY_INITIAL_DELAY', 0.5))
+    DB_RETRY_MAX_DELAY = float(os.getenv('TIME_SLEEP_RETRY', 30))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+
+    # Параметры MongoClient (connection.client_options). Не заданные
+    # переменные- значения pymongo по умолчанию
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 100))
+    MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_MAX_IDLE_TIME_MS = optional_int('MONGO_MAX_IDLE_TIME_MS')
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = optional_int('MONGO_WAIT_QUEUE_TIMEOUT_MS')
+    MONGO_CONNECT_TIMEOUT_MS = optional_int('MONGO_CONNECT_TIMEOUT_MS')
+    MONGO_SOCKET_TIMEOUT_MS = optional_int('MONGO_SOCKET_TIMEOUT_MS')
+    # Через запятую, например "zstd,snappy,zlib"
+    MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS') or None
+    MONGO_READ_PREFERENCE = os.getenv('MONGO_READ_PREFERENCE', 'primary')
+
+    # Отдельный клиент для чтения (match_index, find_templates_by_keys,
+    # get_all_form_templates, get_all_form_indexes, постраничная выдача)
+    MONGO_READ_CLIENT_ENABLED = os.getenv('MONGO_READ_CLIENT_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    MONGO_READ_MAX_POOL_SIZE = int(os.getenv('MONGO_READ_MAX_POOL_SIZE', 200))
+    MONGO_READ_READ_PREFERENCE = os.getenv('MONGO_READ_READ_PREFERENCE', 'secondaryPreferred')
+
+    # Сервер gunicorn (gunicorn.conf.py). По умолчанию воркеров столько,
+    # сколько ядер доступно процессу
+    SERVER_BIND = os.getenv('SERVER_BIND', '0.0.0.0:5000')
+    SERVER_WORKERS = optional_int('SERVER_WORKERS')
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', 64))
+    SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', 30))
+    # Сколько секунд воркер дорабатывает принятые запросы при остановке и перезапуске
+    SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', 20))
+    SERVER_KEEPALIVE = int(os.getenv('SERVER_KEEPALIVE', 5))
+    # Перезапуск воркера после стольких запросов (0- без перезапуска)
+    SERVER_MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', 0))
+    SERVER_MAX_REQUESTS_JITTER = int(os.getenv('SERVER_MAX_REQUESTS_JITTER', 0))
+    # Сколько секунд новый воркер ждет подключения к базе и прогрева кэшей,
+    # прежде чем начать принимать запросы
+    SERVER_WARMUP_TIMEOUT = float(os.getenv('SERVER_WARMUP_TIMEOUT', 10))
+    # Номер воркера, выставляется в gunicorn.conf.py (заголовок X-Worker, metrics.worker_id)
+    SERVER_WORKER_ID = ''
+
+    # Снимок шаблонов и индексов (snapshot.py). Если файл задан и соответствует
+    # данным в базе, воркер загружает индекс шаблонов из него, а не из MongoDB
+    SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', '')
+    SNAPSHOT_BATCH_SIZE = int(os.getenv('SNAPSHOT_BATCH_SIZE', 10000))
+    # Восстановление заполняет коллекции с этим суффиксом, затем заменяет ими текущие
+    SNAPSHOT_RESTORE_SUFFIX = os.getenv('SNAPSHOT_RESTORE_SUFFIX', '_restore')
+
+    # Ограничение одновременных запросов по классам маршрутов (admission.py):
+    # write- записи в MongoDB, read- чтение, cpu- валидация. В gthread запрос
+    # в очереди ограничителя тоже занимает поток, поэтому лимиты и очереди
+    # по умолчанию- доли SERVER_THREADS, а их сумма должна оставлять поток
+    # маршрутам без класса (проверяется в gunicorn.conf.py). Иначе лишние
+    # запросы ждут свободного потока в gunicorn и ограничение не срабатывает.
+    # write и read ждут MongoDB, а не CPU, им достается больше потоков
+    ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    ADMISSION_LIMITS = {
+        "write": admission_limits("write", connection_share(SERVER_THREADS, 4, MONGO_MAX_POOL_SIZE),
+                                  thread_share(SERVER_THREADS, 8), 2000),
+        "read": admission_limits("read", connection_share(SERVER_THREADS, 4, MONGO_MAX_POOL_SIZE),
+                                 thread_share(SERVER_THREADS, 8), 1000),
+        "cpu": admission_limits("cpu", thread_share(SERVER_THREADS, 8, 1),
+                                thread_share(SERVER_THREADS, 16), 500),
+    }
+    ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 1))
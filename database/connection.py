@@ -1,69 +1,211 @@
 from pymongo import MongoClient
-from eKom.database.config import Config
+from pymongo.errors import OperationFailure
+from database.config import Config
+from database.queries import (bucket_indexes, obsolete_bucket_indexes, template_keys_backfill, BUCKET_LOOKUP_INDEX,
+                              LEGACY_BUCKET_FILTER, TEMPLATE_KEYS_INDEX, TEMPLATES_WITHOUT_KEYS, TEMPLATE_KEYS_SOURCE)
+import random
+import threading
 import time
-from dotenv import load_dotenv
-import os
-from eKom.logging_form import logger
-from pymongo.errors import ServerSelectionTimeoutError
+from logging_form import logger
+from database.pool_monitor import PoolMonitor
 
-# Загрузка переменных из .env
-load_dotenv()
+"""
+Подключение к MongoDB в фоновом потоке.
 
+Приложение начинает принимать запросы сразу, а подключение, создание
+коллекций и индексов и прогрев кэшей выполняются в фоне с повторными
+попытками. Пока база не готова, get_database() бросает DatabaseNotReady.
+"""
 
-def connect_to_database(max_retries, delay):
+
+class DatabaseNotReady(Exception):
     """
-    Подключение к MongoDB с повторной попыткой в случае неудачи.
+    Подключение к MongoDB еще не установлено.
     """
-    attempts = 0
-    while attempts < max_retries:
-        try:
-            client = MongoClient(Config.MONGO_URI)
-            db = client[Config.MONGO_DB_NAME]
-            # Проверяем подключение, вызывая команду, например, получения списка коллекций
-            db.list_collection_names()
-            logger.info(" Подключение к MongoDB успешно! ")
-            return client, db
-        except ServerSelectionTimeoutError as e:
-            attempts += 1
-            logger.info(f" Ошибка подключения к MongoDB (попытка {attempts}/{max_retries}): {e} ")
-            time.sleep(delay)
-        except Exception as e:
-            attempts += 1
-            logger.info(f" Неизвестная ошибка при подключении к MongoDB: {e} ")
-            time.sleep(delay)
 
-    raise Exception("Не удалось подключиться к MongoDB.")
+
+# Состояние подключения: starting -> ready, либо failed,
+# если попытки закончились
+DATABASE = None
+# База данных клиента для чтения, см. Config.MONGO_READ_CLIENT_ENABLED
+READ_DATABASE = None
+STATUS = "starting"
+_connect_thread = None
+_connect_lock = threading.Lock()
+
+
+def retry_delays():
+    """
+    Паузы между попытками подключения: растут вдвое от
+    Config.DB_RETRY_INITIAL_DELAY до Config.DB_RETRY_MAX_DELAY,
+    со случайным разбросом, чтобы воркеры не ломились одновременно.
+    Количество- Config.MAX_RETRY_CONNECT_DB (0- без ограничения).
+    """
+    delay = Config.DB_RETRY_INITIAL_DELAY
+    attempt = 1
+    while not Config.MAX_RETRY_CONNECT_DB or attempt < Config.MAX_RETRY_CONNECT_DB:
+        yield attempt, random.uniform(delay / 2, delay)
+        delay = min(delay * 2, Config.DB_RETRY_MAX_DELAY)
+        attempt += 1
+
+
+def client_options(pool, max_pool_size, read_preference):
+    """
+    Параметры MongoClient из Config, общие для синхронного и async клиента.
+
+    :args:
+        pool (str): Имя пула в метриках, см. pool_monitor
+        max_pool_size (int)
+        read_preference (str): primary, secondaryPreferred, ...
+
+    :returns:
+        dict: Именованные аргументы MongoClient
+    """
+    options = {
+        "maxPoolSize": max_pool_size,
+        "minPoolSize": Config.MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": Config.MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": Config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": Config.MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": Config.MONGO_SOCKET_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "compressors": Config.MONGO_COMPRESSORS,
+        "readPreference": read_preference,
+        "event_listeners": [PoolMonitor(pool)],
+    }
+    return {name: value for name, value in options.items() if value is not None}
+
+
+def create_client():
+    return MongoClient(Config.MONGO_URI, **client_options(
+        "main", Config.MONGO_MAX_POOL_SIZE, Config.MONGO_READ_PREFERENCE))
+
+
+def create_read_client():
+    return MongoClient(Config.MONGO_URI, **client_options(
+        "read", Config.MONGO_READ_MAX_POOL_SIZE, Config.MONGO_READ_READ_PREFERENCE))
+
+
+# Предупреждения при создании индексов, общие с async_operations.initialize_indexes
+UNIQUE_INDEXES_FAILED = (" Не удалось создать уникальные индексы корзин, перестройте коллекцию "
+                         "индексов: python rebuild.py ({}) ")
+LEGACY_INDEX_FORMAT = " Коллекция индексов в прежнем формате, перестройте ее: python rebuild.py "
+
+
+def create_index_indexes(index):
+    """
+    Индексы MongoDB для коллекции индексов шаблонов (и ее копии при перестройке, см. rebuild.py).
+    """
+    for name in obsolete_bucket_indexes(index.index_information()):
+        index.drop_index(name)
+    index.create_index(BUCKET_LOOKUP_INDEX)
+    try:
+        for keys, options in bucket_indexes():
+            index.create_index(keys, **options)
+    except OperationFailure as e:
+        # Повторы и лишние неполные корзины, записанные до появления этих индексов
+        logger.warning(UNIQUE_INDEXES_FAILED.format(e))
+    if index.find_one(LEGACY_BUCKET_FILTER, {"_id": 1}):
+        logger.warning(LEGACY_INDEX_FORMAT)
 
 
 def initialize_collection(db):
     """
     Создает коллекцию для шаблонов форм и индексов, если они еще не существуют.
     """
-    if Config.MONGO_COLLECTION_NAME not in db.list_collection_names():
-        db.create_collection(Config.MONGO_COLLECTION_NAME)
-        logger.info(f" Коллекция '{Config.MONGO_COLLECTION_NAME}' создана.")
-    if Config.INDEX_COLLECTION_NAME not in db.list_collection_names():
-        db.create_collection(Config.INDEX_COLLECTION_NAME)
-        logger.info(f" Коллекция '{Config.INDEX_COLLECTION_NAME}' создана.")
+    collections = set(db.list_collection_names())
+    for name in (Config.MONGO_COLLECTION_NAME, Config.INDEX_COLLECTION_NAME):
+        if name not in collections:
+            db.create_collection(name)
+            logger.info(f" Коллекция '{name}' создана.")
+
+    create_index_indexes(db[Config.INDEX_COLLECTION_NAME])
+
+    # Ключи для подбора агрегацией (Config.MATCH_ENGINE = "aggregate"),
+    # шаблоны, созданные до их появления, дополняются здесь
+    templates = db[Config.MONGO_COLLECTION_NAME]
+    backfill = [template_keys_backfill(template)
+                for template in templates.find(TEMPLATES_WITHOUT_KEYS, TEMPLATE_KEYS_SOURCE)]
+    if backfill:
+        templates.bulk_write(backfill, ordered=False)
+        logger.info(f" Добавлены ключи подбора шаблонам: {len(backfill)} ")
+    templates.create_index(TEMPLATE_KEYS_INDEX)
+
+
+def connect_to_database(on_ready=()):
+    """
+    Подключение к MongoDB с повторными попытками. После подключения
+    создает коллекции и индексы и вызывает on_ready (прогрев кэшей);
+    ошибка в любом шаге- повод для следующей попытки.
+
+    :args:
+        on_ready (iterable): Функции без аргументов
+    """
+    global DATABASE, READ_DATABASE, STATUS
+
+    client = create_client()
+    db = client[Config.MONGO_DB_NAME]
+    delays = retry_delays()
+    while True:
+        try:
+            db.command("ping")
+            initialize_collection(db)
+            if Config.MONGO_READ_CLIENT_ENABLED and READ_DATABASE is None:
+                READ_DATABASE = create_read_client()[Config.MONGO_DB_NAME]
+            DATABASE = db
+            logger.info(" Подключение к MongoDB успешно! ")
+            for callback in on_ready:
+                callback()
+            STATUS = "ready"
+            return
+        except Exception as e:
+            attempt, delay = next(delays, (None, None))
+            if attempt is None:
+                STATUS = "failed"
+                logger.critical(f" Не удалось подключиться к MongoDB: {e} ")
+                return
+            logger.info(f" Ошибка подключения к MongoDB (попытка {attempt}), повтор через {delay:.1f} с: {e} ")
+            time.sleep(delay)
 
 
-def initialize_database_connection():
+def start_database_connection(on_ready=()):
+    """
+    Запускает подключение в фоновом потоке, повторный вызов ничего не делает.
     """
-    Подключение к базе данных и инициализация коллекций.
+    global _connect_thread
 
+    with _connect_lock:
+        if _connect_thread is None:
+            _connect_thread = threading.Thread(target=connect_to_database, args=(tuple(on_ready),),
+                                               name="mongo-connect", daemon=True)
+            _connect_thread.start()
+
+
+def get_database():
+    """
     :returns:
-        MONGO_CLIENT: Объект клиента MongoDB.
-        MONGO_DB: Объект базы данных MongoDB.
+        Database: База данных MongoDB
 
     :exception:
-        Генерирует исключение, если подключение не удалось.
+        DatabaseNotReady, если подключение еще не установлено
     """
-    try:
-        max_retries = int(os.getenv("MAX_RETRY_CONNECT_DB", 5))
-        delay = int(os.getenv("TIME_SLEEP_RETRY", 5))
-        MONGO_CLIENT, MONGO_DB = connect_to_database(max_retries, delay)
-        initialize_collection(MONGO_DB)
-        return MONGO_CLIENT, MONGO_DB
-    except Exception as e:
-        logger.info(f" Критическая ошибка: {e} ")
-        raise
\ No newline at end of file
+    if DATABASE is None:
+        raise DatabaseNotReady("Database is not ready")
+    return DATABASE
+
+
+def get_read_database():
+    """
+    База данных для запросов только на чтение: отдельный клиент с
+    Config.MONGO_READ_READ_PREFERENCE, если он включен, иначе основной.
+    """
+    database = get_database()
+    return READ_DATABASE if READ_DATABASE is not None else database
+
+
+def database_status():
+    """
+    :returns:
+        str: starting, ready или failed
+    """
+    return STATUS
@@ -1,47 +1,168 @@
-from eKom.database.config import Config
-from eKom.database.connection import initialize_database_connection
+from itertools import islice
+from pymongo import UpdateOne, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from database.config import Config
+from database.connection import get_database, get_read_database, initialize_collection, create_index_indexes
+from database.queries import GENERATION_ID, BUCKET_PROJECTION, BUCKET_PUSH_ATTEMPTS, index_key, bucket_push, bucket_entry, group_bucket_entries, rejected_buckets, page_query, generation_bump, snapshot_mark, index_rebuild_pipeline, template_keys, match_pipeline, TEMPLATE_PROJECTION, RAW_CODEC_OPTIONS
+from matching import match_buckets
+from metrics import timed
 
 
-MONGO_CLIENT, MONGO_DB = initialize_database_connection()
+def bump_generation(snapshot_id=None, reset=False):
+    """
+    Увеличивает счетчик поколений данных, см. coherence.py
+
+    :args:
+        snapshot_id (str): Id снимка, если данные восстановлены из него
+        reset (bool): Шаблоны удалены или заменены, см. queries.generation_bump
+
+    :return:
+        int: Новое поколение
+    """
+    meta = get_database()[Config.META_COLLECTION_NAME]
+    result = meta.find_one_and_update(*generation_bump(snapshot_id, reset), upsert=True,
+                                      return_document=ReturnDocument.AFTER)
+    return result["value"]
+
+
+@timed("mongo")
+def get_generation():
+    """
+    Текущее поколение данных, 0 если записей еще не было
+    """
+    return get_generation_state()["value"]
+
+
+def get_generation_state():
+    """
+    :return:
+        dict: { "value": <поколение>, "resets": <удалений и замен шаблонов>,
+                "snapshots": [id снимков с этими данными] }
+    """
+    meta = get_database()[Config.META_COLLECTION_NAME]
+    result = meta.find_one({"_id": GENERATION_ID}) or {}
+    return {"value": result.get("value", 0), "resets": result.get("resets", 0),
+            "snapshots": result.get("snapshots", [])}
+
+
+@timed("mongo")
+def mark_snapshot(generation, snapshot_id):
+    """
+    Отмечает, что данные поколения generation выгружены в снимок snapshot_id.
+
+    :return:
+        bool: False, если поколение успело измениться
+    """
+    meta = get_database()[Config.META_COLLECTION_NAME]
+    return meta.update_one(*snapshot_mark(generation, snapshot_id)).modified_count == 1
 
 
-def build_index(field_name, field_type, template):
+def push_entry(index, key, field_count, entry):
     """
-    Создает новый индеккс, либо обновляет существующий
+    Добавляет в корзину одну ссылку на шаблон. Уже добавленная ссылка не повторяется.
+    """
+    for attempt in range(BUCKET_PUSH_ATTEMPTS):
+        try:
+            index.update_one(*bucket_push(key, field_count, [entry]), upsert=True)
+            return
+        except DuplicateKeyError:
+            if index.find_one(bucket_entry(key, field_count, entry["id"]), {"_id": 1}):
+                return
+            if attempt == BUCKET_PUSH_ATTEMPTS - 1:
+                raise
+
+
+@timed("mongo")
+def build_indexes(entries):
+    """
+    Добавляет ссылки на шаблоны в коллекцию индексов одной пачкой bulk_write
+    с условным upsert по каждой корзине, см. queries.bucket_push. Корзины,
+    которые отклонили уникальные индексы, записываются по одной ссылке:
+    повторная запись тех же шаблонов ничего не меняет.
 
     :args:
-        field_name (str)
-        field_type(str)
-        template(dict): Шаблон- {имя, список полей}
+        entries (list): Тройки (key, field_count, entry), см. matching.index_entries
+
+    :return:
+        int: Новое поколение, None если добавлять было нечего
     """
-    # Комбинируем имя поля и тип
-    key = f"{field_name}+{field_type}"
-    index = MONGO_DB[Config.INDEX_COLLECTION_NAME]
+    index = get_database()[Config.INDEX_COLLECTION_NAME]
 
-    existing_index = index.find_one({"key": key})
+    buckets = group_bucket_entries(entries)
+    if not buckets:
+        return None
 
-    if existing_index:
-        # Если индекс уже существует, добавляем шаблон, если его там нет
-        if not any(t["name"] == template["name"] for t in existing_index['templates']):
-            index.update_one(
-                {"key": key},
-                {"$push": {"templates": template}}
-            )
-    else:
-        # Если индекса нет, создаем новый
-        index.insert_one({"key": key, "templates": [template]})
+    try:
+        try:
+            index.bulk_write([UpdateOne(*bucket_push(*bucket), upsert=True) for bucket in buckets],
+                             ordered=False)
+        except BulkWriteError as e:
+            for key, field_count, bucket_entries in rejected_buckets(buckets, e):
+                for entry in bucket_entries:
+                    push_entry(index, key, field_count, entry)
+    finally:
+        generation = bump_generation()
+    return generation
 
 
-def find_templates_by_field(field_name, field_type):
+@timed("mongo")
+def match_index(result_form):
     """
-    Поиск всех шаблонов, содержащих указанное поле с данным типом.
+    Подбор шаблона по корзинам коллекции индексов, см. matching.BucketMatch.
+    Корзины читаются пачками в порядке field_count, и чтение прекращается,
+    как только лучший результат больше не может измениться.
+
+    :args:
+        result_form (dict): { "<field_name>": <type> }
+
+    :return:
+        str: Имя шаблона, либо "" если ни один не подошел
+    """
+    index = get_read_database()[Config.INDEX_COLLECTION_NAME]
+    keys = [index_key(field_name, field_type) for field_name, field_type in result_form.items()]
+    cursor = index.find({"key": {"$in": keys}}, BUCKET_PROJECTION).sort("field_count", ASCENDING)
+    try:
+        return match_buckets(cursor)
+    finally:
+        cursor.close()
+
+
+@timed("mongo")
+def find_templates_by_keys(keys):
+    """
+    Поиск корзин сразу по нескольким ключам "имя+тип" одним запросом.
+
+    :args:
+        keys (iterable): Ключи индекса.
+
+    :return:
+        dict: { "<key>": список корзин в порядке field_count }
     """
-    index = MONGO_DB[Config.INDEX_COLLECTION_NAME]
-    key = f"{field_name}+{field_type}"
-    result = index.find_one({"key": key})
-    return result['templates'] if result else []
+    index = get_read_database()[Config.INDEX_COLLECTION_NAME]
+    result = index.find({"key": {"$in": list(keys)}}, BUCKET_PROJECTION).sort("field_count", ASCENDING)
+    buckets = {}
+    for bucket in result:
+        buckets.setdefault(bucket["key"], []).append(bucket)
+    return buckets
 
 
+@timed("mongo")
+def match_template(result_form):
+    """
+    Подбор шаблона одной агрегацией на стороне MongoDB, см. queries.match_pipeline
+
+    :args:
+        result_form (dict): { "<field_name>": <type> }
+
+    :return:
+        str: Имя шаблона, либо "" если ни один не подошел
+    """
+    collection = get_read_database()[Config.MONGO_COLLECTION_NAME]
+    template = next(collection.aggregate(match_pipeline(result_form)), None)
+    return template["name"] if template else ""
+
+
+@timed("mongo")
 def create_form_template(template_data):
     """
     Создает новый шаблон
@@ -52,35 +173,202 @@ def create_form_template(template_data):
     :return:
         id (str)
     """
-    collection = MONGO_DB[Config.MONGO_COLLECTION_NAME]
-    result = collection.insert_one(template_data)
+    collection = get_database()[Config.MONGO_COLLECTION_NAME]
+    result = collection.insert_one({**template_data, **template_keys(template_data)})
+    bump_generation()
     return result.inserted_id
 
 
+@timed("mongo")
+def create_form_templates(templates_data):
+    """
+    Создает несколько шаблонов одним запросом
+
+    :args:
+        templates_data (list): Шаблоны- {имя, список полей}
+
+    :return:
+        list: id шаблонов в том же порядке
+    """
+    collection = get_database()[Config.MONGO_COLLECTION_NAME]
+    result = collection.insert_many([{**template, **template_keys(template)} for template in templates_data])
+    bump_generation()
+    return result.inserted_ids
+
+
+@timed("mongo")
 def get_all_form_templates():
     """
     Возвращает все текущие шаблоны
     """
-    collection = MONGO_DB[Config.MONGO_COLLECTION_NAME]
-    return list(collection.find({}))
+    collection = get_read_database()[Config.MONGO_COLLECTION_NAME]
+    return list(collection.find({}, TEMPLATE_PROJECTION))
 
 
+@timed("mongo")
 def get_all_form_indexes():
     """
     Возвращает все текущие индексы
     """
-    collection = MONGO_DB[Config.INDEX_COLLECTION_NAME]
+    collection = get_read_database()[Config.INDEX_COLLECTION_NAME]
     return list(collection.find({}))
 
 
+def find_documents(collection_name, after=None, limit=None, projection=None, raw=False):
+    """
+    Курсор по документам коллекции в порядке _id, для постраничной
+    выдачи по ключу (?after=<id>&limit=) и потоковой выдачи.
+
+    :args:
+        collection_name (str)
+        after (ObjectId): Вернуть документы после этого _id
+        limit (int): Максимальное количество документов
+        projection (dict): Какие поля вернуть, по умолчанию все
+        raw (bool): Документы RawBSONDocument, без разбора в dict
+
+    :return:
+        Cursor, документы читаются пачками по Config.STREAM_BATCH_SIZE
+    """
+    collection = get_read_database()[collection_name]
+    if raw:
+        collection = collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+    query, sort = page_query(after)
+    cursor = collection.find(query, projection).sort(sort).batch_size(Config.STREAM_BATCH_SIZE)
+    if limit:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+def find_form_templates(after=None, limit=None, projection=None, raw=False):
+    """
+    Шаблоны в порядке _id, см. find_documents
+    """
+    return find_documents(Config.MONGO_COLLECTION_NAME, after, limit, projection or TEMPLATE_PROJECTION, raw)
+
+
+def find_form_indexes(after=None, limit=None, projection=None, raw=False):
+    """
+    Индексы в порядке _id, см. find_documents
+    """
+    return find_documents(Config.INDEX_COLLECTION_NAME, after, limit, projection, raw)
+
+
+@timed("mongo")
 def clear_database():
     """
     Удаляет все данные из коллекций, связанных с шаблонами и индексами.
+
+    :return:
+        int: Новое поколение
     """
     # Очистка коллекции шаблонов
-    template_collection = MONGO_DB[Config.MONGO_COLLECTION_NAME]
+    template_collection = get_database()[Config.MONGO_COLLECTION_NAME]
     template_collection.delete_many({})
 
     # Очистка коллекции индексов
-    index_collection = MONGO_DB[Config.INDEX_COLLECTION_NAME]
-    index_collection.delete_many({})
\ No newline at end of file
+    index_collection = get_database()[Config.INDEX_COLLECTION_NAME]
+    index_collection.delete_many({})
+
+    return bump_generation(reset=True)
+
+
+@timed("mongo")
+def restore_collections(templates, indexes, snapshot_id):
+    """
+    Заменяет шаблоны и индексы документами из снимка. Документы пачками
+    по Config.SNAPSHOT_BATCH_SIZE загружаются в отдельные коллекции
+    (Config.SNAPSHOT_RESTORE_SUFFIX), индексы MongoDB строятся уже по
+    загруженным данным, и только потом коллекции заменяют текущие через
+    renameCollection, как в rebuild.py. Пока идет загрузка, сервис работает
+    на прежних данных; если она не удалась, текущие коллекции не меняются.
+
+    :args:
+        templates (iterable): Документы шаблонов, можно RawBSONDocument
+        indexes (iterable): Документы индексов
+        snapshot_id (str)
+    """
+    database = get_database()
+    names = (Config.MONGO_COLLECTION_NAME, Config.INDEX_COLLECTION_NAME)
+    staging = {name: database[f"{name}{Config.SNAPSHOT_RESTORE_SUFFIX}"] for name in names}
+    try:
+        for name, documents in zip(names, (templates, indexes)):
+            staging[name].drop()
+            database.create_collection(staging[name].name)
+            documents = iter(documents)
+            while batch := list(islice(documents, Config.SNAPSHOT_BATCH_SIZE)):
+                staging[name].insert_many(batch, ordered=False)
+        staging[Config.MONGO_COLLECTION_NAME].create_index("keys")
+        create_index_indexes(staging[Config.INDEX_COLLECTION_NAME])
+    except BaseException:
+        for collection in staging.values():
+            collection.drop()
+        raise
+
+    for name in names:
+        staging[name].rename(name, dropTarget=True)
+    # Ключи подбора шаблонам из снимков, выгруженных до их появления
+    initialize_collection(database)
+    bump_generation(snapshot_id, reset=True)
+
+
+@timed("mongo")
+def rebuild_index_collection(target):
+    """
+    Строит коллекцию индексов заново в коллекции target на стороне MongoDB,
+    см. queries.index_rebuild_pipeline. Текущая коллекция индексов не меняется.
+    """
+    database = get_database()
+    database[target].drop()
+    database[Config.MONGO_COLLECTION_NAME].aggregate(index_rebuild_pipeline(target), allowDiskUse=True)
+    create_index_indexes(database[target])
+
+
+@timed("mongo")
+def swap_index_collection(source):
+    """
+    Заменяет коллекцию индексов коллекцией source одним renameCollection.
+    """
+    get_database()[source].rename(Config.INDEX_COLLECTION_NAME, dropTarget=True)
+
+
+def drop_collection(name):
+    get_database()[name].drop()
+
+
+def find_indexes_by_key(collection_name):
+    """
+    Документы коллекции индексов в порядке key, field_count, для сравнения двух коллекций
+    """
+    collection = get_database()[collection_name]
+    return collection.find({}, {"_id": 0}).sort([("key", ASCENDING), ("field_count", ASCENDING)]) \
+        .batch_size(Config.STREAM_BATCH_SIZE)
+
+
+def find_templates_after(template_id=None):
+    """
+    Шаблоны, созданные после шаблона template_id (все, если None), в порядке _id.
+    Для загрузки кэшей, поэтому с основного клиента: вторичный узел может еще
+    не получить запись, о которой сообщил счетчик поколений.
+    """
+    collection = get_database()[Config.MONGO_COLLECTION_NAME]
+    query, sort = page_query(template_id)
+    return collection.find(query, TEMPLATE_PROJECTION).sort(sort)
+
+
+def latest_template_id():
+    """
+    _id последнего созданного шаблона, None если шаблонов нет
+    """
+    collection = get_database()[Config.MONGO_COLLECTION_NAME]
+    template = collection.find_one({}, {"_id": 1}, sort=[("_id", DESCENDING)])
+    return template["_id"] if template else None
+
+
+def collection_size(name):
+    """
+    :return:
+        dict: { "documents", "bytes" (данные без сжатия), "storage_bytes" (на диске) }
+    """
+    stats = get_database().command("collStats", name)
+    return {"documents": stats.get("count", 0), "bytes": stats.get("size", 0),
+            "storage_bytes": stats.get("storageSize", 0)}
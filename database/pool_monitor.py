@@ -0,0 +1,66 @@
+from pymongo import monitoring
+from metrics import Counter, Gauge, Histogram
+
+"""
+Статистика пулов соединений MongoClient для /metrics.
+"""
+
+POOL_CHECKOUT_WAIT = Histogram(
+    "mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    ("pool",))
+POOL_CHECKOUT_FAILURES = Counter(
+    "mongo_pool_checkout_failures_total", "Failed connection checkouts",
+    ("pool", "reason"))
+POOL_CONNECTIONS_IN_USE = Gauge(
+    "mongo_pool_connections_in_use", "Connections currently checked out",
+    ("pool",))
+POOL_CONNECTIONS = Gauge(
+    "mongo_pool_connections", "Open connections",
+    ("pool",))
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """
+    Слушатель событий пула одного клиента, см. connection.client_options
+
+    :args:
+        pool (str): Имя пула в метриках (main, read)
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        if event.duration is not None:
+            POOL_CHECKOUT_WAIT.observe(event.duration, self.pool)
+        POOL_CONNECTIONS_IN_USE.inc(1, self.pool)
+
+    def connection_check_out_failed(self, event):
+        POOL_CHECKOUT_FAILURES.inc(1, self.pool, event.reason)
+
+    def connection_checked_in(self, event):
+        POOL_CONNECTIONS_IN_USE.dec(1, self.pool)
+
+    def connection_created(self, event):
+        POOL_CONNECTIONS.inc(1, self.pool)
+
+    def connection_closed(self, event):
+        POOL_CONNECTIONS.dec(1, self.pool)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
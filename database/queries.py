@@ -0,0 +1,322 @@
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import ASCENDING, UpdateOne
+from database.config import Config
+
+"""
+Запросы к коллекциям, общие для синхронных (db_operations)
+и асинхронных (async_operations) операций.
+"""
+
+
+def index_key(field_name, field_type):
+    """
+    Комбинируем имя поля и тип
+    """
+    return f"{field_name}+{field_type}"
+
+
+def template_keys(template):
+    """
+    Поля для подбора шаблона агрегацией (match_pipeline): ключи "имя+тип"
+    в порядке полей шаблона и их количество.
+
+    :returns:
+        dict: { "keys": [...], "field_count": <int> }
+    """
+    keys = [index_key(field["name"], field["type"]) for field in template["fields"]]
+    return {"keys": keys, "field_count": len(keys)}
+
+
+# Мультиключевой индекс коллекции шаблонов для match_pipeline
+TEMPLATE_KEYS_INDEX = "keys"
+# Шаблоны, созданные до появления template_keys, и поля, из которых они считаются
+TEMPLATES_WITHOUT_KEYS = {"keys": {"$exists": False}}
+TEMPLATE_KEYS_SOURCE = {"fields": 1}
+
+
+def template_keys_backfill(template):
+    """
+    Дополняет шаблон из TEMPLATES_WITHOUT_KEYS полями template_keys.
+
+    :returns:
+        UpdateOne для bulk_write
+    """
+    return UpdateOne({"_id": template["_id"]}, {"$set": template_keys(template)})
+
+
+# Служебные поля template_keys не отдаются в /templates
+TEMPLATE_PROJECTION = {"keys": 0, "field_count": 0}
+
+
+def match_pipeline(result_form):
+    """
+    Подбор шаблона одной агрегацией по коллекции шаблонов.
+
+    Как и matching.TemplateIndex, шаблон подходит своими первыми полями:
+    считается, сколько ключей шаблона подряд с начала есть в форме.
+    Побеждает наибольшее число, при равенстве- более ранний шаблон.
+    Кандидаты выбираются по мультиключевому индексу на keys.
+
+    :args:
+        result_form (dict): { "<field_name>": <type> }
+
+    :returns:
+        list: Стадии для aggregate, результат- не больше одного документа с name
+    """
+    keys = [index_key(field_name, field_type) for field_name, field_type in result_form.items()]
+    # Позиция первого ключа шаблона, которого нет в форме, либо -1
+    first_missing = {"$indexOfArray": [
+        {"$map": {"input": "$keys", "as": "key", "in": {"$in": ["$$key", {"$literal": keys}]}}},
+        False,
+    ]}
+    return [
+        {"$match": {"keys": {"$in": keys}}},
+        {"$project": {"name": 1, "matched": {"$let": {
+            "vars": {"missing": first_missing},
+            "in": {"$cond": [{"$eq": ["$$missing", -1]}, "$field_count", "$$missing"]},
+        }}}},
+        {"$match": {"matched": {"$gt": 0}}},
+        {"$sort": {"matched": -1, "_id": 1}},
+        {"$limit": 1},
+    ]
+
+
+# Документы без разбора в dict: байты BSON отдаются клиенту как есть
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+# Поля, которые можно запросить в /templates и /indexes (?fields=)
+TEMPLATE_FIELDS = {"name", "fields", "fields.name", "fields.type"}
+INDEX_FIELDS = {"key", "field_count", "count", "entries", "entries.id", "entries.name"}
+
+
+def listing_projection(fields, allowed):
+    """
+    Проекция для выдачи списка по параметру fields, _id возвращается всегда.
+
+    :args:
+        fields (str): Поля через запятую, например "key,entries.name"
+        allowed (set): Допустимые поля
+
+    :returns:
+        dict: Проекция для find, либо None, если fields не задан
+
+    :exception:
+        ValueError, если поле не разрешено или вложено в уже выбранное
+    """
+    if not fields:
+        return None
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - allowed
+    if unknown or not names:
+        raise ValueError(f"'fields' must be a subset of: {', '.join(sorted(allowed))}")
+    # MongoDB не принимает в одной проекции путь и его родителя
+    for name in names:
+        if any(name.startswith(f"{other}.") for other in names):
+            raise ValueError(f"'fields' has both '{name}' and its parent")
+    return {name: 1 for name in names}
+
+
+def bucket_push(key, field_count, entries):
+    """
+    Условный upsert ссылок на шаблоны в корзину индекса.
+
+    Фильтр совпадает с корзиной ключа, в которой хватает места для всех
+    entries и нет ни одной из них. Если такой нет, upsert создает новую
+    корзину. Новую корзину отклоняют с DuplicateKeyError уникальные индексы
+    (connection.create_index_indexes), если в корзинах ключа уже есть
+    ссылка на один из шаблонов (повторная запись, например при перестройке
+    в rebuild.py) или другая неполная корзина (одновременная запись в ключ),
+    см. db_operations.build_indexes
+
+    :args:
+        key (str): Ключ "имя+тип"
+        field_count (int): Номер поля с этим ключом в шаблонах, начиная с 1
+        entries (list): { "id": <_id шаблона>, "name": <имя> }, не больше Config.INDEX_BUCKET_SIZE
+
+    :returns:
+        (filter, update) для update_one с upsert=True
+    """
+    return (
+        {"key": key, "field_count": field_count,
+         "count": {"$lte": Config.INDEX_BUCKET_SIZE - len(entries)},
+         "entries.id": {"$nin": [entry["id"] for entry in entries]}},
+        {"$push": {"entries": {"$each": entries}}, "$inc": {"count": len(entries)}}
+    )
+
+
+# Код ошибки MongoDB при нарушении уникального индекса
+DUPLICATE_KEY = 11000
+# Попыток добавить ссылку на шаблон по одной, если одновременная запись
+# в тот же ключ успела создать неполную корзину (db_operations.push_entry)
+BUCKET_PUSH_ATTEMPTS = 3
+
+
+def rejected_buckets(buckets, error):
+    """
+    Корзины из bulk_write, upsert которых отклонили уникальные индексы, см. bucket_push
+
+    :args:
+        buckets (list): Аргументы bucket_push в порядке операций bulk_write
+        error (BulkWriteError)
+
+    :returns:
+        list: Корзины для записи по одной ссылке
+
+    :exception:
+        error, если операции не прошли по другой причине
+    """
+    write_errors = error.details.get("writeErrors", [])
+    if error.details.get("writeConcernErrors") or any(item["code"] != DUPLICATE_KEY for item in write_errors):
+        raise error
+    return [buckets[item["index"]] for item in write_errors]
+
+
+def bucket_entry(key, field_count, template_id):
+    """
+    Фильтр корзины, в которой уже есть ссылка на шаблон template_id.
+    """
+    return {"key": key, "field_count": field_count, "entries.id": template_id}
+
+
+def bucket_indexes():
+    """
+    Уникальные индексы коллекции индексов, см. bucket_push: ссылка на шаблон
+    в корзинах ключа одна и неполная корзина у ключа одна. Граница неполной
+    корзины зависит от Config.INDEX_BUCKET_SIZE, поэтому он входит в имя индекса.
+
+    :returns:
+        list: (keys, options) для create_index
+    """
+    return [
+        ([("key", ASCENDING), ("field_count", ASCENDING), ("entries.id", ASCENDING)],
+         {"name": "bucket_entry", "unique": True,
+          "partialFilterExpression": {"entries.id": {"$exists": True}}}),
+        ([("key", ASCENDING), ("field_count", ASCENDING)],
+         {"name": f"open_bucket_{Config.INDEX_BUCKET_SIZE}", "unique": True,
+          "partialFilterExpression": {"count": {"$lt": Config.INDEX_BUCKET_SIZE}}}),
+    ]
+
+
+def obsolete_bucket_indexes(existing):
+    """
+    Индексы коллекции индексов, которые нужно удалить: уникальный по key от
+    прежнего формата (документов на ключ теперь несколько) и индекс неполных
+    корзин для другого Config.INDEX_BUCKET_SIZE.
+
+    :args:
+        existing (iterable): Имена индексов коллекции
+    """
+    current = {options["name"] for _, options in bucket_indexes()}
+    return [name for name in existing
+            if name in ("key_1", "key_1_templates.name_1")
+            or (name.startswith("open_bucket_") and name not in current)]
+
+
+# Поиск корзин по ключам в порядке field_count и условный upsert в bucket_push
+BUCKET_LOOKUP_INDEX = [("key", ASCENDING), ("field_count", ASCENDING), ("count", ASCENDING)]
+# Корзины прежнего формата- с копиями шаблонов, такую коллекцию перестраивает rebuild.py
+LEGACY_BUCKET_FILTER = {"templates": {"$exists": True}}
+
+# Поля корзины, нужные для подбора (matching.BucketMatch)
+BUCKET_PROJECTION = {"_id": 0, "key": 1, "field_count": 1, "entries": 1}
+
+
+def group_bucket_entries(entries):
+    """
+    Группирует записи индекса по ключу и номеру поля и делит на части
+    не больше Config.INDEX_BUCKET_SIZE.
+
+    :args:
+        entries (iterable): Тройки (key, field_count, entry), см. matching.index_entries
+
+    :returns:
+        list: Тройки (key, field_count, entries) - аргументы bucket_push
+    """
+    grouped = {}
+    for key, field_count, entry in entries:
+        grouped.setdefault((key, field_count), []).append(entry)
+
+    size = Config.INDEX_BUCKET_SIZE
+    return [
+        (key, field_count, group[start:start + size])
+        for (key, field_count), group in grouped.items()
+        for start in range(0, len(group), size)
+    ]
+
+
+def index_rebuild_pipeline(target):
+    """
+    Вся коллекция индексов заново из коллекции шаблонов, результат- в коллекцию target.
+
+    Как matching.index_entries: каждое поле шаблона дает ссылку на шаблон под
+    ключом поля и его номером; как group_bucket_entries: ссылки делятся на
+    корзины по Config.INDEX_BUCKET_SIZE в порядке _id шаблонов. Номер корзины
+    считается для каждой ссылки ($documentNumber), поэтому ни один
+    промежуточный документ не содержит все ссылки ключа. Нужен MongoDB 5.0.
+    """
+    size = Config.INDEX_BUCKET_SIZE
+    return [
+        {"$project": {"name": 1, "field": "$fields"}},
+        {"$unwind": {"path": "$field", "includeArrayIndex": "position"}},
+        {"$project": {"name": 1,
+                      "key": {"$concat": ["$field.name", "+", "$field.type"]},
+                      "field_count": {"$add": ["$position", 1]}}},
+        {"$setWindowFields": {
+            "partitionBy": {"key": "$key", "field_count": "$field_count"},
+            "sortBy": {"_id": 1},
+            "output": {"number": {"$documentNumber": {}}},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": {"key": "$key", "field_count": "$field_count",
+                    "bucket": {"$floor": {"$divide": [{"$subtract": ["$number", 1]}, size]}}},
+            "entries": {"$push": {"id": "$_id", "name": "$name"}},
+        }},
+        {"$project": {"_id": 0, "key": "$_id.key", "field_count": "$_id.field_count", "entries": 1}},
+        {"$set": {"count": {"$size": "$entries"}}},
+        {"$out": target},
+    ]
+
+
+def page_query(after):
+    """
+    Фильтр и сортировка для выдачи документов по возрастанию _id после after.
+    """
+    query = {"_id": {"$gt": after}} if after is not None else {}
+    return query, [("_id", ASCENDING)]
+
+
+# Документ со счетчиком поколений в Config.META_COLLECTION_NAME
+GENERATION_ID = "generation"
+
+
+def generation_bump(snapshot_id=None, reset=False):
+    """
+    Счетчик поколений хранит и id снимков (snapshot.py) с теми же данными,
+    что в базе. Любая запись, кроме восстановления из снимка, их сбрасывает.
+    Отдельно считаются записи, после которых шаблоны нельзя догрузить
+    к индексу воркера (resets, см. coherence.py).
+
+    :args:
+        snapshot_id (str): Id снимка, из которого восстановлены данные
+        reset (bool): Шаблоны удалены или заменены
+
+    :returns:
+        (filter, update) для find_one_and_update с upsert=True
+    """
+    increment = {"value": 1, "resets": 1} if reset else {"value": 1}
+    if snapshot_id is None:
+        return {"_id": GENERATION_ID}, {"$inc": increment, "$unset": {"snapshots": ""}}
+    return {"_id": GENERATION_ID}, {"$inc": increment, "$set": {"snapshots": [snapshot_id]}}
+
+
+def snapshot_mark(generation, snapshot_id):
+    """
+    Отмечает, что данные поколения generation сохранены в снимок snapshot_id.
+    Если за время выгрузки была запись, фильтр не совпадет.
+
+    :returns:
+        (filter, update) для update_one
+    """
+    return {"_id": GENERATION_ID, "value": generation}, {"$addToSet": {"snapshots": snapshot_id}}
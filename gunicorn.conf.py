@@ -0,0 +1,109 @@
+import os
+import time
+from database.config import Config
+from metrics import clear_snapshots, mark_worker_dead, write_snapshot
+
+"""
+Настройки gunicorn для запуска в production:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Приложение загружается в каждом воркере уже после fork (preload_app выключен),
+поэтому у каждого воркера свой MongoClient, свой поток подключения к базе
+и свои кэши. В мастере импортируются только Config и metrics (файлы метрик воркеров).
+
+Перезапуск без потери запросов- SIGHUP (новые воркеры, затем остановка старых),
+остановка- SIGTERM: воркеры дорабатывают принятые запросы SERVER_GRACEFUL_TIMEOUT секунд.
+"""
+
+
+def available_cores():
+    """
+    Количество ядер, на которых процессу разрешено работать.
+    Ограничение CPU квотой контейнера здесь не видно, его задают через SERVER_WORKERS.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = Config.SERVER_BIND
+workers = Config.SERVER_WORKERS or available_cores()
+worker_class = "gthread"
+threads = Config.SERVER_THREADS
+timeout = Config.SERVER_TIMEOUT
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+keepalive = Config.SERVER_KEEPALIVE
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = Config.SERVER_MAX_REQUESTS_JITTER
+# MongoClient и потоки журнала не переживают fork
+preload_app = False
+# /metrics складывает метрики всех воркеров из этой папки, см. metrics.py
+metrics_dir = Config.METRICS_MULTIPROCESS_DIR or os.path.join("log", "metrics")
+
+
+def check_admission_threads(threads):
+    """
+    Запросы классов admission.py, допущенные и ожидающие в очереди, занимают
+    потоки воркера. Если их может быть столько же, сколько потоков, лишние
+    запросы ждут в gunicorn, не доходя до ограничителя, и он не срабатывает.
+
+    :exception:
+        RuntimeError, если лимиты и очереди не оставляют свободного потока
+    """
+    if not Config.ADMISSION_ENABLED:
+        return
+    used = sum(limit + queue_size for limit, queue_size, _ in Config.ADMISSION_LIMITS.values())
+    if used >= threads:
+        raise RuntimeError(
+            f"ADMISSION_*_LIMIT and _QUEUE_SIZE take {used} threads, "
+            f"SERVER_THREADS={threads} must be greater")
+
+
+check_admission_threads(threads)
+
+
+def on_starting(server):
+    # Воркеры наследуют Config мастера. Счетчики прошлого запуска
+    # не должны попасть в сумму
+    Config.METRICS_MULTIPROCESS_DIR = metrics_dir
+    clear_snapshots()
+
+
+def pre_fork(server, worker):
+    """
+    Выдает воркеру наименьший свободный номер. По нему воркер пишет журнал
+    в свой файл: RotatingFileHandler не рассчитан на запись из нескольких процессов.
+    """
+    taken = {getattr(other, "slot", None) for other in server.WORKERS.values()}
+    worker.slot = next(slot for slot in range(len(taken) + 1) if slot not in taken)
+
+
+def post_fork(server, worker):
+    name, extension = os.path.splitext(Config.LOG_FILE_NAME)
+    Config.LOG_FILE_NAME = f"{name}.{worker.slot}{extension}"
+    Config.SERVER_WORKER_ID = str(worker.slot)
+
+
+def post_worker_init(worker):
+    """
+    Не дает воркеру принимать запросы, пока он не подключился к базе и не прогрел
+    кэши (не дольше SERVER_WARMUP_TIMEOUT). Запросы тем временем обслуживают
+    остальные воркеры.
+    """
+    from database.connection import database_status
+
+    deadline = time.monotonic() + Config.SERVER_WARMUP_TIMEOUT
+    while database_status() == "starting" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    worker.log.info("Worker %s: database %s", worker.pid, database_status())
+
+
+def worker_exit(server, worker):
+    # Запросы, обработанные после последнего сохранения метрик
+    write_snapshot()
+
+
+def child_exit(server, worker):
+    mark_worker_dead(worker.pid)
@@ -1,29 +1,138 @@
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import os
+from database.config import Config
 
+"""
+Логирование приложения.
+
+Запись в файл и в консоль выполняет фоновый поток QueueListener,
+обработчик запроса только кладет запись в очередь. Записи пишутся
+в формате JSON, по одной в строке.
+"""
 
 # Создаем папку для логов
 log_directory = "log"
 if not os.path.exists(log_directory):
     os.makedirs(log_directory)
 
+# Стандартные атрибуты LogRecord, остальные пришли через extra=
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Запись лога одной строкой JSON: время, уровень, сообщение
+    и поля, переданные через extra=.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogQueueHandler(QueueHandler):
+    """
+    QueueHandler, который сохраняет traceback отдельно от сообщения,
+    чтобы JsonFormatter записал его в поле "exc". Если очередь
+    заполнена, запись отбрасывается, а не блокирует запрос.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogQueueListener(QueueListener):
+    """
+    При остановке ждет места в очереди, чтобы не потерять уже принятые записи.
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
 # Настройка логгера
 logger = logging.getLogger("app")
 logger.setLevel(logging.INFO)
 
 # Хендлер для ротации логов
-log_file = os.path.join(log_directory, "service.log")
+log_file = os.path.join(log_directory, Config.LOG_FILE_NAME)
 rotating_handler = RotatingFileHandler(
     log_file, maxBytes=5 * 1024 * 1024, backupCount=5  # 5 MB, 5 файлов
 )
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+formatter = JsonFormatter()
 rotating_handler.setFormatter(formatter)
 
 # Хендлер для вывода в консоль
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(formatter)
 
-# Добавляем хендлеры к логгеру
-logger.addHandler(rotating_handler)
-logger.addHandler(console_handler)
\ No newline at end of file
+# Хендлеры работают в потоке listener, логгер пишет только в очередь
+log_queue = queue.Queue(Config.LOG_QUEUE_SIZE)
+queue_handler = LogQueueHandler(log_queue)
+listener = LogQueueListener(log_queue, rotating_handler, console_handler, respect_handler_level=True)
+logger.addHandler(queue_handler)
+listener.start()
+
+
+@atexit.register
+def stop_logging():
+    """
+    Дописывает оставшиеся в очереди записи и закрывает файлы.
+    Вызывается при завершении процесса, повторный вызов ничего не делает.
+    """
+    if queue_handler in logger.handlers:
+        logger.removeHandler(queue_handler)
+        listener.stop()
+        rotating_handler.close()
+
+
+def log_request(method, url, ip, status, latency):
+    """
+    Запись журнала запросов. Успешные ответы пишутся с вероятностью
+    Config.LOG_ACCESS_SAMPLE_RATE, ошибки- всегда.
+
+    :args:
+        latency (float): Время обработки в секундах
+    """
+    if status < 400 and random.random() >= Config.LOG_ACCESS_SAMPLE_RATE:
+        return
+    level = logging.INFO if status < 500 else logging.ERROR
+    logger.log(level, "request", extra={
+        "method": method,
+        "url": url,
+        "ip": ip,
+        "status": status,
+        "latency_ms": round(latency * 1000, 3),
+    })
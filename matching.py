@@ -0,0 +1,301 @@
+import threading
+from array import array
+from operator import itemgetter
+from metrics import templates_scanned
+
+"""
+Подбор шаблона по полям формы.
+
+Шаблон подходит к форме своими первыми полями: считается, сколько полей
+шаблона подряд с начала есть в форме с теми же типами. Побеждает наибольшее
+число, при равенстве- более ранний шаблон. Оба способа поиска ниже
+(по корзинам коллекции индексов и по индексу в памяти) следуют этому правилу
+и отдают одинаковый результат.
+
+От исходного перебора /get_form (build_index + check_fields) правило
+отличается намеренно, см. test/test_matching.py:
+    - при равенстве побеждает более ранний шаблон, а не первый встреченный
+      в порядке полей формы;
+    - исходный перебор запоминал имя шаблона при первой проверке и пропускал
+      остальные его префиксы, даже подходящие, отдавая "" или шаблон хуже;
+    - шаблоны с одинаковым именем учитываются все, исходный build_index
+      оставлял под ключом только первый.
+"""
+
+
+def form_signature(result_form):
+    """
+    Ключ кэша результатов подбора: результат зависит только от пар
+    (имя поля, тип), но не от значений и порядка полей формы.
+
+    :args:
+        result_form (dict): { "<field_name>": <type> }
+
+    :returns:
+        tuple: Отсортированные пары (имя поля, тип)
+    """
+    return tuple(sorted(result_form.items()))
+
+
+def index_entries(template, template_id):
+    """
+    Записи коллекции индексов для шаблона: каждое поле дает ссылку
+    на шаблон под ключом поля и номером поля в шаблоне.
+
+    :args:
+        template (dict): Шаблон- {имя, список полей}
+        template_id (ObjectId): _id шаблона в коллекции шаблонов
+
+    :returns:
+        list: Тройки (key, field_count, { "id", "name" }), см. queries.group_bucket_entries
+    """
+    entry = {"id": template_id, "name": template["name"]}
+    return [
+        (f"{field['name']}+{field['type']}", position + 1, entry)
+        for position, field in enumerate(template["fields"])
+    ]
+
+
+def batch_results(forms, result_forms, template_names):
+    """
+    Собирает ответ /get_form/batch.
+
+    :args:
+        forms (list): Формы из запроса.
+        result_forms (list): Типы полей непустых форм (validators.classify_form).
+        template_names (list): Найденные для них шаблоны.
+
+    :returns:
+        list: { "status": <код /get_form>, "result": <ответ /get_form> } в порядке форм
+    """
+    template_names = iter(template_names)
+    result_forms = iter(result_forms)
+
+    results = []
+    for form in forms:
+        if not form or not isinstance(form, dict):
+            results.append({"status": 400, "result": {"error": "Form fields are required"}})
+            continue
+
+        result_form = next(result_forms)
+        template_name = next(template_names)
+        if template_name:
+            results.append({"status": 200, "result": {"matching_template_name": template_name}})
+        else:
+            results.append({"status": 404, "result": result_form})
+
+    return results
+
+
+class BucketMatch:
+    """
+    Подбор шаблона по корзинам коллекции индексов для ключей формы.
+
+    Корзины подаются в порядке field_count. Шаблон засчитывает поле номер n,
+    только если до этого засчитаны все n - 1 его первых полей, поэтому
+    к корзинам с field_count больше лучшего результата + 1 ни один шаблон
+    уже не подойдет и их можно не читать (add возвращает False).
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._best_id = None
+        self.best_count = 0
+        self.name = ""
+        self.scanned = 0
+
+    def add(self, bucket):
+        """
+        :args:
+            bucket (dict): { "field_count", "entries": [{ "id", "name" }] }
+
+        :returns:
+            bool: False, если дальнейшие корзины результат не изменят
+        """
+        field_count = bucket["field_count"]
+        if field_count > self.best_count + 1:
+            return False
+
+        counts = self._counts
+        entries = bucket["entries"]
+        self.scanned += len(entries)
+        for entry in entries:
+            template_id = entry["id"]
+            if counts.get(template_id, 0) != field_count - 1:
+                continue
+            counts[template_id] = field_count
+            # При равенстве побеждает более ранний шаблон (меньший _id)
+            if field_count > self.best_count or template_id < self._best_id:
+                self._best_id, self.best_count = template_id, field_count
+                self.name = entry["name"]
+        return True
+
+
+def form_buckets(result_form, buckets_by_key):
+    """
+    Корзины всех ключей формы в общем порядке field_count.
+
+    :args:
+        result_form (dict): { "<field_name>": <type> }
+        buckets_by_key (dict): { "<key>": корзины в порядке field_count }
+
+    :returns:
+        list: Корзины для match_buckets
+    """
+    buckets = []
+    for field_name, field_type in result_form.items():
+        buckets.extend(buckets_by_key.get(f"{field_name}+{field_type}", ()))
+    # Списки уже упорядочены, sort только сливает их
+    buckets.sort(key=itemgetter("field_count"))
+    return buckets
+
+
+def match_buckets(buckets):
+    """
+    Подбор шаблона по корзинам в порядке field_count, см. BucketMatch
+
+    :returns:
+        str: Имя шаблона, либо пустая строка.
+    """
+    match = BucketMatch()
+    for bucket in buckets:
+        if not match.add(bucket):
+            break
+    templates_scanned(match.scanned)
+    return match.name
+
+
+def forms_keys(result_forms):
+    """
+    :returns:
+        set: Ключи "имя+тип" всех форм, см. db_operations.find_templates_by_keys
+    """
+    return {f"{field_name}+{field_type}"
+            for result_form in result_forms
+            for field_name, field_type in result_form.items()}
+
+
+def match_forms_buckets(result_forms, buckets_by_key):
+    """
+    Подбор шаблонов для списка форм по корзинам их ключей, см. match_buckets
+
+    :returns:
+        list: Имена шаблонов в порядке форм (пустая строка, если не найден).
+    """
+    return [match_buckets(form_buckets(result_form, buckets_by_key)) for result_form in result_forms]
+
+
+class TemplateIndex:
+    """
+    Инвертированный индекс шаблонов в памяти процесса.
+
+    Для каждого ключа "имя+тип" хранятся два параллельных массива:
+    целочисленные id шаблонов и позиция поля в шаблоне. Id выдаются
+    по порядку добавления, поэтому массивы id всегда отсортированы.
+    Поиск не обращается к базе данных.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = []
+        self._postings = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._names)
+
+    @staticmethod
+    def _append(names, postings, template):
+        template_id = len(names)
+        names.append(template["name"])
+        for position, field in enumerate(template["fields"]):
+            key = f"{field['name']}+{field['type']}"
+            entry = postings.get(key)
+            if entry is None:
+                entry = postings[key] = (array('I'), array('I'))
+            elif not isinstance(entry[0], array):
+                # Массивы из снимка (memoryview) только для чтения, копируем перед изменением
+                entry = postings[key] = (array('I', entry[0]), array('I', entry[1]))
+            ids, positions = entry
+            ids.append(template_id)
+            positions.append(position)
+
+    def load(self, templates):
+        """
+        Полностью перестраивает индекс.
+
+        :args:
+            templates (iterable): Шаблоны- {имя, список полей}
+        """
+        names, postings = [], {}
+        for template in templates:
+            self._append(names, postings, template)
+
+        with self._lock:
+            self._names, self._postings = names, postings
+            self.loaded = True
+
+    def load_postings(self, names, postings):
+        """
+        Заменяет индекс готовыми массивами, см. snapshot.py
+
+        :args:
+            names (list): Имена шаблонов по id
+            postings (dict): { "<key>": (id шаблонов, позиции полей) }, последовательности uint32
+        """
+        with self._lock:
+            self._names, self._postings = names, postings
+            self.loaded = True
+
+    def postings(self):
+        """
+        :returns:
+            (names, postings), см. load_postings
+        """
+        with self._lock:
+            return self._names, self._postings
+
+    def add(self, template):
+        """
+        Добавляет один шаблон- {имя, список полей}
+        """
+        with self._lock:
+            self._append(self._names, self._postings, template)
+
+    def clear(self):
+        self.load([])
+
+    def match(self, result_form):
+        """
+        Ищет шаблон с наибольшим числом первых полей, которые все есть
+        в форме с теми же типами. При равенстве побеждает более ранний
+        (отличия от исходного перебора- в описании модуля).
+
+        :args:
+            result_form (dict): { "<field_name>": <type> }
+
+        :returns:
+            str: Имя шаблона, либо пустая строка.
+        """
+        names, postings = self._names, self._postings
+
+        # Битовая маска совпавших позиций полей для каждого шаблона
+        masks = {}
+        scanned = 0
+        for field_name, field_type in result_form.items():
+            entry = postings.get(f"{field_name}+{field_type}")
+            if entry is None:
+                continue
+            scanned += len(entry[0])
+            for template_id, position in zip(*entry):
+                masks[template_id] = masks.get(template_id, 0) | (1 << position)
+
+        best_id, best_count = -1, 0
+        for template_id, mask in masks.items():
+            # Количество подряд совпавших полей с начала шаблона
+            count = (~mask & (mask + 1)).bit_length() - 1
+            if count > best_count or (count == best_count and template_id < best_id):
+                best_id, best_count = template_id, count
+
+        templates_scanned(scanned)
+        return names[best_id] if best_count else ""
@@ -0,0 +1,361 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+from database.config import Config
+
+"""
+Метрики приложения в текстовом формате Prometheus (/metrics).
+
+Время запроса учитывается по маршрутам, время внутри запроса- по этапам:
+validation, matching, serialization и mongo (по каждой функции db_operations).
+Маршрут текущего запроса хранится в contextvar, поэтому этапы, вызванные
+глубже по стеку, попадают в метрики своего маршрута.
+
+Под gunicorn у каждого воркера свои метрики. Если задан
+METRICS_MULTIPROCESS_DIR, воркер раз в METRICS_FLUSH_INTERVAL_MS сохраняет их
+в файл metrics.<pid>.json этой папки, а /metrics складывает файлы всех
+воркеров: счетчики и гистограммы суммируются, текущие значения (gauge)
+выводятся по воркерам с меткой worker. Значения других воркеров отстают
+не больше чем на METRICS_FLUSH_INTERVAL_MS.
+"""
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Маршрут текущего запроса, выставляется в views.log_requests_and_responses
+current_route = ContextVar("current_route", default="")
+# Профиль текущего запроса (profiling.RequestProfile), если он профилируется
+current_profile = ContextVar("current_profile", default=None)
+
+REGISTRY = []
+# Поток start_snapshot_writer
+snapshot_writer = None
+
+# Заголовок ответа с номером воркера, см. worker_id
+WORKER_HEADER = "X-Worker"
+
+
+def format_labels(labelnames, labels, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Counter:
+    """
+    Счетчик с метками.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, values=None, labelnames=None):
+        """
+        :args:
+            values (dict): Метки -> значение, по умолчанию значения процесса
+            labelnames (tuple): Имена меток, если отличаются от self.labelnames
+        """
+        values = self.values() if values is None else values
+        labelnames = labelnames or self.labelnames
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    Текущее значение с метками, может уменьшаться.
+    """
+
+    kind = "gauge"
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+
+class Histogram:
+    """
+    Гистограмма с метками и фиксированными корзинами.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # метки -> [количество в каждой корзине + корзина +Inf, сумма]
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][position] += 1
+            series[1] += value
+
+    def values(self):
+        with self._lock:
+            return {labels: [list(counts), total] for labels, (counts, total) in self._series.items()}
+
+    def render(self, values=None, labelnames=None):
+        """
+        :args:
+            values (dict): Метки -> [количество в корзинах, сумма], по умолчанию значения процесса
+            labelnames (tuple): Имена меток, если отличаются от self.labelnames
+        """
+        values = self.values() if values is None else values
+        labelnames = labelnames or self.labelnames
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = format_labels(labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(labelnames, labels)} {cumulative}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route",
+    ("route", "method", "status"))
+STAGE_LATENCY = Histogram(
+    "stage_duration_seconds", "Time spent in a request stage",
+    ("route", "stage", "operation"))
+TEMPLATES_SCANNED = Counter(
+    "get_form_templates_scanned_total", "Index entries examined while matching forms",
+    ("route",))
+
+
+def render():
+    """
+    Все метрики в текстовом формате Prometheus: всех воркеров, если задан
+    Config.METRICS_MULTIPROCESS_DIR, иначе только этого процесса.
+    """
+    if Config.METRICS_MULTIPROCESS_DIR:
+        return render_workers()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def worker_id():
+    """
+    :returns:
+        str: Номер воркера gunicorn (gunicorn.conf.py), вне gunicorn- pid процесса
+    """
+    return Config.SERVER_WORKER_ID or str(os.getpid())
+
+
+def snapshot_path(pid):
+    return os.path.join(Config.METRICS_MULTIPROCESS_DIR, f"metrics.{pid}.json")
+
+
+def write_snapshot():
+    """
+    Сохраняет метрики процесса в METRICS_MULTIPROCESS_DIR. Файл заменяется
+    целиком, поэтому читатели не видят его недописанным.
+    """
+    os.makedirs(Config.METRICS_MULTIPROCESS_DIR, exist_ok=True)
+    snapshot = {
+        "worker": worker_id(),
+        "metrics": {metric.name: {"kind": metric.kind,
+                                  "values": [[list(labels), value] for labels, value in metric.values().items()]}
+                    for metric in REGISTRY},
+    }
+    path = snapshot_path(os.getpid())
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(snapshot, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_snapshot(path):
+    """
+    :returns:
+        dict: Метрики воркера, None- файла уже нет (воркер завершился)
+    """
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def snapshot_paths():
+    directory = Config.METRICS_MULTIPROCESS_DIR
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(names)
+            if name.startswith("metrics.") and name.endswith(".json")]
+
+
+def add_value(current, value):
+    if current is None:
+        return value
+    if isinstance(value, list):
+        # Гистограмма: [количество в корзинах, сумма]
+        return [[a + b for a, b in zip(current[0], value[0])], current[1] + value[1]]
+    return current + value
+
+
+def render_workers():
+    """
+    Метрики всех воркеров из METRICS_MULTIPROCESS_DIR, свои- на момент запроса.
+    """
+    write_snapshot()
+    totals = {metric.name: {} for metric in REGISTRY}
+    for path in snapshot_paths():
+        snapshot = read_snapshot(path)
+        if snapshot is None:
+            continue
+        for name, metric in snapshot["metrics"].items():
+            values = totals.get(name)
+            if values is None:
+                continue
+            for labels, value in metric["values"]:
+                labels = tuple(labels)
+                if metric["kind"] == "gauge":
+                    labels += (snapshot["worker"],)
+                values[labels] = add_value(values.get(labels), value)
+
+    lines = []
+    for metric in REGISTRY:
+        labelnames = metric.labelnames + ("worker",) if metric.kind == "gauge" else None
+        lines.extend(metric.render(totals[metric.name], labelnames))
+    return "\n".join(lines) + "\n"
+
+
+def start_snapshot_writer():
+    """
+    Запускает поток, сохраняющий метрики процесса раз в
+    Config.METRICS_FLUSH_INTERVAL_MS, если задан METRICS_MULTIPROCESS_DIR.
+    """
+    global snapshot_writer
+    if not Config.METRICS_MULTIPROCESS_DIR or snapshot_writer is not None:
+        return
+    snapshot_writer = threading.Thread(target=write_snapshots, name="metrics-writer", daemon=True)
+    snapshot_writer.start()
+
+
+def write_snapshots():
+    while True:
+        time.sleep(Config.METRICS_FLUSH_INTERVAL_MS / 1000)
+        try:
+            write_snapshot()
+        except OSError:
+            # Папка недоступна- попробуем в следующий раз
+            pass
+
+
+def mark_worker_dead(pid):
+    """
+    Убирает текущие значения (gauge) завершившегося воркера, счетчики
+    и гистограммы остаются в сумме. Вызывается в мастере gunicorn (child_exit).
+    """
+    path = snapshot_path(pid)
+    snapshot = read_snapshot(path)
+    if snapshot is None:
+        return
+    snapshot["metrics"] = {name: metric for name, metric in snapshot["metrics"].items()
+                           if metric["kind"] != "gauge"}
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(snapshot, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def clear_snapshots():
+    """
+    Удаляет файлы метрик прошлого запуска, вызывается в мастере gunicorn при старте.
+    """
+    for path in snapshot_paths():
+        os.remove(path)
+
+
+def observe_request(route, method, status, latency):
+    if Config.METRICS_ENABLED:
+        REQUEST_LATENCY.observe(latency, route, method, str(status))
+
+
+def templates_scanned(count):
+    if Config.METRICS_ENABLED:
+        TEMPLATES_SCANNED.inc(count, current_route.get())
+
+
+@contextmanager
+def stage(name, operation=None):
+    """
+    Учитывает время блока как этап name текущего маршрута
+    и в профиле запроса, если он профилируется.
+    """
+    profile = current_profile.get()
+    if not Config.METRICS_ENABLED and profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if Config.METRICS_ENABLED:
+            STAGE_LATENCY.observe(elapsed, current_route.get(), name, operation or name)
+        if profile is not None:
+            profile.record(name, operation or name, elapsed)
+
+
+def timed(name):
+    """
+    Декоратор: учитывает время вызова функции как этап name,
+    операция- имя функции. Работает и с async функциями.
+    """
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name, func.__name__):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,182 @@
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import random
+import threading
+import time
+from database.config import Config
+from metrics import current_profile
+
+"""
+Профилирование отдельных запросов по требованию.
+
+Запрос профилируется, если пришел с заголовком "X-Profile: 1"
+(при Config.PROFILE_ENABLED), либо попал в выборку Config.PROFILE_SAMPLE_RATE.
+Обработчик выполняется под cProfile, этапы metrics.stage (каждый вызов
+db_operations, validation, matching, serialization) учитываются отдельно.
+Краткая сводка возвращается в заголовке ответа X-Profile, полный отчет
+пишется в Config.PROFILE_DIR, где хранятся последние Config.PROFILE_MAX_FILES
+отчетов. Если профилирование выключено, запрос
+проверяет только два параметра Config.
+
+cProfile в процессе может работать только один (начиная с Python 3.12),
+поэтому из одновременных запросов функции профилирует первый, у остальных
+в отчете только этапы. В async_app в профиль попадают и другие запросы,
+выполнявшиеся, пока обработчик ждал MongoDB.
+"""
+
+PROFILE_HEADER = "X-Profile"
+
+# Функций в сводке заголовка, в файле- Config.PROFILE_TOP_FUNCTIONS
+HEADER_TOP_FUNCTIONS = 5
+
+_profiler_lock = threading.Lock()
+_report_numbers = itertools.count(1)
+
+
+def start_profile(route, headers):
+    """
+    :args:
+        route (str): Маршрут запроса
+        headers: Заголовки запроса
+
+    :returns:
+        RequestProfile, если запрос нужно профилировать, иначе None
+    """
+    if not Config.PROFILE_ENABLED and not Config.PROFILE_SAMPLE_RATE:
+        return None
+    if Config.PROFILE_ENABLED and headers.get(PROFILE_HEADER) == "1":
+        return RequestProfile(route)
+    if random.random() < Config.PROFILE_SAMPLE_RATE:
+        return RequestProfile(route)
+    return None
+
+
+def function_name(function):
+    filename, line, name = function
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+class RequestProfile:
+    """
+    Профиль одного запроса: время этапов и статистика cProfile.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.elapsed = 0.0
+        # { (этап, операция): [вызовов, секунд] }
+        self.stages = {}
+        self._profiler = None
+
+    def record(self, name, operation, elapsed):
+        """
+        Учитывает этап, вызывается из metrics.stage
+        """
+        entry = self.stages.setdefault((name, operation), [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+
+    def _start(self):
+        if _profiler_lock.acquire(blocking=False):
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._started = time.perf_counter()
+        return current_profile.set(self)
+
+    def _stop(self, token):
+        self.elapsed = time.perf_counter() - self._started
+        current_profile.reset(token)
+        if self._profiler is not None:
+            self._profiler.disable()
+            _profiler_lock.release()
+
+    def run(self, func, *args, **kwargs):
+        token = self._start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._stop(token)
+
+    async def run_async(self, func, *args, **kwargs):
+        token = self._start()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            self._stop(token)
+
+    def functions(self, limit):
+        """
+        :returns:
+            list: Функции с наибольшим собственным временем, либо None,
+                если cProfile был занят другим запросом
+        """
+        if self._profiler is None:
+            return None
+        stats = pstats.Stats(self._profiler).stats
+        top = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+        return [
+            {"function": function_name(function), "calls": calls,
+             "tottime_ms": milliseconds(tottime), "cumtime_ms": milliseconds(cumtime)}
+            for function, (_, calls, tottime, cumtime, _) in top
+        ]
+
+    def summary(self, limit):
+        mongo = {operation: {"calls": calls, "ms": milliseconds(seconds)}
+                 for (name, operation), (calls, seconds) in self.stages.items() if name == "mongo"}
+        stages = {}
+        for (name, _), (_, seconds) in self.stages.items():
+            stages[name] = stages.get(name, 0.0) + seconds
+        return {
+            "route": self.route,
+            "total_ms": milliseconds(self.elapsed),
+            "mongo_calls": sum(operation["calls"] for operation in mongo.values()),
+            "stages_ms": {name: milliseconds(seconds) for name, seconds in stages.items()},
+            "mongo": mongo,
+            "functions": self.functions(limit),
+        }
+
+    def report(self, method, status):
+        """
+        Пишет полный отчет в Config.PROFILE_DIR.
+
+        :returns:
+            str: Сводка для заголовка X-Profile- JSON без операций mongo
+                и с первыми HEADER_TOP_FUNCTIONS функциями
+        """
+        report = {"method": method, "status": status, **self.summary(Config.PROFILE_TOP_FUNCTIONS)}
+        os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+        filename = f"profile.{time.strftime('%Y%m%d-%H%M%S')}.{os.getpid()}.{next(_report_numbers)}.json"
+        with open(os.path.join(Config.PROFILE_DIR, filename), "w") as file:
+            json.dump(report, file, indent=2)
+
+        header = {key: report[key] for key in ("total_ms", "mongo_calls", "stages_ms")}
+        if report["functions"] is not None:
+            header["functions"] = [[function["function"], function["tottime_ms"]]
+                                   for function in report["functions"][:HEADER_TOP_FUNCTIONS]]
+        header["file"] = filename
+        remove_old_reports(Config.PROFILE_DIR, Config.PROFILE_MAX_FILES)
+        return json.dumps(header, separators=(",", ":"))
+
+
+def remove_old_reports(directory, keep):
+    """
+    Оставляет в directory не больше keep последних отчетов профилирования.
+    Имена начинаются со времени записи, поэтому сортируются по возрасту.
+    Отчеты могут писать несколько воркеров, уже удаленный файл- не ошибка.
+    """
+    reports = sorted(name for name in os.listdir(directory)
+                     if name.startswith("profile.") and name.endswith(".json"))
+    for name in reports[:max(len(reports) - keep, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
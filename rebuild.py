@@ -0,0 +1,141 @@
+import argparse
+import json
+import sys
+from itertools import groupby
+from database import db_operations as db
+from database.config import Config
+from matching import index_entries
+from coherence import overlap_start
+from logging_form import logger
+
+"""
+Перестройка коллекции индексов из коллекции шаблонов без остановки сервиса.
+
+Запуск:
+    python rebuild.py              перестроить и заменить коллекцию индексов
+    python rebuild.py --dry-run    только отчет о расхождениях
+
+Индексы строятся одной агрегацией ($unwind/$group) в отдельную коллекцию
+(Config.INDEX_REBUILD_COLLECTION_NAME), которая затем заменяет текущую одним
+renameCollection. Шаблоны, созданные за время перестройки, добавляются в новую
+коллекцию после замены: перечитываются шаблоны после последнего известного
+до начала перестройки (с запасом Config.TEMPLATE_ID_OVERLAP_S, см. coherence.py),
+уже попавшие в новую коллекцию пропускаются (queries.bucket_push). Очистка
+базы (/clear_db) во время перестройки не учитывается- перестройку нужно повторить.
+"""
+
+# Сколько ключей каждого вида расхождений попадает в отчет
+DRIFT_EXAMPLES = 10
+
+
+def bucket_groups(buckets):
+    """
+    Объединяет корзины одного ключа и номера поля.
+
+    :args:
+        buckets (iterable): Документы коллекции индексов в порядке key, field_count
+
+    :returns:
+        iterator: Пары ((key, field_count), множество id шаблонов). У документов
+            прежнего формата (без field_count) номер поля 0, а шаблонов нет
+    """
+    for group, documents in groupby(buckets, key=lambda bucket: (bucket["key"], bucket.get("field_count", 0))):
+        yield group, {entry["id"] for bucket in documents for entry in bucket.get("entries", ())}
+
+
+def index_drift(current, rebuilt):
+    """
+    Сравнивает две коллекции индексов по группам корзин (ключ, номер поля).
+
+    :args:
+        current (iterable): Документы текущей коллекции в порядке key, field_count
+        rebuilt (iterable): Документы перестроенной коллекции в том же порядке
+
+    :returns:
+        dict: Количество групп, которых нет в текущей коллекции (missing),
+            лишних (extra) и с другим набором шаблонов (stale), примеры [key, field_count]
+    """
+    drift = {"keys": 0, "missing": 0, "extra": 0, "stale": 0,
+             "examples": {"missing": [], "extra": [], "stale": []}}
+
+    def found(kind, group):
+        drift[kind] += 1
+        if len(drift["examples"][kind]) < DRIFT_EXAMPLES:
+            drift["examples"][kind].append(list(group))
+
+    current, rebuilt = bucket_groups(current), bucket_groups(rebuilt)
+    old, new = next(current, None), next(rebuilt, None)
+    while old is not None or new is not None:
+        if new is not None and (old is None or new[0] < old[0]):
+            drift["keys"] += 1
+            found("missing", new[0])
+            new = next(rebuilt, None)
+        elif new is None or old[0] < new[0]:
+            found("extra", old[0])
+            old = next(current, None)
+        else:
+            drift["keys"] += 1
+            if old[1] != new[1]:
+                found("stale", new[0])
+            old, new = next(current, None), next(rebuilt, None)
+    return drift
+
+
+def rebuild_indexes(dry_run=False):
+    """
+    Перестраивает коллекцию индексов.
+
+    :args:
+        dry_run (bool): Не заменять коллекцию, только сравнить
+
+    :returns:
+        dict: Расхождения (index_drift), размер коллекции до и после,
+            swapped- заменена ли коллекция, caught_up- сколько шаблонов
+            перечитано после замены
+    """
+    staging = Config.INDEX_REBUILD_COLLECTION_NAME
+    generation = db.get_generation()
+    last_template_id = db.latest_template_id()
+
+    db.rebuild_index_collection(staging)
+    report = {
+        "drift": index_drift(db.find_indexes_by_key(Config.INDEX_COLLECTION_NAME),
+                             db.find_indexes_by_key(staging)),
+        "before": db.collection_size(Config.INDEX_COLLECTION_NAME),
+        "after": db.collection_size(staging),
+        "swapped": False,
+        "caught_up": 0,
+    }
+    if dry_run:
+        db.drop_collection(staging)
+        return report
+
+    db.swap_index_collection(staging)
+    report["swapped"] = True
+
+    # Записи в индекс, сделанные за время перестройки, ушли в старую коллекцию
+    if db.get_generation() != generation:
+        templates = list(db.find_templates_after(overlap_start(last_template_id, Config.TEMPLATE_ID_OVERLAP_S)))
+        db.build_indexes([entry for template in templates
+                          for entry in index_entries(template, template["_id"])])
+        report["caught_up"] = len(templates)
+    db.bump_generation()
+    logger.info(" Коллекция индексов перестроена ", extra={"rebuild": report})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перестройка коллекции индексов")
+    parser.add_argument("--dry-run", action="store_true", help="только отчет о расхождениях")
+    args = parser.parse_args()
+
+    from database.connection import connect_to_database, database_status
+
+    connect_to_database()
+    if database_status() != "ready":
+        sys.exit("MongoDB is not available")
+    print(json.dumps(rebuild_indexes(args.dry_run), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import uuid
+from array import array
+import bson
+from bson.raw_bson import RawBSONDocument
+from database import db_operations as db
+from database.config import Config
+from matching import TemplateIndex
+
+"""
+Снимок шаблонов и индексов в одном файле.
+
+Запуск:
+    python snapshot.py export <path>    выгрузить базу в файл
+    python snapshot.py restore <path>   заменить шаблоны и индексы в базе данными из файла
+    python snapshot.py info <path>
+
+Формат (числа little-endian, секции выровнены по 8 байт):
+    заголовок      HEADER, затем SECTION для каждой секции из SECTIONS
+    templates      документы шаблонов BSON подряд, в порядке _id
+    indexes        документы коллекции индексов BSON подряд
+    names          BSON { "names": [имя шаблона по id] }
+    keys           BSON { "keys": [[ключ "имя+тип", начало, количество], ...] }
+    ids            uint32, id шаблонов для всех ключей подряд
+    positions      uint32, позиции полей, параллельно ids
+
+names, keys, ids и positions- готовый matching.TemplateIndex: воркер отображает
+файл в память и использует ids и positions без копирования, база не читается.
+Id снимка хранится в счетчике поколений (db_operations.mark_snapshot), по нему
+воркер проверяет, что снимок соответствует данным в базе.
+"""
+
+MAGIC = b"EKOMSNAP"
+VERSION = 2
+# magic, version, количество секций, id снимка, поколение, шаблонов, записей в ids
+HEADER = struct.Struct("<8sHH16sQQQ")
+# смещение и длина секции
+SECTION = struct.Struct("<QQ")
+SECTIONS = ("templates", "indexes", "names", "keys", "ids", "positions")
+
+
+def encode_documents(documents):
+    for document in documents:
+        yield document.raw if isinstance(document, RawBSONDocument) else bson.encode(document)
+
+
+class SnapshotWriter:
+    """
+    Пишет снимок по частям, не держа документы в памяти: шаблоны
+    (add_templates, в порядке _id), затем индексы (add_indexes), затем close.
+    Индекс шаблонов для секций names, keys, ids и positions строится
+    по мере записи шаблонов. Файл пишется рядом и заменяется целиком
+    в close, воркеры не увидят его недописанным.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._temporary = f"{path}.tmp"
+        self._file = open(self._temporary, "wb")
+        self._file.write(b"\0" * (HEADER.size + SECTION.size * len(SECTIONS)))
+        self._index = TemplateIndex()
+        self._table = []
+        self._begin_section()
+
+    def _begin_section(self):
+        self._file.write(b"\0" * (-self._file.tell() % 8))
+        self._start = self._file.tell()
+
+    def _next_section(self):
+        self._table.append((self._start, self._file.tell() - self._start))
+        if len(self._table) < len(SECTIONS):
+            self._begin_section()
+
+    def _section(self):
+        return SECTIONS[len(self._table)]
+
+    def add_templates(self, templates):
+        """
+        :args:
+            templates (iterable): Документы шаблонов в порядке _id
+        """
+        if self._section() != "templates":
+            raise ValueError("Templates must be written before indexes")
+        for template in templates:
+            self._index.add(template)
+            self._file.write(bson.encode(template))
+
+    def add_indexes(self, indexes):
+        """
+        :args:
+            indexes (iterable): Документы индексов, можно RawBSONDocument
+        """
+        if self._section() == "templates":
+            self._next_section()
+        for chunk in encode_documents(indexes):
+            self._file.write(chunk)
+
+    def close(self, generation):
+        """
+        :args:
+            generation (int): Поколение данных на момент выгрузки
+
+        :returns:
+            str: Id снимка
+        """
+        if self._section() == "templates":
+            self._next_section()
+        names, postings = self._index.postings()
+        keys, ids, positions = [], array('I'), array('I')
+        for key in sorted(postings):
+            key_ids, key_positions = postings[key]
+            keys.append([key, len(ids), len(key_ids)])
+            ids.extend(key_ids)
+            positions.extend(key_positions)
+        if sys.byteorder != "little":
+            ids.byteswap()
+            positions.byteswap()
+
+        # Конец секции indexes
+        self._next_section()
+        for chunk in (bson.encode({"names": names}), bson.encode({"keys": keys}),
+                      ids.tobytes(), positions.tobytes()):
+            self._file.write(chunk)
+            self._next_section()
+
+        snapshot_id = uuid.uuid4()
+        with self._file as file:
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, VERSION, len(SECTIONS), snapshot_id.bytes,
+                                   generation, len(names), len(ids)))
+            for start, length in self._table:
+                file.write(SECTION.pack(start, length))
+        os.replace(self._temporary, self.path)
+        return snapshot_id.hex
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._temporary)
+
+
+def write_snapshot(path, templates, indexes, generation):
+    """
+    Записывает снимок целиком, см. SnapshotWriter
+
+    :args:
+        templates (iterable): Документы шаблонов в порядке _id
+        indexes (iterable): Документы индексов, можно RawBSONDocument
+        generation (int): Поколение данных на момент выгрузки
+
+    :returns:
+        str: Id снимка
+    """
+    writer = SnapshotWriter(path)
+    try:
+        writer.add_templates(templates)
+        writer.add_indexes(indexes)
+        return writer.close(generation)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+class Snapshot:
+    """
+    Снимок, отображенный в память только для чтения.
+
+    :exception:
+        ValueError, если файл не снимок или другой версии формата
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, snapshot_id, generation, template_count, entry_count = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a snapshot")
+        if version != VERSION or count != len(SECTIONS):
+            raise ValueError(f"Unsupported snapshot version {version}")
+        self.snapshot_id = uuid.UUID(bytes=snapshot_id).hex
+        self.generation = generation
+        self.template_count = template_count
+        self.entry_count = entry_count
+        self._sections = {
+            name: SECTION.unpack_from(self._map, HEADER.size + SECTION.size * number)
+            for number, name in enumerate(SECTIONS)
+        }
+
+    def section(self, name):
+        start, length = self._sections[name]
+        return memoryview(self._map)[start:start + length]
+
+    def documents(self, name):
+        """
+        Документы секции templates или indexes по одному, RawBSONDocument
+        """
+        view = self.section(name)
+        position = 0
+        while position < len(view):
+            size = int.from_bytes(view[position:position + 4], "little")
+            yield RawBSONDocument(bytes(view[position:position + size]))
+            position += size
+
+    def postings(self):
+        """
+        Данные для TemplateIndex.load_postings. ids и positions ссылаются
+        на отображенный файл, он остается открытым, пока они используются.
+        """
+        names = bson.decode(self.section("names"))["names"]
+        ids = self.section("ids").cast("I")
+        positions = self.section("positions").cast("I")
+        if sys.byteorder != "little":
+            ids, positions = array('I', ids), array('I', positions)
+            ids.byteswap()
+            positions.byteswap()
+
+        postings = {}
+        for key, start, count in bson.decode(self.section("keys"))["keys"]:
+            postings[key] = (ids[start:start + count], positions[start:start + count])
+        return names, postings
+
+    def info(self):
+        return {
+            "snapshot_id": self.snapshot_id,
+            "generation": self.generation,
+            "templates": self.template_count,
+            "index_entries": self.entry_count,
+            "bytes": len(self._map),
+        }
+
+
+def load_index(path, template_index, snapshot_ids):
+    """
+    Загружает индекс шаблонов из снимка, если снимок соответствует данным в базе.
+
+    :args:
+        snapshot_ids (list): Id снимков из счетчика поколений, см. db_operations.get_generation_state
+
+    :returns:
+        bool: True, если индекс загружен
+    """
+    if not path or not snapshot_ids or not os.path.exists(path):
+        return False
+    snapshot = Snapshot(path)
+    if snapshot.snapshot_id not in snapshot_ids:
+        return False
+    template_index.load_postings(*snapshot.postings())
+    return True
+
+
+def export_snapshot(path):
+    """
+    Выгружает шаблоны и индексы из базы в файл.
+
+    :returns:
+        dict: Snapshot.info и marked- совпадает ли снимок с данными в базе
+            (нет, если во время выгрузки были записи)
+    """
+    generation = db.get_generation()
+    # Шаблоны читаются курсором пачками, как и индексы
+    templates = db.find_documents(Config.MONGO_COLLECTION_NAME)
+    indexes = db.find_documents(Config.INDEX_COLLECTION_NAME, raw=True)
+    snapshot_id = write_snapshot(path, templates, indexes, generation)
+    marked = db.mark_snapshot(generation, snapshot_id)
+    return {**Snapshot(path).info(), "marked": marked}
+
+
+def restore_snapshot(path):
+    """
+    Заменяет шаблоны и индексы в базе данными из файла.
+    """
+    snapshot = Snapshot(path)
+    db.restore_collections(snapshot.documents("templates"), snapshot.documents("indexes"),
+                           snapshot.snapshot_id)
+    return snapshot.info()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Снимок шаблонов и индексов")
+    parser.add_argument("command", choices=("export", "restore", "info"))
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print(Snapshot(args.path).info())
+        return
+
+    from database.connection import connect_to_database, database_status
+
+    connect_to_database()
+    if database_status() != "ready":
+        sys.exit("MongoDB is not available")
+    if args.command == "export":
+        print(export_snapshot(args.path))
+    else:
+        print(restore_snapshot(args.path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os
+import runpy
+import threading
+import pytest
+import requests
+from admission import AdmissionLimiter, Overloaded
+from database.config import Config
+from .test_setup import BASE_URL
+
+GUNICORN_CONF = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+"""
+Ограничение одновременных запросов (admission.py).
+"""
+
+
+def hold_slot(limiter, entered, release):
+    with limiter.slot():
+        entered.set()
+        release.wait()
+
+
+def test_limiter_sheds_when_queue_is_full_or_deadline_passes():
+    limiter = AdmissionLimiter("test", 1, 0, 50)
+    entered, release = threading.Event(), threading.Event()
+    holder = threading.Thread(target=hold_slot, args=(limiter, entered, release))
+    holder.start()
+    entered.wait()
+
+    with pytest.raises(Overloaded):
+        with limiter.slot():
+            pass
+    limiter.queue_size = 1
+    with pytest.raises(Overloaded):
+        with limiter.slot():
+            pass
+
+    release.set()
+    holder.join()
+    with limiter.slot():
+        pass
+    stats = limiter.stats()
+    assert stats["shed"] == {"queue_full": 1, "timeout": 1}
+    assert (stats["admitted"], stats["in_flight"], stats["waiting"]) == (2, 0, 0)
+
+
+def test_limiter_is_fifo():
+    limiter = AdmissionLimiter("test", 1, 2, 2000)
+    entered, release = threading.Event(), threading.Event()
+    holder = threading.Thread(target=hold_slot, args=(limiter, entered, release))
+    holder.start()
+    entered.wait()
+
+    order = []
+
+    def wait_slot(number):
+        with limiter.slot():
+            order.append(number)
+
+    waiters = []
+    for number in range(2):
+        waiters.append(threading.Thread(target=wait_slot, args=(number,)))
+        waiters[-1].start()
+        while limiter.waiting != number + 1:
+            pass
+
+    # Освободившееся место достается первому ожидающему, а не новому запросу
+    release.set()
+    holder.join()
+    with limiter.slot():
+        order.append("new")
+    for waiter in waiters:
+        waiter.join()
+    assert order == [0, 1, "new"]
+
+
+def test_limits_fit_gunicorn_threads():
+    """Под gthread запросы сверх лимитов и очередей отклоняются, а не ждут поток в gunicorn."""
+    settings = runpy.run_path(GUNICORN_CONF)
+    threads = settings["threads"]
+    limit, queue_size, _ = Config.ADMISSION_LIMITS["write"]
+
+    # Столько записей одновременно, сколько потоков у воркера
+    limiter = AdmissionLimiter("write", limit, queue_size, 50)
+    entered, release = threading.Event(), threading.Event()
+    holders = [threading.Thread(target=hold_slot, args=(limiter, entered, release))
+               for _ in range(limit)]
+    for holder in holders:
+        holder.start()
+    while limiter.in_flight < limit:
+        pass
+    shed = 0
+    for _ in range(threads - limit):
+        try:
+            with limiter.slot():
+                pass
+        except Overloaded:
+            shed += 1
+    release.set()
+    for holder in holders:
+        holder.join()
+    assert shed == threads - limit
+
+    with pytest.raises(RuntimeError):
+        settings["check_admission_threads"](limit)
+
+
+def test_admission_stats():
+    response = requests.get(f"{BASE_URL}/admission")
+    assert response.status_code == 200
+    stats = response.json()
+    if stats != {"enabled": False}:
+        assert set(stats) == {"write", "read", "cpu"}
+        assert all(route_class["in_flight"] >= 0 for route_class in stats.values())
@@ -0,0 +1,67 @@
+import random
+import pytest
+from database.queries import template_keys, match_pipeline
+from matching import TemplateIndex
+from .test_setup import mongo_client
+
+"""
+Подбор шаблона агрегацией (MATCH_ENGINE=aggregate) должен совпадать
+с индексом в памяти. Сравнение идет в отдельной базе MongoDB
+(Config.MONGO_URI), без нее тесты пропускаются (в CI- падают).
+"""
+
+TEST_DB_NAME = "test_aggregate_matching"
+NAMES = ["email", "phone", "date", "text", "login", "order", "comment", "birthday"]
+TYPES = ["email", "phone", "date", "text"]
+
+
+@pytest.fixture
+def collection():
+    client = mongo_client()
+    client.drop_database(TEST_DB_NAME)
+    collection = client[TEST_DB_NAME]["templates"]
+    collection.create_index("keys")
+    yield collection
+    client.drop_database(TEST_DB_NAME)
+    client.close()
+
+
+def random_template(rng, number):
+    names = rng.sample(NAMES, rng.randint(1, 5))
+    return {"name": f"Template {number}",
+            "fields": [{"name": name, "type": rng.choice(TYPES)} for name in names]}
+
+
+def test_aggregate_matches_template_index(collection):
+    rng = random.Random(16)
+    templates = [random_template(rng, number) for number in range(200)]
+    collection.insert_many([{**template, **template_keys(template)} for template in templates])
+    index = TemplateIndex()
+    index.load(templates)
+
+    for _ in range(300):
+        result_form = {name: rng.choice(TYPES) for name in rng.sample(NAMES, rng.randint(1, 6))}
+        found = next(collection.aggregate(match_pipeline(result_form)), None)
+        assert (found["name"] if found else "") == index.match(result_form), result_form
+
+
+def test_prefix_and_tie_cases(collection):
+    """Поле шаблона не с начала не засчитывается, при равенстве- более ранний _id."""
+    collection.insert_many([{**template, **template_keys(template)} for template in (
+        {"name": "Gap", "fields": [{"name": "b", "type": "text"}, {"name": "a", "type": "text"}]},
+        {"name": "First", "fields": [{"name": "a", "type": "text"}, {"name": "c", "type": "date"}]},
+        {"name": "Second", "fields": [{"name": "a", "type": "text"}]},
+    )])
+    assert next(collection.aggregate(match_pipeline({"a": "text"})))["name"] == "First"
+    assert next(collection.aggregate(match_pipeline({"a": "text", "c": "date"})))["matched"] == 2
+    assert list(collection.aggregate(match_pipeline({"b": "email"}))) == []
+
+
+def test_pipeline_structure():
+    """Без MongoDB: ранжирование и отбор, на которых держатся случаи выше."""
+    pipeline = match_pipeline({"a": "text"})
+    assert pipeline[0] == {"$match": {"keys": {"$in": ["a+text"]}}}
+    # Шаблон, у которого первое поле не из формы, не подходит
+    assert {"$match": {"matched": {"$gt": 0}}} in pipeline
+    # Больше полей с начала, при равенстве- более ранний шаблон
+    assert pipeline[-2:] == [{"$sort": {"matched": -1, "_id": 1}}, {"$limit": 1}]
@@ -0,0 +1,17 @@
+from benchmark import run_suite, compare
+
+"""
+Проверка самого бенчмарка на маленьком наборе, без замера производительности.
+"""
+
+
+def test_run_suite_reports_time_per_op():
+    results = run_suite(quick=True, min_time=0.001, only="/10t/5f")
+    assert set(results) == {"match/index/10t/5f", "match/memory/10t/5f"}
+    assert all(result["us_per_op"] > 0 for result in results.values())
+
+
+def test_compare_reports_only_slower_cases():
+    baseline = {"a": {"us_per_op": 10.0}, "b": {"us_per_op": 10.0}}
+    results = {"a": {"us_per_op": 13.0}, "b": {"us_per_op": 11.0}, "c": {"us_per_op": 99.0}}
+    assert compare(results, baseline, 0.25) == [("a", 10.0, 13.0, 1.3)]
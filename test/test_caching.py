@@ -0,0 +1,24 @@
+from caching import ResponseCache, MISSING
+
+"""
+Кэши в памяти процесса (caching.py) без обращения к серверу.
+"""
+
+
+def test_response_cache_is_bounded_by_bytes():
+    cache = ResponseCache(10)
+    cache.put("a", b"1234")
+    cache.put("b", b"5678")
+    assert cache.get("a") == b"1234"
+    # Не помещается вместе с "b"- вытесняется давно не используемое
+    cache.put("c", b"90ab")
+    assert cache.get("b") is MISSING
+    assert cache.bytes == 8
+
+    # Тело больше всего кэша не кэшируется и ничего не вытесняет
+    cache.put("d", b"x" * 11)
+    assert cache.get("d") is MISSING
+    assert cache.get("a") == b"1234"
+
+    cache.set_generation(5)
+    assert (len(cache), cache.bytes) == (0, 0)
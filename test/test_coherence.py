@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from bson import ObjectId
+from coherence import GenerationWatcher, RecentTemplates, ADDED, RESET
+from view_support import ViewState
+from admission import AdmissionLimiter
+from database.config import Config
+from database.connection import DatabaseNotReady
+
+"""
+Проверка счетчика поколений без обращения к серверу.
+"""
+
+
+def test_first_generation_does_not_reload():
+    watcher = GenerationWatcher(1000)
+    assert watcher.compare(5) is None
+    watcher.update(5)
+    assert watcher.compare(5) is None
+    assert watcher.compare(6) == ADDED
+    assert watcher.compare(6, resets=1) == RESET
+
+
+def test_checks_are_throttled():
+    watcher = GenerationWatcher(60_000)
+    assert watcher.due() is True
+    assert watcher.due() is False
+
+
+def test_own_writes_advance_generation():
+    watcher = GenerationWatcher(1000)
+    watcher.update(5)
+    assert watcher.advance(7, 2) is True
+    assert watcher.compare(7) is None
+    # Между записями был чужой шаблон- его загрузит следующая проверка
+    assert watcher.advance(10, 2) is False
+    assert watcher.compare(10) == ADDED
+    assert watcher.advance(8, 1, resets=1) is True
+    assert watcher.compare(8, resets=1) is None
+
+
+def object_id(seconds):
+    return ObjectId.from_datetime(datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=seconds))
+
+
+def test_recent_templates_overlap():
+    recent = RecentTemplates(10)
+    assert recent.since() is None
+    assert recent.add(object_id(100)) is True
+    assert recent.add(object_id(100)) is False
+    # Шаблон с меньшим _id, записанный позже, попадает в перечитываемый интервал
+    assert recent.since() == object_id(90)
+    assert recent.add(object_id(95)) is True
+    assert recent.since() == object_id(90)
+
+
+def test_recent_templates_prune():
+    recent = RecentTemplates(10)
+    for seconds in range(3000):
+        recent.add(object_id(seconds))
+    assert len(recent._ids) < 2100
+    assert recent.add(object_id(2995)) is False
+
+
+def template(name, template_id):
+    return {"_id": template_id, "name": name, "fields": [{"name": "email", "type": "email"}]}
+
+
+def test_view_state_loads_added_templates_once():
+    state = ViewState(AdmissionLimiter)
+    state.load_templates([template("first", object_id(1))], {"value": 3, "resets": 0})
+    assert state.changes({"value": 3, "resets": 0}) is None
+
+    # Шаблон этого воркера, затем перечитанный из базы вместе с чужим
+    state.templates_added([template("own", object_id(2))], [object_id(2)], 5)
+    assert state.changes({"value": 5, "resets": 0}) is None
+    assert state.changes({"value": 7, "resets": 0}) == ADDED
+    state.load_added([template("own", object_id(2)), template("other", object_id(3))],
+                     {"value": 7, "resets": 0})
+    assert len(state.template_index) == 3
+    assert state.template_index.match({"email": "email"}) == "first"
+
+    assert state.changes({"value": 8, "resets": 1}) == RESET
+    state.cleared(8)
+    assert len(state.template_index) == 0
+    assert state.changes({"value": 8, "resets": 1}) is None
+
+
+def test_view_state_after_snapshot_reloads_fully():
+    state = ViewState(AdmissionLimiter)
+    state.generation_watcher.update(3)
+    assert state.changes({"value": 4, "resets": 0}) == RESET
+
+
+def test_view_state_reset_drops_stale_index(monkeypatch):
+    monkeypatch.setattr(Config, "GENERATION_CHECK_INTERVAL_MS", 0)
+    state = ViewState(AdmissionLimiter)
+    state.load_templates([template("first", object_id(1))], {"value": 3, "resets": 0})
+    assert state.check_due() is True
+
+    # Другой воркер очистил базу: прежний индекс не используется до перезагрузки
+    assert state.begin_reload() is True
+    assert state.begin_reload() is False
+    with pytest.raises(DatabaseNotReady):
+        state.memory_index()
+    assert state.check_due() is False
+
+    state.load_templates([], {"value": 5, "resets": 1})
+    state.end_reload()
+    assert len(state.memory_index()) == 0
+    assert state.changes({"value": 5, "resets": 1}) is None
@@ -0,0 +1,48 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+from .test_setup import BASE_URL
+
+THREADS = 16
+
+
+def test_create_template_concurrent():
+    """Тест параллельного создания шаблонов с общими полями."""
+    prefix = f"concurrency_{uuid.uuid4().hex}"
+    shared_fields = [
+        {"name": f"{prefix}_email", "type": "email"},
+        {"name": f"{prefix}_phone", "type": "phone"},
+        {"name": f"{prefix}_comment", "type": "text"},
+    ]
+    templates = [
+        {"name": f"{prefix} Template {i}", "fields": shared_fields[:i % 3 + 1]}
+        for i in range(48)
+    ]
+    # Один и тот же шаблон несколько раз подряд
+    templates += [{"name": f"{prefix} Repeated", "fields": shared_fields}] * 8
+
+    def create(template):
+        return requests.post(f"{BASE_URL}/create_template", json=template).status_code
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        statuses = list(executor.map(create, templates))
+    assert statuses == [201] * len(templates)
+
+    indexes = [index for index in requests.get(f"{BASE_URL}/indexes").json()
+               if index["key"].startswith(prefix)]
+
+    # Корзины только для полей шаблонов, каждое под своим номером
+    positions = {f"{field['name']}+{field['type']}": position
+                 for position, field in enumerate(shared_fields)}
+    assert {index["key"] for index in indexes} == set(positions)
+    assert all(index["field_count"] == positions[index["key"]] + 1 for index in indexes)
+    assert all(index["count"] == len(index["entries"]) for index in indexes)
+
+    # Каждый созданный шаблон с этим полем в индексе ровно один раз
+    for key, position in positions.items():
+        entries = [entry for index in indexes if index["key"] == key for entry in index["entries"]]
+        assert len({entry["id"] for entry in entries}) == len(entries)
+        names = [entry["name"] for entry in entries]
+        expected = [template["name"] for template in templates if len(template["fields"]) > position]
+        assert sorted(names) == sorted(expected)
@@ -0,0 +1,90 @@
+import json
+import uuid
+import pytest
+import requests
+from .test_setup import BASE_URL
+
+
+def make_templates(prefix):
+    """Шаблоны с уникальными именами полей, чтобы не задеть тесты get_form."""
+    return [
+        {
+            "name": f"{prefix} Order",
+            "fields": [
+                {"name": f"{prefix}_email", "type": "email"},
+                {"name": f"{prefix}_date", "type": "date"},
+            ],
+        },
+        {
+            "name": f"{prefix} Broken",
+            "fields": [
+                {"name": f"{prefix}_phone", "type": "phone"},
+                {"name": f"{prefix}_size", "type": "number"},
+            ],
+        },
+        {
+            "fields": [{"name": f"{prefix}_text", "type": "text"}],
+        },
+    ]
+
+
+def check_response(response, prefix):
+    assert response.status_code == 201
+    result = response.json()
+    assert result["created"] == 2
+
+    order, broken, unnamed = result["templates"]
+    assert order["template_id"]
+    assert order["warnings"] == []
+    assert broken["template_id"]
+    assert len(broken["warnings"]) == 1
+    assert broken["fields"] == [{"name": f"{prefix}_phone", "type": "phone"}]
+    assert unnamed == {"error": "Template name is required"}
+
+    form = {f"{prefix}_email": "user@example.com", f"{prefix}_date": "01.01.2000"}
+    response = requests.post(f"{BASE_URL}/get_form", json=form)
+    assert response.status_code == 200
+    assert response.json()["matching_template_name"] == f"{prefix} Order"
+
+
+def test_create_templates_bulk_json():
+    """Тест создания шаблонов JSON массивом."""
+    prefix = f"bulk_{uuid.uuid4().hex}"
+    response = requests.post(f"{BASE_URL}/create_templates/bulk", json=make_templates(prefix))
+    check_response(response, prefix)
+
+
+def test_create_templates_bulk_ndjson():
+    """Тест создания шаблонов в формате NDJSON."""
+    prefix = f"bulk_{uuid.uuid4().hex}"
+    body = "\n".join(json.dumps(template) for template in make_templates(prefix))
+    response = requests.post(
+        f"{BASE_URL}/create_templates/bulk",
+        data=body,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    check_response(response, prefix)
+
+
+def test_create_templates_bulk_requires_list():
+    """Тест для запроса без списка шаблонов."""
+    response = requests.post(f"{BASE_URL}/create_templates/bulk", json={"name": "Single"})
+    assert response.status_code == 400
+
+
+def test_create_templates_bulk_malformed_field():
+    """Тест, что шаблон с полем не объектом отклоняется, а остальные создаются."""
+    prefix = f"bulk_{uuid.uuid4().hex}"
+    templates = [
+        {"name": f"{prefix} Bad", "fields": [f"{prefix}_email"]},
+        {"name": f"{prefix} Good", "fields": [{"name": f"{prefix}_email", "type": "email"}]},
+    ]
+    response = requests.post(f"{BASE_URL}/create_templates/bulk", json=templates)
+    assert response.status_code == 201
+    bad, good = response.json()["templates"]
+    assert bad == {"error": "Field 0 must be an object"}
+    assert good["template_id"]
+
+    response = requests.post(f"{BASE_URL}/create_templates/bulk", json=templates[:1])
+    assert response.status_code == 400
+    assert response.json()["templates"] == [bad]
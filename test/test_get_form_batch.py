@@ -0,0 +1,48 @@
+import pytest
+import requests
+from .test_setup import BASE_URL
+
+
+def test_get_form_batch_matches_single_route():
+    """Тест, что /get_form/batch отвечает так же, как /get_form для каждой формы."""
+    forms = [
+        {
+            "email": "user@example.com",
+            "phone": "+123456789",
+            "dob": "1990-01-01"
+        },
+        {
+            "name": "John Doe",
+            "email": "contact@example.com",
+            "message": "This is a test message."
+        },
+        {
+            "unknown_field": "some value"
+        },
+    ]
+    response = requests.post(f"{BASE_URL}/get_form/batch", json=forms)
+    assert response.status_code == 200
+    results = response.json()
+    assert len(results) == len(forms)
+
+    for form, result in zip(forms, results):
+        single = requests.post(f"{BASE_URL}/get_form", json=form)
+        assert result["status"] == single.status_code
+        assert result["result"] == single.json()
+
+
+def test_get_form_batch_empty_form():
+    """Тест, что пустая форма в пакете не ломает остальные."""
+    forms = [{}, {"info": "some text"}]
+    response = requests.post(f"{BASE_URL}/get_form/batch", json=forms)
+    assert response.status_code == 200
+    results = response.json()
+    assert results[0]["status"] == 400
+    assert results[1]["status"] == 200
+    assert results[1]["result"]["matching_template_name"] == "Simple Form"
+
+
+def test_get_form_batch_requires_list():
+    """Тест для запроса без списка форм."""
+    response = requests.post(f"{BASE_URL}/get_form/batch", json={"info": "some text"})
+    assert response.status_code == 400
@@ -0,0 +1,17 @@
+import pytest
+import requests
+from .test_setup import BASE_URL
+
+
+def test_healthz():
+    """Тест проверки живости процесса."""
+    response = requests.get(f"{BASE_URL}/healthz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_readyz():
+    """Тест готовности: база подключена, кэши загружены."""
+    response = requests.get(f"{BASE_URL}/readyz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
@@ -0,0 +1,42 @@
+import json
+import logging
+import logging_form
+from logging_form import JsonFormatter, log_request
+from database.config import Config
+
+"""
+Проверка формата журнала и выборки успешных запросов без обращения к серверу.
+"""
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_json_format_includes_extra_fields():
+    record = logging.makeLogRecord({"msg": "request", "levelname": "INFO", "status": 200, "latency_ms": 1.5})
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "request"
+    assert entry["status"] == 200
+    assert entry["latency_ms"] == 1.5
+
+
+def test_access_log_sampling(monkeypatch):
+    handler = Records()
+    logging_form.logger.addHandler(handler)
+    try:
+        monkeypatch.setattr(Config, "LOG_ACCESS_SAMPLE_RATE", 0.0)
+        log_request("GET", "/templates", "127.0.0.1", 200, 0.01)
+        log_request("GET", "/templates", "127.0.0.1", 500, 0.01)
+        assert [record.status for record in handler.records] == [500]
+
+        monkeypatch.setattr(Config, "LOG_ACCESS_SAMPLE_RATE", 1.0)
+        log_request("GET", "/templates", "127.0.0.1", 200, 0.01)
+        assert [record.status for record in handler.records] == [500, 200]
+    finally:
+        logging_form.logger.removeHandler(handler)
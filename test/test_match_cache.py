@@ -0,0 +1,47 @@
+import uuid
+import requests
+from metrics import WORKER_HEADER
+from .test_setup import BASE_URL, eventually
+
+
+def one_worker_hits(session, field):
+    """
+    Два подбора одной формы и счетчик попаданий до и после второго.
+    Кэш у каждого воркера свой, поэтому запросы идут через одно
+    keep-alive соединение и считаются, только если их обслужил один воркер.
+
+    :returns:
+        tuple: (попадания до, попадания после), None- ответили разные воркеры
+    """
+    responses = [
+        session.post(f"{BASE_URL}/get_form", json={field: "first"}),
+        session.get(f"{BASE_URL}/match/cache"),
+        session.post(f"{BASE_URL}/get_form", json={field: "second"}),
+        session.get(f"{BASE_URL}/match/cache"),
+    ]
+    assert [response.status_code for response in responses] == [404, 200, 404, 200]
+    if len({response.headers[WORKER_HEADER] for response in responses}) > 1:
+        return None
+    return responses[1].json()["hits"], responses[3].json()["hits"]
+
+
+def test_match_cache_hits_and_invalidation():
+    """Тест кэша подбора: форма того же вида берется из кэша, "не найден"
+    тоже кэшируется, а новый шаблон сбрасывает кэш."""
+    with requests.Session() as session:
+        for _ in range(5):
+            field = f"field_{uuid.uuid4().hex}"
+            hits = one_worker_hits(session, field)
+            if hits is not None:
+                break
+        assert hits is not None, "Requests of one connection were served by different workers"
+        assert hits[1] == hits[0] + 1
+
+    template = {"name": f"Cache {field}", "fields": [{"name": field, "type": "text"}]}
+    assert requests.post(f"{BASE_URL}/create_template", json=template).status_code == 201
+
+    # Воркер, у которого форма в кэше как "не найдена", мог еще не узнать о шаблоне
+    response = eventually(lambda: requests.post(f"{BASE_URL}/get_form", json={field: "third"}),
+                          lambda response: response.status_code == 200)
+    assert response.status_code == 200
+    assert response.json() == {"matching_template_name": template["name"]}
@@ -0,0 +1,102 @@
+import random
+from matching import TemplateIndex
+
+"""
+Сравнение TemplateIndex.match с исходным перебором /get_form
+(build_index + check_fields до перехода на индекс в памяти).
+
+Намеренные отличия от исходного перебора:
+    - при равном числе совпавших первых полей побеждает более ранний шаблон,
+      а не первый встреченный в порядке полей формы;
+    - исходный перебор запоминал имя шаблона при первой проверке префикса
+      и пропускал остальные префиксы того же шаблона под другими полями
+      формы, даже подходящие, возвращая "" или шаблон хуже.
+Шаблоны в тесте с уникальными именами: исходный build_index не добавлял
+в индекс второй шаблон с тем же именем.
+"""
+
+NAMES = ["email", "phone", "date", "text", "login", "order", "comment", "birthday"]
+TYPES = ["email", "phone", "date", "text"]
+
+
+def legacy_index(templates):
+    """Коллекция индексов исходного build_index: под ключом поля- префикс шаблона до этого поля."""
+    index = {}
+    for template in templates:
+        for position, field in enumerate(template["fields"]):
+            entries = index.setdefault(f"{field['name']}+{field['type']}", [])
+            if not any(entry["name"] == template["name"] for entry in entries):
+                entries.append({"name": template["name"], "fields": template["fields"][:position + 1]})
+    return index
+
+
+def legacy_check_fields(matching_template, form_fields):
+    if len(matching_template["fields"]) > len(form_fields):
+        return False
+    return all(field["name"] in form_fields and form_fields[field["name"]] == field["type"]
+               for field in matching_template["fields"])
+
+
+def legacy_match(index, result_form):
+    """Исходный цикл get_form."""
+    template_names = set()
+    potential_template_name = ""
+    max_count_fields = 0
+    for field_name, field_type in result_form.items():
+        for template in index.get(f"{field_name}+{field_type}", []):
+            if template["name"] not in template_names and len(template["fields"]) > max_count_fields:
+                template_names.add(template["name"])
+                if legacy_check_fields(template, result_form):
+                    potential_template_name = template["name"]
+                    max_count_fields = len(template["fields"])
+    return potential_template_name
+
+
+def leading_fields(template, result_form):
+    count = 0
+    for field in template["fields"]:
+        if result_form.get(field["name"]) != field["type"]:
+            break
+        count += 1
+    return count
+
+
+def random_template(rng, number):
+    names = rng.sample(NAMES, rng.randint(1, 5))
+    return {"name": f"Template {number}",
+            "fields": [{"name": name, "type": rng.choice(TYPES)} for name in names]}
+
+
+def test_template_index_against_legacy_scan():
+    rng = random.Random(1)
+    templates = [random_template(rng, number) for number in range(300)]
+    by_name = {template["name"]: template for template in templates}
+    index = TemplateIndex()
+    index.load(templates)
+    legacy = legacy_index(templates)
+
+    differences = {"tie": 0, "skipped": 0}
+    for _ in range(3000):
+        result_form = {name: rng.choice(TYPES) for name in rng.sample(NAMES, rng.randint(1, 6))}
+        expected = legacy_match(legacy, result_form)
+        found = index.match(result_form)
+
+        # Правило индекса: наибольшее число первых полей, при равенстве- более ранний
+        scores = [leading_fields(template, result_form) for template in templates]
+        best = max(scores)
+        assert found == (templates[scores.index(best)]["name"] if best else ""), result_form
+
+        if found == expected:
+            continue
+        assert found, result_form
+        if expected and leading_fields(by_name[expected], result_form) == best:
+            differences["tie"] += 1
+        else:
+            # Исходный перебор уже видел этот шаблон под другим полем формы
+            # с другим префиксом и пропустил лучший
+            form_keys = {f"{name}+{field_type}" for name, field_type in result_form.items()}
+            seen = [entry for key in form_keys for entry in legacy.get(key, []) if entry["name"] == found]
+            assert len(seen) > 1, result_form
+            differences["skipped"] += 1
+
+    assert differences["tie"] and differences["skipped"], differences
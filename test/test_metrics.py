@@ -0,0 +1,58 @@
+import json
+import requests
+import metrics
+from metrics import Counter, Gauge, Histogram
+from database.config import Config
+from .test_setup import BASE_URL, eventually
+
+
+def test_metrics_report_get_form_stages():
+    """Тест, что после /get_form в /metrics есть время запроса и его этапов."""
+    response = requests.post(f"{BASE_URL}/get_form", json={"info": "metrics"})
+    assert response.status_code == 200
+
+    # Метрики другого воркера попадают в /metrics через METRICS_FLUSH_INTERVAL_MS
+    response = eventually(lambda: requests.get(f"{BASE_URL}/metrics"),
+                          lambda response: 'http_request_duration_seconds_count{route="/get_form"' in response.text)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain")
+
+    body = response.text
+    assert '# TYPE http_request_duration_seconds histogram' in body
+    assert 'http_request_duration_seconds_count{route="/get_form",method="POST",status="200"}' in body
+    for stage in ("validation", "matching", "serialization"):
+        assert f'stage_duration_seconds_count{{route="/get_form",stage="{stage}"' in body
+    assert 'get_form_templates_scanned_total{route="/get_form"}' in body
+
+
+def test_metrics_of_all_workers(tmp_path, monkeypatch):
+    """Тест, что /metrics складывает счетчики воркеров, а gauge выводит по воркерам."""
+    monkeypatch.setattr(Config, "METRICS_MULTIPROCESS_DIR", str(tmp_path))
+    monkeypatch.setattr(Config, "SERVER_WORKER_ID", "0")
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    counter = Counter("test_workers_total", "Test counter", ("route",))
+    gauge = Gauge("test_workers_in_flight", "Test gauge")
+    histogram = Histogram("test_workers_seconds", "Test histogram", buckets=(0.1, 1.0))
+
+    counter.inc(2, "/get_form")
+    gauge.inc(3)
+    histogram.observe(0.5)
+    other = {"worker": "1", "metrics": {
+        "test_workers_total": {"kind": "counter", "values": [[["/get_form"], 5]]},
+        "test_workers_in_flight": {"kind": "gauge", "values": [[[], 1]]},
+        "test_workers_seconds": {"kind": "histogram", "values": [[[], [[1, 0, 0], 0.05]]]},
+    }}
+    (tmp_path / "metrics.1.json").write_text(json.dumps(other))
+
+    body = metrics.render()
+    assert 'test_workers_total{route="/get_form"} 7' in body
+    assert 'test_workers_in_flight{worker="0"} 3' in body
+    assert 'test_workers_in_flight{worker="1"} 1' in body
+    assert 'test_workers_seconds_bucket{le="0.1"} 1' in body
+    assert 'test_workers_seconds_count 2' in body
+
+    # Счетчики завершившегося воркера остаются в сумме, gauge- нет
+    metrics.mark_worker_dead(1)
+    body = metrics.render()
+    assert 'test_workers_total{route="/get_form"} 7' in body
+    assert 'worker="1"' not in body
@@ -0,0 +1,73 @@
+import json
+import pytest
+import requests
+from database.config import Config
+from metrics import stage
+from profiling import RequestProfile, start_profile, remove_old_reports, PROFILE_HEADER
+from .test_setup import BASE_URL
+
+"""
+Профилирование запросов (profiling.py).
+"""
+
+
+def test_profile_reports_stages_and_functions(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PROFILE_DIR", str(tmp_path))
+
+    def view():
+        with stage("mongo", "find_templates"):
+            sum(range(1000))
+        with stage("mongo", "find_templates"):
+            pass
+        with stage("validation"):
+            sorted(range(1000), reverse=True)
+        return "done"
+
+    profile = RequestProfile("/get_form")
+    assert profile.run(view) == "done"
+
+    header = json.loads(profile.report("POST", 200))
+    assert header["mongo_calls"] == 2
+    assert set(header["stages_ms"]) == {"mongo", "validation"}
+    assert any("view" in function for function, _ in header["functions"])
+
+    report = json.loads((tmp_path / header["file"]).read_text())
+    assert report["route"] == "/get_form" and report["status"] == 200
+    assert report["mongo"]["find_templates"]["calls"] == 2
+
+
+def test_old_reports_are_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(Config, "PROFILE_MAX_FILES", 3)
+    (tmp_path / "profile.20000101-000000.1.1.json").write_text("{}")
+    (tmp_path / "notes.txt").write_text("")
+
+    files = [json.loads(RequestProfile("/get_form").report("GET", 200))["file"] for _ in range(4)]
+    remaining = sorted(path.name for path in tmp_path.iterdir())
+    assert "profile.20000101-000000.1.1.json" not in remaining
+    assert files[-1] in remaining and "notes.txt" in remaining
+    assert len(remaining) == 4
+
+    remove_old_reports(str(tmp_path), 0)
+    assert [path.name for path in tmp_path.iterdir()] == ["notes.txt"]
+
+
+def test_profile_is_opt_in(monkeypatch):
+    monkeypatch.setattr(Config, "PROFILE_ENABLED", False)
+    monkeypatch.setattr(Config, "PROFILE_SAMPLE_RATE", 0)
+    assert start_profile("/get_form", {PROFILE_HEADER: "1"}) is None
+
+    monkeypatch.setattr(Config, "PROFILE_ENABLED", True)
+    assert start_profile("/get_form", {}) is None
+    assert start_profile("/get_form", {PROFILE_HEADER: "1"}) is not None
+
+
+def test_profile_header():
+    """Тест сводки профиля в ответе /get_form, если сервер запущен с PROFILE_ENABLED."""
+    response = requests.post(f"{BASE_URL}/get_form", json={"info": "profile"},
+                             headers={PROFILE_HEADER: "1"})
+    assert response.status_code == 200
+    if PROFILE_HEADER not in response.headers:
+        pytest.skip("Profiling is disabled on the server")
+    summary = json.loads(response.headers[PROFILE_HEADER])
+    assert "validation" in summary["stages_ms"] and summary["total_ms"] > 0
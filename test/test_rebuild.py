@@ -0,0 +1,152 @@
+import random
+import pytest
+from database import db_operations as db
+from database.config import Config
+from database.connection import initialize_collection
+from database.queries import group_bucket_entries, index_rebuild_pipeline
+from matching import index_entries
+from rebuild import index_drift, rebuild_indexes
+from .test_setup import mongo_client
+
+"""
+Перестройка коллекции индексов (rebuild.py).
+"""
+
+TEST_DB_NAME = "test_rebuild"
+
+
+def test_index_drift():
+    current = [
+        {"key": "a+text", "field_count": 1, "entries": [{"id": 1, "name": "A"}]},
+        {"key": "a+text", "field_count": 1, "entries": [{"id": 2, "name": "B"}]},
+        {"key": "b+text", "field_count": 2, "entries": [{"id": 2, "name": "B"}]},
+        {"key": "c+text", "field_count": 1, "entries": [{"id": 3, "name": "C"}]},
+        {"key": "e+text", "templates": [{"name": "E", "fields": []}]},
+    ]
+    rebuilt = [
+        {"key": "a+text", "field_count": 1, "entries": [{"id": 1, "name": "A"}, {"id": 2, "name": "B"}]},
+        {"key": "c+text", "field_count": 1, "entries": [{"id": 3, "name": "C"}, {"id": 4, "name": "D"}]},
+        {"key": "d+text", "field_count": 2, "entries": [{"id": 4, "name": "D"}]},
+    ]
+    drift = index_drift(current, rebuilt)
+    assert (drift["keys"], drift["missing"], drift["extra"], drift["stale"]) == (3, 1, 2, 1)
+    assert drift["examples"] == {"missing": [["d+text", 2]], "extra": [["b+text", 2], ["e+text", 0]],
+                                 "stale": [["c+text", 1]]}
+
+
+def test_pipeline_matches_incremental_index(monkeypatch):
+    """Агрегация строит те же корзины, что create_template по одному. Нужен MongoDB."""
+    client = mongo_client()
+    # Несколько корзин на ключ
+    monkeypatch.setattr(Config, "INDEX_BUCKET_SIZE", 7)
+    client.drop_database(TEST_DB_NAME)
+    database = client[TEST_DB_NAME]
+    try:
+        rng = random.Random(20)
+        names = ["email", "phone", "date", "text", "login"]
+        templates = [{"name": f"Template {rng.randint(0, 30)}",
+                      "fields": [{"name": name, "type": rng.choice(["email", "text"])}
+                                 for name in rng.sample(names, rng.randint(1, 4))]}
+                     for _ in range(100)]
+        template_ids = database.templates.insert_many([dict(template) for template in templates]).inserted_ids
+
+        list(database.templates.aggregate(index_rebuild_pipeline("rebuilt")))
+
+        expected = group_bucket_entries(entry for template, template_id in zip(templates, template_ids)
+                                        for entry in index_entries(template, template_id))
+        rebuilt = [(document["key"], document["field_count"], document["entries"])
+                   for document in database.rebuilt.find()]
+        assert all(document["count"] == len(document["entries"]) for document in database.rebuilt.find())
+        def order(bucket):
+            return bucket[0], bucket[1], bucket[2][0]["id"]
+
+        assert sorted(rebuilt, key=order) == sorted(expected, key=order)
+    finally:
+        client.drop_database(TEST_DB_NAME)
+        client.close()
+
+
+
+@pytest.fixture
+def rebuild_database(monkeypatch):
+    """db_operations на отдельной базе с маленькими корзинами. Нужен MongoDB."""
+    client = mongo_client()
+    monkeypatch.setattr(Config, "INDEX_BUCKET_SIZE", 5)
+    client.drop_database(TEST_DB_NAME)
+    database = client[TEST_DB_NAME]
+    monkeypatch.setattr(db, "get_database", lambda: database)
+    monkeypatch.setattr(db, "get_read_database", lambda: database)
+    initialize_collection(database)
+    yield database
+    client.drop_database(TEST_DB_NAME)
+    client.close()
+
+
+def create_templates(rng, count):
+    for _ in range(count):
+        template = {"name": f"Template {rng.randint(0, 9)}", "fields": [
+            {"name": name, "type": "text"} for name in rng.sample(["a", "b", "c", "d"], rng.randint(1, 3))]}
+        template_id = db.create_form_template(dict(template))
+        db.build_indexes(index_entries(template, template_id))
+
+
+def check_buckets(database):
+    """Ссылка на шаблон в корзинах ключа одна, неполная корзина у ключа одна."""
+    groups = {}
+    for bucket in database[Config.INDEX_COLLECTION_NAME].find():
+        assert bucket["count"] == len(bucket["entries"])
+        groups.setdefault((bucket["key"], bucket["field_count"]), []).append(bucket)
+    for group in groups.values():
+        ids = [entry["id"] for bucket in group for entry in bucket["entries"]]
+        assert len(ids) == len(set(ids))
+        assert sum(bucket["count"] < Config.INDEX_BUCKET_SIZE for bucket in group) <= 1
+
+
+def test_rebuild_with_concurrent_creates(rebuild_database, monkeypatch):
+    """
+    Шаблоны, созданные на каждом шаге перестройки, попадают в новую
+    коллекцию индексов ровно один раз.
+    """
+    rng = random.Random(22)
+    create_templates(rng, 40)
+
+    rebuild_index_collection, swap_index_collection = db.rebuild_index_collection, db.swap_index_collection
+
+    def rebuild(target):
+        # Шаблон успевает и в агрегацию, и в перечитывание после замены
+        create_templates(rng, 3)
+        rebuild_index_collection(target)
+        # Запись в старую коллекцию, которая будет заменена
+        create_templates(rng, 3)
+
+    def swap(source):
+        swap_index_collection(source)
+        # Запись уже в новую коллекцию, до перечитывания
+        create_templates(rng, 3)
+
+    monkeypatch.setattr(db, "rebuild_index_collection", rebuild)
+    monkeypatch.setattr(db, "swap_index_collection", swap)
+    report = rebuild_indexes()
+    assert report["swapped"] and report["caught_up"] >= 9
+    monkeypatch.setattr(db, "rebuild_index_collection", rebuild_index_collection)
+
+    check_buckets(rebuild_database)
+    db.rebuild_index_collection("expected")
+    drift = index_drift(db.find_indexes_by_key(Config.INDEX_COLLECTION_NAME), db.find_indexes_by_key("expected"))
+    assert (drift["missing"], drift["extra"], drift["stale"]) == (0, 0, 0), drift
+
+
+def test_concurrent_writes_share_open_bucket(rebuild_database):
+    """
+    Запись, для которой не нашлось неполной корзины с местом, не создает
+    вторую неполную: ссылки добавляются в существующую по одной.
+    """
+    entries = [("a+text", 1, {"id": template_id, "name": "A"}) for template_id in range(8)]
+    db.build_indexes(entries[:3])
+    # Вторая запись в ключ не помещается в неполную корзину (3 + 4 > 5)
+    db.build_indexes(entries[3:7])
+    # Повторная запись тех же ссылок ничего не меняет
+    db.build_indexes(entries)
+    check_buckets(rebuild_database)
+    buckets = list(rebuild_database[Config.INDEX_COLLECTION_NAME].find().sort("count", -1))
+    assert [bucket["count"] for bucket in buckets] == [5, 3]
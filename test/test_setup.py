@@ -1,7 +1,50 @@
+import os
+import time
 import pytest
 import requests
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from database.config import Config
 
 BASE_URL = "http://127.0.0.1:5000"
+# Записи другого воркера gunicorn видны не сразу, а через
+# GENERATION_CHECK_INTERVAL_MS, см. README, раздел 11
+CONVERGENCE_TIMEOUT_S = 5.0
+
+
+def eventually(send, accept, timeout=CONVERGENCE_TIMEOUT_S):
+    """
+    Повторяет запрос, пока ответ не подойдет или не выйдет время.
+
+    :args:
+        send (callable): Отправляет запрос и возвращает ответ
+        accept (callable): Подходит ли ответ
+
+    :returns:
+        requests.Response: Последний ответ
+    """
+    deadline = time.monotonic() + timeout
+    response = send()
+    while not accept(response) and time.monotonic() < deadline:
+        time.sleep(0.1)
+        response = send()
+    return response
+
+
+def mongo_client():
+    """
+    Клиент MongoDB (Config.MONGO_URI) для тестов, которым нужна база.
+    Без MongoDB тест пропускается, а при TEST_REQUIRE_MONGO=1 (в CI) падает.
+    """
+    client = MongoClient(Config.MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        client.close()
+        if os.getenv("TEST_REQUIRE_MONGO") == "1":
+            raise
+        pytest.skip("MongoDB is not available")
+    return client
 
 
 # запускается ровно один раз перед тестами get_form
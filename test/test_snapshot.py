@@ -0,0 +1,104 @@
+import pytest
+import requests
+from database import db_operations as db
+from database.config import Config
+from database.connection import initialize_collection
+from matching import TemplateIndex, index_entries
+from snapshot import Snapshot, write_snapshot, load_index, export_snapshot, restore_snapshot
+from .test_setup import BASE_URL, mongo_client
+
+"""
+Снимок шаблонов и индексов (snapshot.py).
+"""
+
+TEMPLATES = [
+    {"name": "Contact", "fields": [{"name": "name", "type": "text"}, {"name": "email", "type": "email"}]},
+    {"name": "Email", "fields": [{"name": "email", "type": "email"}]},
+    {"name": "Event", "fields": [{"name": "title", "type": "text"}, {"name": "date", "type": "date"}]},
+]
+
+TEST_DB_NAME = "test_snapshot"
+
+
+def test_index_from_snapshot_matches_like_loaded_one(tmp_path):
+    path = tmp_path / "templates.snapshot"
+    snapshot_id = write_snapshot(str(path), TEMPLATES, [], 3)
+    expected = TemplateIndex()
+    expected.load(TEMPLATES)
+
+    index = TemplateIndex()
+    assert not load_index(str(path), index, ["other"])
+    assert load_index(str(path), index, [snapshot_id])
+    for form in ({"email": "email"}, {"name": "text", "email": "email"}, {"title": "text"}, {"date": "date"}):
+        assert index.match(form) == expected.match(form)
+
+    # Добавление шаблона после загрузки из снимка
+    index.add({"name": "Date", "fields": [{"name": "date", "type": "date"}]})
+    assert index.match({"date": "date"}) == "Date"
+    assert Snapshot(str(path)).info()["templates"] == 3
+
+
+def test_snapshot_endpoint(tmp_path):
+    response = requests.get(f"{BASE_URL}/snapshot")
+    assert response.status_code == 200
+    path = tmp_path / "templates.snapshot"
+    path.write_bytes(response.content)
+
+    snapshot = Snapshot(str(path))
+    templates = requests.get(f"{BASE_URL}/templates").json()
+    assert sorted(document["name"] for document in snapshot.documents("templates")) == \
+        sorted(template["name"] for template in templates)
+    assert snapshot.info()["index_entries"] > 0
+
+
+@pytest.fixture
+def snapshot_database(monkeypatch):
+    """db_operations на отдельной базе. Нужен MongoDB."""
+    client = mongo_client()
+    client.drop_database(TEST_DB_NAME)
+    database = client[TEST_DB_NAME]
+    monkeypatch.setattr(db, "get_database", lambda: database)
+    monkeypatch.setattr(db, "get_read_database", lambda: database)
+    initialize_collection(database)
+    yield database
+    client.drop_database(TEST_DB_NAME)
+    client.close()
+
+
+def create_templates(templates):
+    template_ids = db.create_form_templates([dict(template) for template in templates])
+    db.build_indexes([entry for template, template_id in zip(templates, template_ids)
+                      for entry in index_entries(template, template_id)])
+
+
+def template_names(database):
+    return sorted(template["name"] for template in database[Config.MONGO_COLLECTION_NAME].find())
+
+
+def test_restore_replaces_collections_after_loading(snapshot_database, tmp_path):
+    path = str(tmp_path / "templates.snapshot")
+    create_templates(TEMPLATES)
+    assert export_snapshot(path)["marked"]
+    create_templates([{"name": "Date", "fields": [{"name": "date", "type": "date"}]}])
+    index_count = snapshot_database[Config.INDEX_COLLECTION_NAME].count_documents({})
+
+    def interrupted(documents):
+        yield from documents
+        raise OSError("snapshot is truncated")
+
+    # Неудачная загрузка не трогает текущие коллекции
+    snapshot = Snapshot(path)
+    with pytest.raises(OSError):
+        db.restore_collections(snapshot.documents("templates"), interrupted(snapshot.documents("indexes")),
+                               snapshot.snapshot_id)
+    assert template_names(snapshot_database) == ["Contact", "Date", "Email", "Event"]
+    assert snapshot_database[Config.INDEX_COLLECTION_NAME].count_documents({}) == index_count
+    assert not any(name.endswith(Config.SNAPSHOT_RESTORE_SUFFIX)
+                   for name in snapshot_database.list_collection_names())
+
+    restore_snapshot(path)
+    assert template_names(snapshot_database) == ["Contact", "Email", "Event"]
+    assert snapshot_database[Config.INDEX_COLLECTION_NAME].count_documents({}) == \
+        len(list(snapshot.documents("indexes")))
+    assert db.get_generation_state()["snapshots"] == [snapshot.snapshot_id]
+    assert "keys_1" in snapshot_database[Config.MONGO_COLLECTION_NAME].index_information()
@@ -0,0 +1,129 @@
+import json
+import time
+import uuid
+import pytest
+import requests
+from bson import decode_all
+from .test_setup import BASE_URL, eventually
+
+
+@pytest.mark.parametrize("path", ["/templates", "/indexes"])
+def test_pagination_matches_full_list(path):
+    """Тест, что постраничная выдача отдает тот же список, что и без параметров."""
+    full = requests.get(f"{BASE_URL}{path}").json()
+
+    documents = []
+    params = {"limit": 2}
+    while True:
+        response = requests.get(f"{BASE_URL}{path}", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        documents += page["items"]
+        if not page["next_after"]:
+            break
+        params["after"] = page["next_after"]
+
+    assert sorted(document["_id"] for document in documents) == sorted(document["_id"] for document in full)
+
+
+@pytest.mark.parametrize("path", ["/templates", "/indexes"])
+def test_ndjson_stream(path):
+    """Тест потоковой выдачи NDJSON."""
+    full = requests.get(f"{BASE_URL}{path}").json()
+
+    response = requests.get(f"{BASE_URL}{path}", params={"format": "ndjson"}, stream=True)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    documents = [json.loads(line) for line in response.iter_lines() if line]
+
+    assert sorted(document["_id"] for document in documents) == sorted(document["_id"] for document in full)
+
+
+def test_pagination_invalid_params():
+    """Тест для некорректных параметров."""
+    assert requests.get(f"{BASE_URL}/templates", params={"after": "not-an-id"}).status_code == 400
+    assert requests.get(f"{BASE_URL}/templates", params={"limit": 0}).status_code == 400
+
+
+def test_fields_projection():
+    """Тест выдачи только выбранных полей."""
+    templates = requests.get(f"{BASE_URL}/templates", params={"fields": "name"}).json()
+    assert templates and all(set(template) == {"_id", "name"} for template in templates)
+
+    indexes = requests.get(f"{BASE_URL}/indexes", params={"fields": "key,entries.name"}).json()
+    for index in indexes:
+        assert set(index) == {"_id", "key", "entries"}
+        assert all(set(entry) == {"name"} for entry in index["entries"])
+
+    assert requests.get(f"{BASE_URL}/templates", params={"fields": "keys"}).status_code == 400
+    assert requests.get(f"{BASE_URL}/indexes", params={"fields": "entries,entries.name"}).status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/templates", "/indexes"])
+def test_bson_output(path):
+    """Тест выдачи BSON: те же документы, что и в JSON."""
+    full = requests.get(f"{BASE_URL}{path}").json()
+
+    response = requests.get(f"{BASE_URL}{path}", headers={"Accept": "application/bson"})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/bson"
+    documents = decode_all(response.content)
+
+    assert sorted(str(document["_id"]) for document in documents) == sorted(document["_id"] for document in full)
+
+
+@pytest.mark.parametrize("path, fields", [("/templates", None), ("/indexes", None), ("/indexes", "key,entries.name")])
+def test_bson_and_json_documents_agree(path, fields):
+    """Тест, что BSON (байты из MongoDB без разбора) и JSON (документы,
+    разобранные драйвером) отдают одни и те же документы, с учетом fields."""
+    params = {"fields": fields} if fields else {}
+    documents = requests.get(f"{BASE_URL}{path}", params=params).json()
+    response = requests.get(f"{BASE_URL}{path}", params={**params, "format": "bson"})
+    assert response.status_code == 200
+    raw_documents = [json.loads(json.dumps(document, default=str)) for document in decode_all(response.content)]
+
+    def by_id(document):
+        return document["_id"]
+
+    assert sorted(raw_documents, key=by_id) == sorted(documents, key=by_id)
+
+
+def wait_for_etag(path):
+    # После записи воркер не ставит ETag, пока не перечитает поколение данных
+    for _ in range(20):
+        response = requests.get(f"{BASE_URL}{path}")
+        if "ETag" in response.headers:
+            return response
+        time.sleep(0.2)
+    pytest.skip("Listing cache is disabled on the server")
+
+
+@pytest.mark.parametrize("path", ["/templates", "/indexes"])
+def test_conditional_get(path):
+    """Тест ETag: 304 для неизмененных данных, gzip с тем же содержимым."""
+    response = wait_for_etag(path)
+    etag = response.headers["ETag"]
+
+    not_modified = requests.get(f"{BASE_URL}{path}", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["ETag"] == etag
+
+    compressed = requests.get(f"{BASE_URL}{path}", headers={"Accept-Encoding": "gzip"})
+    assert compressed.json() == response.json()
+    assert requests.get(f"{BASE_URL}{path}", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_conditional_get_after_write():
+    """Тест, что после создания шаблона прежний ETag не дает 304."""
+    etag = wait_for_etag("/templates").headers["ETag"]
+    template = {"name": f"etag_{uuid.uuid4().hex}", "fields": [{"name": "etag", "type": "text"}]}
+    assert requests.post(f"{BASE_URL}/create_template", json=template).status_code == 201
+
+    # Воркер, ответивший на запрос, узнает о чужой записи при проверке поколения
+    response = eventually(
+        lambda: requests.get(f"{BASE_URL}/templates", headers={"If-None-Match": etag}),
+        lambda response: response.status_code == 200
+        and template["name"] in {document["name"] for document in response.json()})
+    assert response.status_code == 200
+    assert template["name"] in {document["name"] for document in response.json()}
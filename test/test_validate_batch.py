@@ -0,0 +1,58 @@
+import json
+import pytest
+import requests
+from validators import validate_batch, validate_ndjson
+from .test_setup import BASE_URL
+
+VALUES = ["user@example.com", "not-an-email", "+7 999 123 45 67", "31.02.2024",
+          "2024-02-29", "user@example.com", 42, None, ""]
+
+
+@pytest.mark.parametrize("kind", ["email", "phone", "date"])
+def test_batch_matches_single_route(kind):
+    """Тест, что пакетная проверка отвечает так же, как одиночная для каждого значения."""
+    response = requests.post(f"{BASE_URL}/validate/{kind}/batch", json=VALUES)
+    assert response.status_code == 200
+    results = response.json()
+    assert [result[kind] for result in results] == VALUES
+
+    for value, result in zip(VALUES, results):
+        if not value:
+            continue
+        single = requests.post(f"{BASE_URL}/validate/{kind}", json={kind: value}).json()
+        assert result["is_valid"] == single["is_valid"]
+
+
+def test_classify():
+    response = requests.post(f"{BASE_URL}/validate/classify", json=VALUES)
+    assert response.status_code == 200
+    assert [result["type"] for result in response.json()] == \
+        ["email", "text", "phone", "text", "date", "email", "text", "text", "text"]
+
+
+def test_ndjson_stream():
+    """Тест потоковой проверки NDJSON с некорректной строкой."""
+    body = "\n".join(json.dumps(value) for value in VALUES[:3]) + "\n{broken\n\n" + json.dumps(VALUES[0])
+    response = requests.post(f"{BASE_URL}/validate/email/batch", data=body,
+                             headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line.get("is_valid") for line in lines] == [True, False, False, None, True]
+    assert lines[3]["error"] == "Invalid JSON"
+
+
+def test_batch_limits():
+    assert requests.post(f"{BASE_URL}/validate/email/batch", json=[]).status_code == 400
+    assert requests.post(f"{BASE_URL}/validate/email/batch", json={"email": "a@b.co"}).status_code == 400
+    assert requests.post(f"{BASE_URL}/validate/text/batch", json=["a"]).status_code == 404
+
+
+def test_ndjson_deduplicates_across_chunks():
+    seen = {}
+    first = validate_ndjson("phone", [b'"+7 999 123 45 67"'], seen)
+    second = validate_ndjson("phone", [b'"+7 999 123 45 67"', b'"x"'], seen)
+    assert first == '{"phone": "+7 999 123 45 67", "is_valid": true}\n'
+    assert second.splitlines()[0] + "\n" == first
+    assert seen == {"+7 999 123 45 67": True, "x": False}
+    assert validate_batch("classify", ["2024-01-01"]) == [{"value": "2024-01-01", "type": "date"}]
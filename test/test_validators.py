@@ -0,0 +1,156 @@
+import random
+import re
+from datetime import datetime
+import pytest
+from validators import validate_field, validate_email, validate_phone, validate_date, VALIDATOR_CACHES
+from database.config import Config
+
+"""
+Сравнение валидаторов с прежней реализацией на большом наборе значений.
+Прежняя реализация скопирована сюда без изменений.
+"""
+
+EMAIL_REGEX = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+PHONE_REGEX = r'^\+7 \d{3} \d{3} \d{2} \d{2}$'
+DATE_REGEX = r'^(\d{2}\.\d{2}\.\d{4}|\d{4}-\d{2}-\d{2})$'
+
+CORPUS_SIZE = 200_000
+
+
+def reference_validate_field(field_value):
+    types_order = ["date", "phone", "email"]
+    validators = {
+        "email": reference_validate_email,
+        "phone": reference_validate_phone,
+        "date": reference_validate_date
+    }
+    for type_ in types_order:
+        if validators[type_](field_value):
+            return type_
+    return "text"
+
+
+def reference_validate_email(email):
+    if not isinstance(email, str):
+        return False
+    if not re.fullmatch(EMAIL_REGEX, email):
+        return False
+    return True
+
+
+def reference_validate_phone(phone):
+    if not isinstance(phone, str):
+        return False
+    if not re.fullmatch(PHONE_REGEX, phone):
+        return False
+    return True
+
+
+def reference_validate_date(date):
+    if not isinstance(date, str):
+        return False
+
+    if not re.fullmatch(DATE_REGEX, date):
+        return False
+
+    for date_format in ('%d.%m.%Y', '%Y-%m-%d'):
+        try:
+            datetime.strptime(date, date_format)
+            return True
+        except ValueError:
+            continue
+
+    return False
+
+
+# Цифры других алфавитов тоже подходят под \d
+DIGITS = "0123456789" + "٠١٢٣٤٥٦٧٨٩" + "०१२३"
+TEXT_CHARS = "abcXYZ019 .-+@_%" + "яЖ٣"
+
+
+def digits(rnd, count):
+    if rnd.random() < 0.05:
+        return "".join(rnd.choice(DIGITS) for _ in range(count))
+    return "".join(rnd.choice("0123456789") for _ in range(count))
+
+
+def random_date(rnd):
+    day = rnd.choice([f"{rnd.randint(0, 39):02d}", digits(rnd, 2)])
+    month = rnd.choice([f"{rnd.randint(0, 19):02d}", digits(rnd, 2)])
+    year = rnd.choice(["0000", "0001", "1900", "2000", "2023", "2024", "9999", digits(rnd, 4)])
+    if rnd.random() < 0.5:
+        return f"{day}.{month}.{year}"
+    return f"{year}-{month}-{day}"
+
+
+def random_phone(rnd):
+    phone = f"+7 {digits(rnd, 3)} {digits(rnd, 3)} {digits(rnd, 2)} {digits(rnd, 2)}"
+    if rnd.random() < 0.3:
+        # Портим один символ
+        position = rnd.randrange(len(phone))
+        phone = phone[:position] + rnd.choice(TEXT_CHARS) + phone[position + 1:]
+    return phone
+
+
+def random_email(rnd):
+    local = "".join(rnd.choice("abz09._%+-") for _ in range(rnd.randint(0, 8)))
+    domain = "".join(rnd.choice("abz09.-") for _ in range(rnd.randint(0, 8)))
+    tld = "".join(rnd.choice("abzZ9") for _ in range(rnd.randint(0, 4)))
+    return rnd.choice([f"{local}@{domain}.{tld}", f"{local}@{domain}{tld}", f"{local}{domain}.{tld}"])
+
+
+def random_text(rnd):
+    length = rnd.choice([0, 1, 5, 9, 10, 11, 15, 16, 17, 40])
+    return "".join(rnd.choice(TEXT_CHARS) for _ in range(length))
+
+
+def generate_corpus(size, seed=2024):
+    rnd = random.Random(seed)
+    generators = [random_date, random_phone, random_email, random_text]
+    corpus = [None, 0, 12.5, True, ["01.01.2000"], {"email": "a@b.cd"},
+              "", "29.02.2000", "29.02.1900", "2024-02-29", "01.01.0000", "user@example.com",
+              "+7 999 123 45 67", "+7 999 123 45 67\n", "01.01.2000\n"]
+    while len(corpus) < size:
+        corpus.append(rnd.choice(generators)(rnd))
+    return corpus
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    return generate_corpus(CORPUS_SIZE)
+
+
+def test_validate_field_matches_reference(corpus):
+    """Тип поля совпадает с прежней реализацией для каждого значения."""
+    for value in corpus:
+        assert validate_field(value) == reference_validate_field(value), repr(value)
+
+
+def test_validators_match_reference(corpus):
+    """Отдельные валидаторы совпадают с прежней реализацией."""
+    for value in corpus:
+        assert validate_email(value) == reference_validate_email(value), repr(value)
+        assert validate_phone(value) == reference_validate_phone(value), repr(value)
+        assert validate_date(value) == reference_validate_date(value), repr(value)
+
+
+def test_corpus_covers_all_types(corpus):
+    """Набор значений содержит все типы полей."""
+    types = {reference_validate_field(value) for value in corpus}
+    assert types == {"date", "phone", "email", "text"}
+
+
+def test_validator_cache_counts_hits():
+    """Повторное значение берется из кэша, длинное проверяется без кэша."""
+    cache = VALIDATOR_CACHES["validate_field"]
+
+    value = "cache-test@example.com"
+    validate_field(value)
+    hits = cache.stats()["hits"]
+    assert validate_field(value) == "email"
+    assert cache.stats()["hits"] == hits + 1
+
+    long_value = "x" * (Config.VALIDATOR_CACHE_MAX_VALUE_LENGTH + 1) + "@example.com"
+    misses = cache.stats()["misses"]
+    assert validate_field(long_value) == "email"
+    assert cache.stats()["misses"] == misses
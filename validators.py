@@ -1,5 +1,9 @@
+import json
 import re
 from datetime import datetime
+from functools import wraps
+from caching import LRUCache, MISSING
+from database.config import Config
 
 """
 Были мысли воспользоваться pydantic, 
@@ -10,7 +14,65 @@ EMAIL_REGEX = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
 PHONE_REGEX = r'^\+7 \d{3} \d{3} \d{2} \d{2}$'
 DATE_REGEX = r'^(\d{2}\.\d{2}\.\d{4}|\d{4}-\d{2}-\d{2})$'
 
+EMAIL_PATTERN = re.compile(EMAIL_REGEX)
+PHONE_PATTERN = re.compile(PHONE_REGEX)
+DATE_PATTERN = re.compile(r'(\d{2})\.(\d{2})\.(\d{4})|(\d{4})-(\d{2})-(\d{2})')
 
+# Все типы одним выражением. Альтернативы не пересекаются, а имя
+# совпавшей группы (lastgroup) и есть тип поля.
+FIELD_PATTERN = re.compile(
+    r'(?P<date>(\d{2})\.(\d{2})\.(\d{4}))'
+    r'|(?P<iso_date>(\d{4})-(\d{2})-(\d{2}))'
+    r'|(?P<phone>\+7 \d{3} \d{3} \d{2} \d{2})'
+    r'|(?P<email>[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})'
+)
+
+DATE_LENGTH = 10
+PHONE_LENGTH = 16
+DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# Кэши валидаторов по имени функции
+VALIDATOR_CACHES = {}
+
+
+def memoized(func):
+    """
+    Кэширует результат валидатора для строковых значений.
+
+    Значения длиннее Config.VALIDATOR_CACHE_MAX_VALUE_LENGTH проверяются
+    напрямую, чтобы длинными уникальными строками нельзя было вытеснить
+    из кэша частые значения. При выключенном кэше функция не оборачивается.
+    """
+    if not Config.VALIDATOR_CACHE_ENABLED:
+        return func
+
+    cache = LRUCache(Config.VALIDATOR_CACHE_SIZE)
+    VALIDATOR_CACHES[func.__name__] = cache
+    max_length = Config.VALIDATOR_CACHE_MAX_VALUE_LENGTH
+
+    @wraps(func)
+    def wrapper(value):
+        if type(value) is not str or len(value) > max_length:
+            return func(value)
+
+        result = cache.get(value)
+        if result is MISSING:
+            result = func(value)
+            cache.put(value, result)
+        return result
+    return wrapper
+
+
+def validator_cache_stats():
+    """
+    :returns:
+        dict: { "<имя валидатора>": счетчики кэша }
+    """
+    return {name: cache.stats() for name, cache in VALIDATOR_CACHES.items()}
+
+
+
+@memoized
 def validate_field(field_value):
     """
     Функция для валидации поля в зависимости от типа.
@@ -23,20 +85,71 @@ def validate_field(field_value):
     Returns:
         type_: Тип присланного поля.
     """
-    # Последовательность проверки типов
-    types_order = ["date", "phone", "email"]
-    # Валидаторы для типов
-    validators = {
-        "email": validate_email,
-        "phone": validate_phone,
-        "date": validate_date
-    }
-    for type_ in types_order:
-        if validators[type_](field_value):
-            return type_
+    if not isinstance(field_value, str):
+        return "text"
+
+    # Дата- ровно 10 символов, телефон- 16, в email обязательно есть '@'.
+    # Остальное сразу текст, без регулярного выражения.
+    length = len(field_value)
+    if length != DATE_LENGTH and length != PHONE_LENGTH and "@" not in field_value:
+        return "text"
+
+    match = FIELD_PATTERN.fullmatch(field_value)
+    if match is None:
+        return "text"
+
+    type_ = match.lastgroup
+    if type_ == "date":
+        day, month, year = match.group(2, 3, 4)
+    elif type_ == "iso_date":
+        year, month, day = match.group(6, 7, 8)
+    else:
+        return type_
+
+    if check_date(field_value, day, month, year):
+        return "date"
     return "text"
 
 
+def check_date(date, day, month, year):
+    """
+    Проверка, что дата существует в календаре.
+
+    :args:
+        date (str): Дата целиком.
+        day, month, year (str): Части даты из регулярного выражения.
+
+    :returns:
+        bool: True если такая дата есть, False иначе.
+    """
+    # \d пропускает не только ASCII цифры, такие даты
+    # разбирает strptime, как и раньше
+    if not date.isascii():
+        return parse_date(date)
+
+    day, month, year = int(day), int(month), int(year)
+    if year < 1 or not 1 <= month <= 12 or day < 1:
+        return False
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return day <= 29
+    return day <= DAYS_IN_MONTH[month - 1]
+
+
+def parse_date(date):
+    """
+    Попытка распарсить дату в форматах DD.MM.YYYY и YYYY-MM-DD.
+    """
+    for date_format in ('%d.%m.%Y', '%Y-%m-%d'):
+        try:
+            datetime.strptime(date, date_format)
+            return True
+        except ValueError:
+            continue
+
+    return False
+
+
+@memoized
 def validate_email(email: str) -> bool:
     """
     Валидация email.
@@ -49,11 +162,12 @@ def validate_email(email: str) -> bool:
     """
     if not isinstance(email, str):
         return False
-    if not re.fullmatch(EMAIL_REGEX, email):
+    if not EMAIL_PATTERN.fullmatch(email):
         return False
     return True
 
 
+@memoized
 def validate_phone(phone: str) -> bool:
     """
     Валидация номера телефона в формате +7 XXX XXX XX XX.
@@ -66,11 +180,12 @@ def validate_phone(phone: str) -> bool:
     """
     if not isinstance(phone, str):
         return False
-    if not re.fullmatch(PHONE_REGEX, phone):
+    if not PHONE_PATTERN.fullmatch(phone):
         return False
     return True
 
 
+@memoized
 def validate_date(date: str) -> bool:
     """
     Валидация даты в форматах DD.MM.YYYY и YYYY-MM-DD.
@@ -84,15 +199,175 @@ def validate_date(date: str) -> bool:
     if not isinstance(date, str):
         return False
 
-    if not re.fullmatch(DATE_REGEX, date):
+    match = DATE_PATTERN.fullmatch(date)
+    if not match:
         return False
 
-    # Попытка распарсить дату в обоих форматах
-    for date_format in ('%d.%m.%Y', '%Y-%m-%d'):
+    if match.group(1):
+        day, month, year = match.group(1, 2, 3)
+    else:
+        year, month, day = match.group(4, 5, 6)
+    return check_date(date, day, month, year)
+
+
+# Вид пакетной проверки (/validate/<вид>/batch, /validate/classify) ->
+# (валидатор, поле значения в ответе, поле результата)
+BATCH_VALIDATORS = {
+    "email": (validate_email, "email", "is_valid"),
+    "phone": (validate_phone, "phone", "is_valid"),
+    "date": (validate_date, "date", "is_valid"),
+    "classify": (validate_field, "value", "type"),
+}
+
+
+def validate_values(validator, values, seen=None):
+    """
+    Проверяет значения одним циклом. Повторяющаяся строка проверяется один раз:
+    результаты хранятся в seen (не больше Config.VALIDATE_BATCH_MAX_SIZE),
+    общий кэш memoized не используется, чтобы пакет не вытеснял из него
+    значения одиночных запросов.
+
+    :args:
+        validator: Валидатор из BATCH_VALIDATORS
+        values (iterable): Значения
+        seen (dict): Результаты уже проверенных строк, общий для частей одного пакета
+
+    :returns:
+        iterator: Результаты в порядке values
+    """
+    check = getattr(validator, "__wrapped__", validator)
+    seen = {} if seen is None else seen
+    limit = Config.VALIDATE_BATCH_MAX_SIZE
+    for value in values:
+        if type(value) is not str:
+            yield check(value)
+            continue
+        result = seen.get(value, MISSING)
+        if result is MISSING:
+            if len(seen) >= limit:
+                seen.clear()
+            result = seen[value] = check(value)
+        yield result
+
+
+def validate_batch(kind, values):
+    """
+    :returns:
+        list: { "<поле значения>": <value>, "<поле результата>": <result> } в порядке values
+    """
+    validator, value_name, result_name = BATCH_VALIDATORS[kind]
+    return [{value_name: value, result_name: result}
+            for value, result in zip(values, validate_values(validator, values))]
+
+
+def validate_ndjson(kind, lines, seen):
+    """
+    Проверяет часть пакета NDJSON, по значению JSON в строке.
+
+    :args:
+        lines (list): Непустые строки запроса
+        seen (dict): См. validate_values
+
+    :returns:
+        str: Строки ответа NDJSON, как элементы validate_batch, для строки
+            с некорректным JSON- { "error", "message" }
+    """
+    validator, value_name, result_name = BATCH_VALIDATORS[kind]
+    items = []
+    for line in lines:
         try:
-            datetime.strptime(date, date_format)
-            return True
-        except ValueError:
+            items.append((json.loads(line), None))
+        except ValueError as e:
+            items.append((None, str(e)))
+
+    results = validate_values(validator, (value for value, error in items if error is None), seen)
+    return "".join(
+        json.dumps({"error": "Invalid JSON", "message": error} if error is not None
+                   else {value_name: value, result_name: next(results)}) + "\n"
+        for value, error in items
+    )
+
+
+def parse_template(data):
+    """
+    Проверяет шаблон из запроса и отбрасывает некорректные поля.
+
+    :args:
+        data: Шаблон- { "name": <string>, "fields": [{ "name": <string>, "type": <string> }] }
+
+    :returns:
+        (template, warnings, error): Шаблон- {имя, список полей},
+        список предупреждений и текст ошибки, если шаблон не подходит.
+    """
+    if not data or not isinstance(data, dict):
+        return None, [], "Template data is required"
+
+    template_name = data.get("name")
+    fields = data.get("fields")
+
+    if not template_name or not isinstance(template_name, str):
+        return None, [], "Template name is required"
+    if not fields or not isinstance(fields, list):
+        return None, [], "Field list is required"
+
+    warnings = []
+    validated_fields = []
+    valid_types = {"date", "email", "phone", "text"}
+
+    for position, field in enumerate(fields):
+        if not isinstance(field, dict):
+            return None, [], f"Field {position} must be an object"
+        field_name = field.get("name")
+        field_type = field.get("type")
+
+        if not field_name or not field_type or not isinstance(field_name, str) or not isinstance(field_type, str):
+            # Пропускаем некорректные поля
+            warnings.append(f"Field {field} is missing a name or type")
             continue
 
-    return False
\ No newline at end of file
+        if field_type not in valid_types:
+            warnings.append(f"Field '{field_name}' has an invalid type ({field_type}). Skipped.")
+            continue
+
+        validated_fields.append({"name": field_name, "type": field_type})
+
+    return {"name": template_name, "fields": validated_fields}, warnings, None
+
+
+def classify_form(form_fields):
+    """
+    Определяет тип каждого поля формы.
+
+    :returns:
+        dict: { "<field_name>": <type> }
+    """
+    result_form = {}
+
+    # Перебираем поля формы
+    for field_name, field_value in form_fields.items():
+        # Валидация полей
+        corrected_type = validate_field(field_value)
+
+        result_form[field_name] = corrected_type
+
+    return result_form
+
+
+def parse_templates(items):
+    """
+    Проверяет список шаблонов, см. parse_template.
+
+    :returns:
+        (templates, results): Подходящие шаблоны и для каждого элемента items
+        по порядку { "warnings", "fields" } или { "error" }.
+    """
+    results = []
+    templates = []
+    for data in items:
+        template, warnings, error = parse_template(data)
+        if error:
+            results.append({"error": error})
+            continue
+        results.append({"warnings": warnings, "fields": template["fields"]})
+        templates.append(template)
+    return templates, results
@@ -0,0 +1,537 @@
+import gzip
+import json
+import threading
+import time
+from bson import ObjectId
+from pymongo.errors import OperationFailure, DuplicateKeyError
+from admission import Overloaded, create_limiters
+from caching import VersionedLRUCache, ResponseCache, MISSING
+from coherence import GenerationWatcher, RecentTemplates, RESET
+from database.config import Config
+from database.connection import DatabaseNotReady
+from database.queries import listing_projection
+from logging_form import logger, log_request
+from matching import TemplateIndex, form_signature
+from metrics import observe_request, stage
+from snapshot import load_index
+
+"""
+Общая часть views.py и async_views.py: кэши процесса, разбор параметров
+запроса и тела ответов. Не зависит от Flask/Quart и от того, как идут
+обращения к MongoDB- в самих views остаются чтение запроса, вызовы базы
+и сборка ответа. Объект request в функциях ниже- запрос Flask или Quart,
+у них одинаковые args, accept_mimetypes, accept_encodings и if_none_match.
+"""
+
+
+class ViewState:
+    """
+    Кэши и ограничители одного приложения.
+
+    :args:
+        limiter_class: admission.AdmissionLimiter или AsyncAdmissionLimiter
+    """
+
+    def __init__(self, limiter_class):
+        # Индекс шаблонов в памяти процесса, см. matching.TemplateIndex
+        self.template_index = TemplateIndex()
+        # Результаты подбора по виду формы, включая "не найден".
+        # Сбрасывается при любом изменении набора шаблонов.
+        self.match_cache = VersionedLRUCache(Config.MATCH_CACHE_SIZE) if Config.MATCH_CACHE_ENABLED else None
+        # Тела ответов /templates и /indexes для текущего поколения данных, см. listing_body
+        self.listing_cache = ResponseCache(Config.LISTING_CACHE_MAX_BYTES) if Config.LISTING_CACHE_ENABLED else None
+        # Ограничители одновременных запросов по классам маршрутов, см. admission.py
+        self.limiters = create_limiters(limiter_class)
+        # Поколение данных, на котором построены кэши процесса, см. coherence.py
+        self.generation_watcher = GenerationWatcher(Config.GENERATION_CHECK_INTERVAL_MS)
+        # Шаблоны, уже добавленные в индекс, для догрузки новых
+        self.recent_templates = RecentTemplates(Config.TEMPLATE_ID_OVERLAP_S, known=False)
+        # Замена индекса и добавление в него шаблонов
+        self._lock = threading.Lock()
+        # Полная перезагрузка индекса в фоне идет не больше чем одна
+        self._reloading = threading.Lock()
+
+    def invalidate_match_cache(self):
+        if self.match_cache is not None:
+            self.match_cache.invalidate()
+
+    def invalidate_caches(self):
+        """
+        Сброс кэшей после записи в этом воркере.
+        """
+        self.invalidate_match_cache()
+        if self.listing_cache is not None:
+            self.listing_cache.invalidate()
+
+    def update_generation(self, generation):
+        """
+        Запоминает поколение данных, на котором построены кэши.
+
+        :args:
+            generation (dict): { "value", "resets" }, см. db_operations.get_generation_state
+        """
+        self._set_listing_generation(generation["value"])
+        self.generation_watcher.update(generation["value"], generation["resets"])
+
+    def _set_listing_generation(self, generation):
+        if self.listing_cache is not None:
+            self.listing_cache.set_generation(generation)
+
+    def check_due(self):
+        """
+        Пора ли сверить поколение данных (check_generation во views): кэши
+        уже построены, не перезагружаются и с прошлой сверки прошло
+        Config.GENERATION_CHECK_INTERVAL_MS.
+        """
+        return (self.generation_watcher.generation is not None and not self._reloading.locked()
+                and self.generation_watcher.due())
+
+    def begin_reload(self):
+        """
+        Шаблоны удалялись или заменялись: прежний индекс и кэши больше не
+        годятся. Индекс заменяется пустым незагруженным- до окончания
+        load_templates подбор по нему отвечает 503 (memory_index), кэши
+        сбрасываются. Перезагрузку нужно выполнить не в потоке запроса
+        и закончить вызовом end_reload.
+
+        :returns:
+            bool: False, если перезагрузка уже идет
+        """
+        if not self._reloading.acquire(blocking=False):
+            return False
+        with self._lock:
+            self.template_index = TemplateIndex()
+        self.invalidate_caches()
+        return True
+
+    def end_reload(self):
+        self._reloading.release()
+
+    def changes(self, generation):
+        """
+        :args:
+            generation (dict): см. update_generation
+
+        :returns:
+            str: None, если данные не менялись, coherence.RESET, если индекс нужно
+                перестроить (load_templates), иначе coherence.ADDED- догрузить
+                шаблоны после templates_since (load_added)
+        """
+        changes = self.generation_watcher.compare(generation["value"], generation["resets"])
+        if changes is not None and not self.recent_templates.known:
+            return RESET
+        return changes
+
+    def templates_since(self):
+        """
+        :returns:
+            ObjectId: Догрузить шаблоны с _id больше этого, см. coherence.RecentTemplates
+        """
+        with self._lock:
+            return self.recent_templates.since()
+
+    def load_templates(self, templates, generation):
+        """
+        Строит индекс шаблонов целиком и заменяет им текущий.
+
+        :args:
+            templates (iterable): Шаблоны с _id, в порядке _id
+            generation (dict): Поколение, прочитанное до шаблонов
+        """
+        template_index = TemplateIndex()
+        recent_templates = RecentTemplates(Config.TEMPLATE_ID_OVERLAP_S)
+        template_index.load(template for template in templates if recent_templates.add(template["_id"]))
+        with self._lock:
+            self.template_index, self.recent_templates = template_index, recent_templates
+        self.update_generation(generation)
+        self.invalidate_match_cache()
+        logger.info(f" Загружено шаблонов в индекс: {len(template_index)} ")
+
+    def load_added(self, templates, generation):
+        """
+        Догружает в индекс новые шаблоны.
+
+        :args:
+            templates (iterable): Шаблоны с _id после templates_since
+            generation (dict): Поколение, прочитанное до шаблонов
+        """
+        added = 0
+        with self._lock:
+            for template in templates:
+                if self.recent_templates.add(template["_id"]):
+                    self.template_index.add(template)
+                    added += 1
+        self.update_generation(generation)
+        if added:
+            self.invalidate_match_cache()
+            logger.info(f" Догружено шаблонов в индекс: {added} ")
+
+    def load_snapshot(self, generation):
+        """
+        Загружает индекс шаблонов из Config.SNAPSHOT_PATH без запросов к базе,
+        если снимок соответствует данным в ней, см. snapshot.py
+
+        :args:
+            generation (dict): { "value", "resets", "snapshots" }, см. db_operations.get_generation_state
+
+        :returns:
+            bool: True, если индекс загружен
+        """
+        try:
+            loaded = load_index(Config.SNAPSHOT_PATH, self.template_index, generation["snapshots"])
+        except (OSError, ValueError) as e:
+            logger.warning(f" Не удалось прочитать снимок {Config.SNAPSHOT_PATH}: {e} ")
+            return False
+        if loaded:
+            self.update_generation(generation)
+            self.invalidate_match_cache()
+            logger.info(f" Загружено шаблонов в индекс из снимка: {len(self.template_index)} ")
+        return loaded
+
+    def templates_added(self, templates, template_ids, generation):
+        """
+        Шаблоны, созданные в этом воркере: в индекс и сброс кэшей.
+
+        :args:
+            templates (list): Шаблоны- {имя, список полей}
+            template_ids (list): Их _id
+            generation (int): Поколение после записи, см. db_operations.build_indexes
+        """
+        with self._lock:
+            for template, template_id in zip(templates, template_ids):
+                if self.recent_templates.add(template_id):
+                    self.template_index.add(template)
+        self.invalidate_caches()
+        # create_form_template(s) и build_indexes увеличивают поколение по разу
+        if self.generation_watcher.advance(generation, 2):
+            self._set_listing_generation(generation)
+
+    def cleared(self, generation):
+        """
+        База очищена в этом воркере.
+
+        :args:
+            generation (int): Поколение после очистки, см. db_operations.clear_database
+        """
+        template_index = TemplateIndex()
+        template_index.clear()
+        with self._lock:
+            self.template_index = template_index
+            self.recent_templates = RecentTemplates(Config.TEMPLATE_ID_OVERLAP_S)
+        self.invalidate_caches()
+        if self.generation_watcher.advance(generation, 1, resets=1):
+            self._set_listing_generation(generation)
+
+    def memory_index(self):
+        """
+        :returns:
+            TemplateIndex, см. MATCH_ENGINE=memory
+
+        :exception:
+            DatabaseNotReady, если индекс еще не загружен
+        """
+        if not self.template_index.loaded:
+            raise DatabaseNotReady("Template index is not loaded yet")
+        return self.template_index
+
+    def lookup(self, result_forms):
+        return MatchLookup(self.match_cache, result_forms)
+
+    def listing_generation(self):
+        """
+        Поколение данных для ETag выдачи /templates и /indexes.
+
+        Воркер узнает о записях других воркеров при проверке поколения
+        (check_generation), поэтому 304 может прийти на данные, измененные не
+        раньше чем Config.GENERATION_CHECK_INTERVAL_MS назад.
+
+        :returns:
+            str: Поколение, либо None, если оно неизвестно или кэш выключен
+        """
+        if self.listing_cache is None or self.listing_cache.generation is None:
+            return None
+        return str(self.listing_cache.generation)
+
+    def match_cache_stats(self):
+        """
+        :returns:
+            dict: { "size", "capacity", "hits", "misses", "evictions", "hit_rate" },
+                либо { "enabled": false }
+        """
+        if self.match_cache is None:
+            return {"enabled": False}
+        return self.match_cache.stats()
+
+    def admission_stats(self):
+        """
+        :returns:
+            dict: { "<класс>": AdmissionLimiter.stats }, либо { "enabled": false }
+        """
+        if not self.limiters:
+            return {"enabled": False}
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+
+class MatchLookup:
+    """
+    Подбор шаблонов для списка форм через match_cache. Формы того же вида,
+    что уже встречались, берутся из кэша, остальные (missed_forms) views
+    ищет сам и передает в fill.
+    """
+
+    def __init__(self, match_cache, result_forms):
+        self._cache = match_cache
+        self._result_forms = result_forms
+        if match_cache is None:
+            self.names = [MISSING] * len(result_forms)
+        else:
+            self._version = match_cache.version
+            self._keys = [form_signature(result_form) for result_form in result_forms]
+            self.names = [match_cache.get(key) for key in self._keys]
+        self.missed = [position for position, name in enumerate(self.names) if name is MISSING]
+
+    @property
+    def missed_forms(self):
+        return [self._result_forms[position] for position in self.missed]
+
+    def fill(self, template_names):
+        """
+        :args:
+            template_names (list): Найденные шаблоны для missed_forms
+
+        :returns:
+            list: Имена шаблонов в порядке форм (пустая строка, если не найден).
+        """
+        for position, template_name in zip(self.missed, template_names):
+            self.names[position] = template_name
+            if self._cache is not None:
+                self._cache.put_if_current(self._keys[position], template_name, self._version)
+        return self.names
+
+
+def error_response(e):
+    """
+    Ответ на исключение обработчика (handle_exceptions во views).
+
+    :returns:
+        tuple: (тело, код, заголовки)
+    """
+    if isinstance(e, DatabaseNotReady):
+        logger.warning(f"Database is not ready: {str(e)}")
+        return {'error': 'Service unavailable', 'message': str(e)}, 503, {'Retry-After': '1'}
+    if isinstance(e, Overloaded):
+        logger.warning(f"Request shed: {str(e)}")
+        return {'error': 'Service overloaded', 'message': str(e)}, 503, {'Retry-After': str(e.retry_after)}
+    if isinstance(e, OperationFailure):
+        logger.error(f"MongoDB error: {str(e)}")
+        return {'error': 'Database error', 'message': str(e)}, 500, {}
+    if isinstance(e, DuplicateKeyError):
+        logger.warning(f"Duplicate key error: {str(e)}")
+        return {'error': 'Duplicate key error', 'message': str(e)}, 400, {}
+    logger.critical(f"Unexpected error: {str(e)}", exc_info=True)
+    return {'error': 'Unexpected error occurred', 'message': str(e)}, 500, {}
+
+
+def request_route(request):
+    return request.url_rule.rule if request.url_rule else request.path
+
+
+def log_failed_request(request, e):
+    logger.error(f"URL: {request.url} | Method: {request.method} | Error: {str(e)}")
+
+
+def record_request(request, route, response, started):
+    """
+    Метрики и журнал запроса, см. log_requests_and_responses во views.
+
+    :args:
+        response: Ответ обработчика, объект или кортеж (тело, код)
+        started (float): time.perf_counter() в начале запроса
+    """
+    status_code = response[1] if isinstance(response, tuple) else response.status_code
+    latency = time.perf_counter() - started
+    observe_request(route, request.method, status_code, latency)
+    log_request(request.method, request.url, request.remote_addr, status_code, latency)
+
+
+def value_result(data, name, message, validator):
+    """
+    Проверка одного значения для /validate/email, /validate/phone, /validate/date.
+
+    :returns:
+        tuple: (тело, код)
+    """
+    value = data.get(name)
+    if not value:
+        return {"error": message}, 400
+    with stage("validation"):
+        is_valid = validator(value)
+    return {name: value, "is_valid": is_valid}, 200
+
+
+def batch_error(values):
+    """
+    :returns:
+        tuple: (тело, код) ошибки пакета /validate/<kind>/batch, либо None
+    """
+    if not values or not isinstance(values, list):
+        return {"error": "Value list is required"}, 400
+    if len(values) > Config.VALIDATE_BATCH_MAX_SIZE:
+        return {"error": "Too many values", "max_size": Config.VALIDATE_BATCH_MAX_SIZE}, 413
+    return None
+
+
+def parse_ndjson(text):
+    """
+    :returns:
+        list: Объекты из непустых строк NDJSON
+
+    :exception:
+        ValueError, если строка не JSON
+    """
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def created_result(template, template_id, warnings):
+    """
+    Тело ответа /create_template.
+    """
+    return {
+        "message": "Template created",
+        "template_id": str(template_id),
+        "warnings": warnings,
+        "fields": template["fields"]
+    }
+
+
+def bulk_result(templates, template_ids, results):
+    """
+    Тело ответа /create_templates/bulk: id созданных шаблонов
+    проставляются в results по порядку.
+    """
+    template_ids = iter(template_ids)
+    for result in results:
+        if "error" not in result:
+            result["template_id"] = str(next(template_ids))
+    return {
+        "message": "Templates created",
+        "created": len(templates),
+        "templates": results
+    }
+
+
+def form_result(result_form, template_name):
+    """
+    Ответ /get_form.
+
+    :returns:
+        tuple: (тело, код)
+    """
+    # Если подходящий шаблон найден, возвращаем его
+    if template_name:
+        return {"matching_template_name": template_name}, 200
+    # Если не нашли подходящий шаблон, возвращаем обработанные поля
+    return result_form, 404
+
+
+def json_line(document):
+    # ObjectId записывается строкой
+    return json.dumps(document, default=str) + "\n"
+
+
+def json_body(value):
+    """
+    JSON, ObjectId записывается строкой.
+    """
+    return json.dumps(value, default=str)
+
+
+# Тип из Accept -> формат выдачи списка
+OUTPUT_FORMATS = {"application/x-ndjson": "ndjson", "application/bson": "bson"}
+
+
+def output_format(request):
+    """
+    Формат выдачи списка: параметр format, иначе заголовок Accept.
+
+    :returns:
+        str: json, ndjson или bson
+    """
+    requested = request.args.get("format")
+    if requested in ("ndjson", "bson"):
+        return requested
+    if requested is None:
+        return OUTPUT_FORMATS.get(request.accept_mimetypes.best, "json")
+    return "json"
+
+
+def listing_args(request, allowed_fields):
+    """
+    Параметры выдачи /templates и /indexes, см. list_documents во views.
+
+    :returns:
+        tuple: (after, limit, projection)
+
+    :exception:
+        ValueError с текстом ошибки для ответа 400
+    """
+    after = request.args.get("after")
+    limit = request.args.get("limit")
+    if after is not None:
+        if not ObjectId.is_valid(after):
+            raise ValueError("Invalid 'after' id")
+        after = ObjectId(after)
+    if limit is not None:
+        if not limit.isdigit() or not 0 < int(limit) <= Config.MAX_PAGE_SIZE:
+            raise ValueError(f"'limit' must be between 1 and {Config.MAX_PAGE_SIZE}")
+        limit = int(limit)
+    return after, limit, listing_projection(request.args.get("fields"), allowed_fields)
+
+
+def not_modified(request, generation):
+    """
+    Данные не менялись с прошлого запроса клиента- ответ 304 без обращения к базе.
+    """
+    return generation is not None and request.if_none_match.contains_weak(generation)
+
+
+def tagged(response, generation):
+    """
+    Слабый ETag: тело с gzip и без него- один и тот же ответ.
+    """
+    if generation is not None:
+        response.set_etag(generation, weak=True)
+        response.headers["Vary"] = "Accept, Accept-Encoding"
+    return response
+
+
+def listing_key(request):
+    """
+    Ключ тела в listing_cache и нужно ли его сжимать.
+
+    :returns:
+        tuple: (ключ, compress)
+    """
+    compress = Config.LISTING_GZIP_ENABLED and "gzip" in request.accept_encodings
+    return (request.path, request.args.get("fields"), compress), compress
+
+
+def listing_body(documents, compress):
+    """
+    Тело всего списка JSON, сжатое gzip, если клиент его принимает.
+    Готовится один раз на поколение данных, см. caching.ResponseCache
+    """
+    with stage("serialization"):
+        body = json_body(documents).encode()
+        if compress:
+            body = gzip.compress(body)
+    return body
+
+
+def page_result(documents, limit):
+    """
+    Страница { "items": [...], "next_after": <id последнего документа | null> }
+    """
+    # Неполная страница- последняя
+    next_after = documents[-1]['_id'] if len(documents) == limit else None
+    return {"items": documents, "next_after": next_after}
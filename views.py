@@ -1,25 +1,141 @@
-from flask import Blueprint, request, jsonify
-from validators import validate_field, validate_email, validate_phone, validate_date
-from database.db_operations import create_form_template, get_all_form_indexes, get_all_form_templates, find_templates_by_field, build_index, clear_database
+import os
+import tempfile
+import threading
+import time
+from itertools import islice
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context, make_response
+from validators import validate_email, validate_phone, validate_date, validator_cache_stats, validate_batch, validate_ndjson, parse_template, parse_templates, classify_form
+from database.db_operations import create_form_template, create_form_templates, get_all_form_indexes, get_all_form_templates, find_form_templates, find_form_indexes, find_templates_by_keys, find_templates_after, match_index, match_template, build_indexes, clear_database, get_generation_state
+from database.config import Config
+from database.queries import TEMPLATE_FIELDS, INDEX_FIELDS
+from database.connection import start_database_connection, database_status, get_database
+from snapshot import export_snapshot
+from matching import index_entries, batch_results, forms_keys, match_forms_buckets
+from caching import MISSING
+from coherence import ADDED, RESET
+from profiling import PROFILE_HEADER, start_profile
+from admission import AdmissionLimiter
 from logging_form import logger
-from pymongo.errors import OperationFailure, DuplicateKeyError
+from metrics import current_route, stage, render as render_metrics, start_snapshot_writer, worker_id, WORKER_HEADER
+from view_support import (ViewState, error_response, request_route, log_failed_request, record_request,
+                          value_result, batch_error, parse_ndjson, created_result, bulk_result, form_result,
+                          json_line, json_body, output_format, listing_args, not_modified, tagged,
+                          listing_key, listing_body, page_result)
 from functools import wraps
 
+"""
+Обработчики запросов Flask. Кэши, разбор параметров и тела ответов общие
+с async_views.py, см. view_support.py
+"""
+
 views_blueprint = Blueprint('auth', __name__)
 
+# Индекс шаблонов, кэши и ограничители процесса
+state = ViewState(AdmissionLimiter)
+
+
+def reload_caches(generation):
+    """
+    Перезагружает все кэши процесса из базы данных: при старте,
+    после очистки базы и восстановления из снимка.
+
+    :args:
+        generation (dict): Поколение, прочитанное до загрузки
+    """
+    state.load_templates(find_templates_after(), generation)
+
+
+def warm_caches():
+    """
+    Первая загрузка кэшей после подключения к базе данных.
+    """
+    # Поколение читается до загрузки: запись, попавшая между ними,
+    # будет замечена при следующей проверке
+    generation = get_generation_state()
+    if not state.load_snapshot(generation):
+        reload_caches(generation)
+
+
+def reload_in_background(generation):
+    """
+    Полная перезагрузка индекса после очистки базы или восстановления
+    из снимка другим воркером, см. check_generation
+    """
+    try:
+        reload_caches(generation)
+    except Exception as e:
+        # Поколение осталось прежним: следующая сверка начнет перезагрузку заново
+        logger.warning(f" Не удалось перезагрузить кэши: {e} ")
+    finally:
+        state.end_reload()
+
+
+@views_blueprint.record_once
+def connect_database(state):
+    """
+    При регистрации Blueprint запускает подключение к базе данных
+    в фоне, см. database.connection. Кэши прогреваются после подключения.
+    """
+    start_database_connection(on_ready=[warm_caches])
+    start_snapshot_writer()
+
+
+@views_blueprint.before_request
+def check_generation():
+    """
+    Не чаще раза в Config.GENERATION_CHECK_INTERVAL_MS сверяет поколение
+    данных до обработки запроса. Шаблоны, созданные другими воркерами,
+    догружаются в индекс сразу. После очистки базы или восстановления из
+    снимка кэши сбрасываются сразу, а индекс строится заново в фоне, до тех
+    пор подбор по индексу в памяти отвечает 503.
+    """
+    if not state.check_due():
+        return
+    try:
+        generation = get_generation_state()
+        changes = state.changes(generation)
+        if changes == ADDED:
+            state.load_added(find_templates_after(state.templates_since()), generation)
+        elif changes == RESET and state.begin_reload():
+            threading.Thread(target=reload_in_background, args=(generation,),
+                             name="reload-caches", daemon=True).start()
+    except Exception as e:
+        # Работаем на текущих кэшах, проверим в следующий раз
+        logger.warning(f" Не удалось проверить поколение данных: {e} ")
+
+
+@views_blueprint.after_request
+def tag_worker(response):
+    """
+    Номер воркера в заголовке X-Worker: /match/cache, /validate/cache
+    и /admission описывают только воркер, ответивший на запрос.
+    """
+    response.headers[WORKER_HEADER] = worker_id()
+    return response
+
 
 def log_requests_and_responses(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        request_info = f"URL: {request.url} | Method: {request.method} | IP: {request.remote_addr}"
+        route = request_route(request)
+        token = current_route.set(route)
+        profile = start_profile(route, request.headers)
+        started = time.perf_counter()
         try:
-            response = func(*args, **kwargs)
-            status_code = response[1] if isinstance(response, tuple) else response.status_code
-            logger.info(f"{request_info} | Status: {status_code}")
-            return response
+            if profile is None:
+                response = func(*args, **kwargs)
+            else:
+                response = profile.run(func, *args, **kwargs)
         except Exception as e:
-            logger.error(f"{request_info} | Error: {str(e)}")
+            log_failed_request(request, e)
             raise
+        finally:
+            current_route.reset(token)
+        if profile is not None:
+            response = make_response(response)
+            response.headers[PROFILE_HEADER] = profile.report(request.method, response.status_code)
+        record_request(request, route, response, started)
+        return response
     return wrapper
 
 
@@ -28,40 +144,92 @@ def handle_exceptions(func):
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
-        except OperationFailure as e:
-            logger.error(f"MongoDB error: {str(e)}")
-            return jsonify({'error': 'Database error', 'message': str(e)}), 500
-        except DuplicateKeyError as e:
-            logger.warning(f"Duplicate key error: {str(e)}")
-            return jsonify({'error': 'Duplicate key error', 'message': str(e)}), 400
         except Exception as e:
-            logger.critical(f"Unexpected error: {str(e)}", exc_info=True)
-            return jsonify({'error': 'Unexpected error occurred', 'message': str(e)}), 500
+            body, status, headers = error_response(e)
+            return jsonify(body), status, headers
     return wrapper
 
 
-def check_fields(matching_template, form_fields):
-    if len(matching_template['fields']) > len(form_fields):
-        return False
+def admit(route_class):
+    """
+    Декоратор: обработчик выполняется, только когда ограничитель класса
+    route_class пропустил запрос, иначе Overloaded- 503 в handle_exceptions.
+    Ставится под handle_exceptions, см. admission.py
+    """
+    def decorator(func):
+        limiter = state.limiters.get(route_class)
+        if limiter is None:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with limiter.slot():
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def match_form(result_form):
+    """
+    Поиск подходящего шаблона. Формы того же вида, что уже встречались,
+    берутся из match_cache без обращения к индексам.
 
-    # Проверяем, что все поля шаблона есть в форме и типы совпадают
-    all_fields_match = True
+    :returns:
+        str: Имя шаблона, либо пустая строка.
+    """
+    lookup = state.lookup([result_form])
+    if lookup.missed:
+        lookup.fill([find_template(result_form)])
+    return lookup.names[0]
 
-    for field in matching_template['fields']:
 
-        # Проверяем наличие поля в форме и соответствие типов
-        if field['name'] not in form_fields or form_fields[field['name']] != field['type']:
-            all_fields_match = False
-            break
+def match_forms(result_forms):
+    """
+    Поиск шаблонов для списка форм через match_cache, см. match_form
 
-    # Если все поля совпадают, возвращаем этот шаблон как лучший
-    if all_fields_match:
-        return True
+    :returns:
+        list: Имена шаблонов в порядке форм (пустая строка, если не найден).
+    """
+    lookup = state.lookup(result_forms)
+    if lookup.missed:
+        lookup.fill(find_templates(lookup.missed_forms))
+    return lookup.names
+
+
+def find_template(result_form):
+    """
+    Поиск подходящего шаблона выбранным в Config.MATCH_ENGINE способом.
+
+    :returns:
+        str: Имя шаблона, либо пустая строка.
+    """
+    if Config.MATCH_ENGINE == "index":
+        return match_index(result_form)
+    if Config.MATCH_ENGINE == "aggregate":
+        return match_template(result_form)
+    return state.memory_index().match(result_form)
+
+
+def find_templates(result_forms):
+    """
+    Поиск шаблонов для списка форм. В режиме "index" все ключи форм
+    запрашиваются из коллекции индексов одним запросом.
+
+    :returns:
+        list: Имена шаблонов в порядке форм (пустая строка, если не найден).
+    """
+    if Config.MATCH_ENGINE == "aggregate":
+        return [match_template(result_form) for result_form in result_forms]
+    if Config.MATCH_ENGINE != "index":
+        template_index = state.memory_index()
+        return [template_index.match(result_form) for result_form in result_forms]
+    return match_forms_buckets(result_forms, find_templates_by_keys(forms_keys(result_forms)))
 
 
 @views_blueprint.route('/validate/email', methods=['POST'])
 @log_requests_and_responses
 @handle_exceptions
+@admit("cpu")
 def validate_email_route():
     """
     Эндпоинт для проверки валидности email-адреса.
@@ -73,18 +241,14 @@ def validate_email_route():
         200: JSON объект { "email": <email>, "is_valid": <bool> }
         400: JSON объект { "error": "Email is required" }
     """
-    data = request.json
-    email = data.get("email")
-    if not email:
-        return jsonify({"error": "Email is required"}), 400
-
-    result = validate_email(email)
-    return jsonify({"email": email, "is_valid": result})
+    body, status = value_result(request.json, "email", "Email is required", validate_email)
+    return jsonify(body), status
 
 
 @views_blueprint.route('/validate/phone', methods=['POST'])
 @log_requests_and_responses
 @handle_exceptions
+@admit("cpu")
 def validate_phone_route():
     """
     Эндпоинт для проверки валидности номера телефона.
@@ -96,18 +260,14 @@ def validate_phone_route():
         200: JSON объект { "phone": <phone>, "is_valid": <bool> }
         400: JSON объект { "error": "Phone number is required" }
     """
-    data = request.json
-    phone = data.get("phone")
-    if not phone:
-        return jsonify({"error": "Phone number is required"}), 400
-
-    result = validate_phone(phone)
-    return jsonify({"phone": phone, "is_valid": result})
+    body, status = value_result(request.json, "phone", "Phone number is required", validate_phone)
+    return jsonify(body), status
 
 
 @views_blueprint.route('/validate/date', methods=['POST'])
 @log_requests_and_responses
 @handle_exceptions
+@admit("cpu")
 def validate_date_route():
     """
     Эндпоинт для проверки валидности даты.
@@ -119,64 +279,247 @@ def validate_date_route():
         200: JSON объект { "date": <date>, "is_valid": <bool> }
         400: JSON объект { "error": "Date is required" }
     """
-    data = request.json
-    date = data.get("date")
-    if not date:
-        return jsonify({"error": "Date is required"}), 400
+    body, status = value_result(request.json, "date", "Date is required", validate_date)
+    return jsonify(body), status
+
+
+def stream_validation(kind, lines):
+    """
+    Отдает результаты пакета NDJSON частями по Config.STREAM_BATCH_SIZE строк,
+    не читая запрос целиком, см. validators.validate_ndjson
+    """
+    seen = {}
+    lines = (line for line in lines if line.strip())
+    while chunk := list(islice(lines, Config.STREAM_BATCH_SIZE)):
+        yield validate_ndjson(kind, chunk, seen)
+
+
+@views_blueprint.route('/validate/<any(email, phone, date):kind>/batch', methods=['POST'])
+@views_blueprint.route('/validate/classify', methods=['POST'], defaults={"kind": "classify"})
+@log_requests_and_responses
+@handle_exceptions
+@admit("cpu")
+def validate_batch_route(kind):
+    """
+    Эндпоинт для проверки сразу многих значений: /validate/email/batch,
+    /validate/phone/batch, /validate/date/batch и /validate/classify (тип
+    значения, как у полей /get_form).
+
+    Требования:
+        JSON массив значений, не больше Config.VALIDATE_BATCH_MAX_SIZE, либо NDJSON
+        (Content-Type: application/x-ndjson)- по значению в строке, без ограничения.
+
+    Возвращает:
+        200: JSON массив (или NDJSON поток) в порядке значений:
+             { "<email|phone|date>": <value>, "is_valid": <bool> },
+             для classify { "value": <value>, "type": <type> }
+        400: Если список значений отсутствует.
+        413: Если значений больше Config.VALIDATE_BATCH_MAX_SIZE.
+    """
+    if request.mimetype == "application/x-ndjson":
+        return Response(stream_with_context(stream_validation(kind, request.stream)),
+                        mimetype="application/x-ndjson")
+
+    values = request.json
+    error = batch_error(values)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    with stage("validation"):
+        results = validate_batch(kind, values)
+    with stage("serialization"):
+        return jsonify(results)
+
+
+@views_blueprint.route('/validate/cache', methods=['GET'])
+@log_requests_and_responses
+@handle_exceptions
+def validate_cache_route():
+    """
+    Эндпоинт со счетчиками кэша валидаторов.
+
+    Возвращает:
+        200: JSON объект { "<validator>": { "size", "capacity", "hits", "misses", "evictions", "hit_rate" } }
+    """
+    return jsonify(validator_cache_stats())
+
+
+@views_blueprint.route('/match/cache', methods=['GET'])
+@log_requests_and_responses
+@handle_exceptions
+def match_cache_route():
+    """
+    Эндпоинт со счетчиками кэша результатов подбора шаблона.
+
+    Возвращает:
+        200: JSON объект { "size", "capacity", "hits", "misses", "evictions", "hit_rate" },
+             либо { "enabled": false }
+    """
+    return jsonify(state.match_cache_stats())
+
 
-    result = validate_date(date)
-    return jsonify({"date": date, "is_valid": result})
+@views_blueprint.route('/admission', methods=['GET'])
+@log_requests_and_responses
+@handle_exceptions
+def admission_route():
+    """
+    Эндпоинт с состоянием ограничителей одновременных запросов.
+
+    Возвращает:
+        200: JSON объект { "<класс>": { "limit", "queue_size", "timeout_ms", "in_flight",
+             "waiting", "admitted", "shed": { "queue_full", "timeout" } } },
+             либо { "enabled": false }
+    """
+    return jsonify(state.admission_stats())
 
 
 @views_blueprint.route('/clear_db', methods=['POST'])
 @log_requests_and_responses
 @handle_exceptions
+@admit("write")
 def clear_db():
     """
     Эндпоинт для очистки базы данных.
     """
     try:
-        clear_database()
+        state.cleared(clear_database())
         return jsonify({"message": "Database cleared successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def stream_documents(cursor):
+    """
+    Отдает документы курсора по одному в строке (NDJSON),
+    не собирая их в список.
+    """
+    for document in cursor:
+        yield json_line(document)
+
+
+def stream_raw_documents(cursor):
+    """
+    Отдает байты BSON документов курсора подряд, без разбора и кодирования.
+    """
+    for document in cursor:
+        yield document.raw
+
+
+def json_response(value):
+    """
+    JSON ответ, ObjectId записывается строкой.
+    """
+    return Response(json_body(value), mimetype="application/json")
+
+
+def cached_listing(get_all, find_page, projection):
+    """
+    Весь список JSON. Тело сериализуется (и сжимается gzip, если клиент
+    его принимает) один раз на поколение данных, см. view_support.listing_body
+    """
+    listing_cache = state.listing_cache
+    key, compress = listing_key(request)
+    version = listing_cache.version
+    body = listing_cache.get(key)
+    if body is MISSING:
+        documents = get_all() if projection is None else list(find_page(None, None, projection))
+        body = listing_body(documents, compress)
+        listing_cache.put_if_current(key, body, version)
+
+    response = Response(body, mimetype="application/json")
+    if compress:
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+def list_documents(get_all, find_page, allowed_fields):
+    """
+    Общая выдача для /templates и /indexes.
+
+    Параметры запроса:
+        без параметров: весь список JSON массивом.
+        after (string), limit (int): одна страница по возрастанию _id,
+            ответ { "items": [...], "next_after": <id последнего документа | null> }.
+        fields (string): только эти поля (и _id), через запятую, см. queries.listing_projection.
+        format=ndjson (или Accept: application/x-ndjson): поток документов
+            прямо из курсора, с учетом after, limit и fields.
+        format=bson (или Accept: application/bson): документы BSON подряд, байты
+            из MongoDB без разбора, с учетом after, limit и fields.
+
+    Для JSON и NDJSON документы разбирает драйвер (C расширение bson), а кодирует
+    json.dumps: значения вроде ObjectId все равно нужно перевести в JSON, а
+    разбор RawBSONDocument в Python был бы медленнее. Объем разбора уменьшает fields.
+
+    Ответ помечается ETag по поколению данных, на If-None-Match с ним же
+    возвращается 304, см. ViewState.listing_generation.
+
+    :args:
+        get_all (callable): () -> список всех документов
+        find_page (callable): (after, limit, projection, raw) -> курсор
+        allowed_fields (set): Поля, доступные в fields
+    """
+    try:
+        after, limit, projection = listing_args(request, allowed_fields)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    output = output_format(request)
+
+    generation = state.listing_generation()
+    if not_modified(request, generation):
+        return tagged(Response("", status=304), generation)
+
+    if output == "bson":
+        cursor = find_page(after, limit, projection, raw=True)
+        return tagged(Response(stream_with_context(stream_raw_documents(cursor)),
+                               mimetype="application/bson"), generation)
+
+    if output == "ndjson":
+        cursor = find_page(after, limit, projection)
+        return tagged(Response(stream_with_context(stream_documents(cursor)),
+                               mimetype="application/x-ndjson"), generation)
+
+    if after is None and limit is None:
+        if generation is not None:
+            return tagged(cached_listing(get_all, find_page, projection), generation)
+        documents = get_all() if projection is None else list(find_page(None, None, projection))
+
+        with stage("serialization"):
+            return json_response(documents)
+
+    limit = limit or Config.PAGE_SIZE
+    documents = list(find_page(after, limit, projection))
+    with stage("serialization"):
+        return tagged(json_response(page_result(documents, limit)), generation)
+
+
 @views_blueprint.route('/templates', methods=['GET'])
 @log_requests_and_responses
 @handle_exceptions
+@admit("read")
 def get_templates():
     """
     Эндпоинт для получения всех шаблонов.
+    Поддерживает постраничную и потоковую выдачу, см. list_documents.
     """
-    templates = get_all_form_templates()
-
-    # Преобразование ObjectId в строку
-    for template in templates:
-        template['_id'] = str(template['_id'])
-
-    return jsonify(templates)
+    return list_documents(get_all_form_templates, find_form_templates, TEMPLATE_FIELDS)
 
 
 @views_blueprint.route('/indexes', methods=['GET'])
 @log_requests_and_responses
 @handle_exceptions
+@admit("read")
 def get_indexes():
     """
     Эндпоинт для получения всех индексов.
+    Поддерживает постраничную и потоковую выдачу, см. list_documents.
     """
-    indexes = get_all_form_indexes()
-
-    # Преобразование ObjectId в строку
-    for index in indexes:
-        index['_id'] = str(index['_id'])
-
-    return jsonify(indexes)
+    return list_documents(get_all_form_indexes, find_form_indexes, INDEX_FIELDS)
 
 
 @views_blueprint.route('/create_template', methods=['POST'])
 @log_requests_and_responses
 @handle_exceptions
+@admit("write")
 def create_template():
     """
     Эндпоинт для создания нового шаблона.
@@ -189,51 +532,65 @@ def create_template():
         201: JSON объект с подтверждением создания
     """
     data = request.json
-    if not data:
-        return jsonify({"error": "Template data is required"}), 400
+    with stage("validation"):
+        template, warnings, error = parse_template(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-    template_name = data.get("name")
-    fields = data.get("fields")
+    template_id = create_form_template(dict(template))
+    # Обновляем индексы
+    generation = build_indexes(index_entries(template, template_id))
+    state.templates_added([template], [template_id], generation)
 
-    if not template_name:
-        return jsonify({"error": "Template name is required"}), 400
-    if not fields or not isinstance(fields, list):
-        return jsonify({"error": "Field list is required"}), 400
+    return jsonify(created_result(template, template_id, warnings)), 201
 
-    warnings = []
-    validated_fields = []
-    valid_types = {"date", "email", "phone", "text"}
 
-    for field in fields:
-        field_name = field.get("name")
-        field_type = field.get("type")
+@views_blueprint.route('/create_templates/bulk', methods=['POST'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("write")
+def create_templates_bulk():
+    """
+    Эндпоинт для создания сразу нескольких шаблонов.
+
+    Требования:
+        JSON массив шаблонов в формате /create_template, либо NDJSON
+        (Content-Type: application/x-ndjson)- по одному шаблону в строке.
 
-        if not field_name or not field_type:
-            # Пропускаем некорректные поля
-            warnings.append(f"Field {field} is missing a name or type")
-            continue
+    Возвращает:
+        201: JSON объект { "created": <int>, "templates": [...] }, где для каждого
+             шаблона по порядку { "template_id", "warnings", "fields" } или { "error" }
+        400: Если список шаблонов отсутствует или ни один шаблон не подходит.
+    """
+    if request.mimetype == "application/x-ndjson":
+        try:
+            items = parse_ndjson(request.get_data(as_text=True))
+        except ValueError as e:
+            return jsonify({"error": "Invalid NDJSON", "message": str(e)}), 400
+    else:
+        items = request.json
 
-        if field_type not in valid_types:
-            warnings.append(f"Field '{field_name}' has an invalid type ({field_type}). Skipped.")
-            continue
+    if not items or not isinstance(items, list):
+        return jsonify({"error": "Template list is required"}), 400
 
-        validated_fields.append({"name": field_name, "type": field_type})
-        # Обновляем индексы
-        build_index(field_name, field_type, {"name": template_name, "fields": validated_fields})
+    with stage("validation"):
+        templates, results = parse_templates(items)
+    if not templates:
+        return jsonify({"error": "No valid templates", "templates": results}), 400
 
-    template_id = create_form_template({"name": template_name, "fields": validated_fields})
+    template_ids = create_form_templates([dict(template) for template in templates])
+    generation = build_indexes([entry for template, template_id in zip(templates, template_ids)
+                                for entry in index_entries(template, template_id)])
 
-    return jsonify({
-        "message": "Template created",
-        "template_id": str(template_id),
-        "warnings": warnings,
-        "fields": validated_fields
-    }), 201
+    state.templates_added(templates, template_ids, generation)
+
+    return jsonify(bulk_result(templates, template_ids, results)), 201
 
 
 @views_blueprint.route('/get_form', methods=['POST'])
 @log_requests_and_responses
 @handle_exceptions
+@admit("read")
 def get_form():
     """
     Эндпоинт для поиска подходящего шаблона по полям формы.
@@ -250,41 +607,116 @@ def get_form():
     if not form_fields:
         return jsonify({"error": "Form fields are required"}), 400
 
-    # Хранение имен шаблонов для уникальности
-    template_names = set()
+    with stage("validation"):
+        result_form = classify_form(form_fields)
 
-    potential_template_name = ""
-    # Зранение количества полей текущего 'лучшего' шаблона
-    max_count_fields = 0
+    with stage("matching"):
+        potential_template_name = match_form(result_form)
 
-    result_form = {}
+    with stage("serialization"):
+        body, status = form_result(result_form, potential_template_name)
+        return jsonify(body), status
 
-    # Перебираем поля формы
-    for field_name, field_value in form_fields.items():
-        # Валидация полей
-        corrected_type = validate_field(field_value)
 
-        result_form[field_name] = corrected_type
+@views_blueprint.route('/get_form/batch', methods=['POST'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("read")
+def get_form_batch():
+    """
+    Эндпоинт для поиска подходящих шаблонов сразу для списка форм.
 
-    for field_name, field_type in result_form.items():
-        # Поиск шаблонов
-        matching_templates = find_templates_by_field(field_name, field_type)
+    Требования:
+        JSON массив форм: [{ "<field_name>": <value> }, ...].
 
-        if matching_templates:
-            for template in matching_templates:
-                # Проверяем уникальность имени шаблона и количество его полей
-                if (template["name"] not in template_names
-                        and len(template["fields"]) > max_count_fields):
+    Возвращает:
+        200: JSON массив в порядке форм, для каждой формы
+             { "status": <код /get_form>, "result": <ответ /get_form> }.
+        400: Если список форм отсутствует.
+    """
+    forms = request.json
+    if not forms or not isinstance(forms, list):
+        return jsonify({"error": "Form list is required"}), 400
+
+    # Формы без полей не участвуют в поиске, как и в /get_form
+    with stage("validation"):
+        result_forms = [classify_form(form) for form in forms
+                        if form and isinstance(form, dict)]
+    with stage("matching"):
+        template_names = match_forms(result_forms)
+    with stage("serialization"):
+        return jsonify(batch_results(forms, result_forms, template_names))
+
+
+@views_blueprint.route('/metrics', methods=['GET'])
+@handle_exceptions
+def metrics_route():
+    """
+    Эндпоинт с метриками в текстовом формате Prometheus: всех воркеров,
+    если задан Config.METRICS_MULTIPROCESS_DIR, иначе процесса, см. metrics.py
 
-                    template_names.add(template["name"])
-                    if check_fields(template, result_form):
-                        # обновляем результат
-                        potential_template_name = template["name"]
-                        max_count_fields = len(template["fields"])
+    Возвращает:
+        200: Гистограммы времени запросов по маршрутам и по этапам
+             (validation, matching, serialization, mongo), счетчик
+             просмотренных при подборе шаблонов.
+    """
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
-    # Если подходящий шаблон найден, возвращаем его
-    if potential_template_name:
-        return jsonify({"matching_template_name": potential_template_name})
 
-    # Если не нашли подходящий шаблон, возвращаем обработанные поля
-    return jsonify(result_form), 404
+@views_blueprint.route('/snapshot', methods=['GET'])
+@log_requests_and_responses
+@handle_exceptions
+@admit("read")
+def snapshot_route():
+    """
+    Эндпоинт для выгрузки снимка шаблонов и индексов, см. snapshot.py.
+    Восстановление- python snapshot.py restore <path>.
+
+    Возвращает:
+        200: Файл снимка (application/octet-stream)
+    """
+    descriptor, path = tempfile.mkstemp(suffix=".snapshot")
+    os.close(descriptor)
+    try:
+        export_snapshot(path)
+        # Файл удаляется сразу, ответ читает его через открытый дескриптор
+        file = open(path, "rb")
+    finally:
+        os.remove(path)
+    return send_file(file, mimetype="application/octet-stream",
+                     as_attachment=True, download_name="templates.snapshot")
+
+
+@views_blueprint.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Проверка живости процесса. Не обращается к базе данных.
+
+    Возвращает:
+        200: Процесс работает.
+        503: Попытки подключения к базе данных закончились, процесс нужно перезапустить.
+    """
+    if database_status() == "failed":
+        return jsonify({"status": "failed"}), 503
+    return jsonify({"status": "ok"})
+
+
+@views_blueprint.route('/readyz', methods=['GET'])
+def readyz():
+    """
+    Проверка готовности принимать запросы: MongoDB доступна, коллекции
+    и индексы созданы, кэши загружены.
+
+    Возвращает:
+        200: { "status": "ready" }
+        503: { "status": <starting|failed|unavailable>, ... }
+    """
+    status = database_status()
+    loaded = state.template_index.loaded
+    if status != "ready" or not loaded:
+        return jsonify({"status": status, "caches": loaded}), 503
+    try:
+        get_database().command("ping")
+    except Exception as e:
+        return jsonify({"status": "unavailable", "message": str(e)}), 503
+    return jsonify({"status": "ready"})